@@ -0,0 +1,174 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# === СБОРКА АЛЬБОМОВ (MEDIA GROUP) ===
+# Telegram присылает альбом отдельными сообщениями с общим media_group_id.
+# Все альбомы собирает один фоновый поток: группа уходит в обработку, когда
+# в нее ALBUM_QUIET секунд не приходило новых файлов, набралось ALBUM_MAX_ITEMS
+# файлов или она собирается дольше ALBUM_MAX_AGE. Ближайшие сроки лежат в куче,
+# поэтому поток спит ровно до следующего срока, а не опрашивает группы.
+# После stop() поток заново не запускается: опоздавший файл сразу уходит в
+# обработку отдельной группой.
+
+ALBUM_QUIET = float(os.environ.get('ALBUM_QUIET', '1.0'))
+ALBUM_MAX_AGE = float(os.environ.get('ALBUM_MAX_AGE', '10'))
+ALBUM_MAX_ITEMS = 10
+MAX_OPEN_GROUPS = 1000
+
+_STOP = object()
+
+
+class MediaGroup:
+    __slots__ = ('group_id', 'user', 'chat_id', 'caption', 'file_ids', 'file_unique_ids', 'file_types', 'created', 'updated')
+
+    def __init__(self, group_id, user, chat_id, now):
+        self.group_id = group_id
+        self.user = user
+        self.chat_id = chat_id
+        self.caption = None
+        self.file_ids = []
+        self.file_unique_ids = []
+        self.file_types = []
+        self.created = now
+        self.updated = now
+
+    @property
+    def media_type(self):
+        # Telegram смешивает в одном альбоме только фото и видео
+        kinds = set(self.file_types)
+        return kinds.pop() if len(kinds) == 1 else 'photo'
+
+    def add(self, media_type, file_id, file_unique_id, caption, now):
+        self.file_ids.append(file_id)
+        self.file_unique_ids.append(file_unique_id)
+        self.file_types.append(media_type)
+        if caption and not self.caption:
+            self.caption = caption
+        self.updated = now
+
+
+class MediaGroupAggregator:
+    def __init__(self, on_ready, quiet=ALBUM_QUIET, max_age=ALBUM_MAX_AGE, max_items=ALBUM_MAX_ITEMS):
+        self.on_ready = on_ready
+        self.quiet = quiet
+        self.max_age = max_age
+        self.max_items = max_items
+        self.flushed = 0
+        self.evicted = 0
+        self._groups = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def _deadline(self, group):
+        return min(group.updated + self.quiet, group.created + self.max_age)
+
+    def open_groups(self):
+        with self._cond:
+            return len(self._groups)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._start_thread()
+
+    def _start_thread(self):
+        self._thread = threading.Thread(target=self._run, name='albums', daemon=True)
+        self._thread.start()
+        logger.info(f"🖼 Сборщик альбомов запущен (тишина {self.quiet}с, максимум {self.max_items} файлов / {self.max_age}с)")
+
+    def add(self, group_id, user, chat_id, media_type, file_id, file_unique_id=None, caption=None):
+        now = time.monotonic()
+        ready = []
+        with self._cond:
+            if self._stopped:
+                group = MediaGroup(group_id, user, chat_id, now)
+                group.add(media_type, file_id, file_unique_id, caption, now)
+                late = group
+            else:
+                late = None
+                if self._thread is None:
+                    self._start_thread()
+                group = self._groups.get(group_id)
+                if group is None:
+                    if len(self._groups) >= MAX_OPEN_GROUPS:
+                        # Слишком много незакрытых альбомов: отдаем самый старый досрочно
+                        ready.append(self._groups.pop(next(iter(self._groups))))
+                        self.evicted += 1
+                    group = MediaGroup(group_id, user, chat_id, now)
+                    self._groups[group_id] = group
+                    heapq.heappush(self._heap, (self._deadline(group), next(self._seq), group_id))
+                    self._cond.notify()
+                group.add(media_type, file_id, file_unique_id, caption, now)
+                if len(group.file_ids) >= self.max_items:
+                    ready.append(self._groups.pop(group_id))
+        if late is not None:
+            logger.warning(f"⚠️ Файл альбома {group_id} пришел после остановки сборщика, обрабатывается отдельно")
+            ready.append(late)
+        for group in ready:
+            self._dispatch(group)
+
+    def stop(self, timeout=10):
+        with self._cond:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._stopped = True
+            self._heap.append((0, -1, _STOP))
+            heapq.heapify(self._heap)
+            self._cond.notify()
+        thread.join(timeout)
+        logger.info(f"🖼 Сборщик альбомов остановлен: обработано {self.flushed} альбомов")
+
+    def _due(self, now):
+        # Забирает из кучи группы, чей срок наступил; у остальных запись в куче
+        # обновляется: пока группа пополнялась, ее срок мог сдвинуться
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, group_id = heapq.heappop(self._heap)
+            if group_id is _STOP:
+                ready.extend(self._groups.values())
+                self._groups.clear()
+                self._heap.clear()
+                return ready, True
+            group = self._groups.get(group_id)
+            if group is None:
+                continue
+            deadline = self._deadline(group)
+            if deadline <= now:
+                ready.append(self._groups.pop(group_id))
+            else:
+                heapq.heappush(self._heap, (deadline, next(self._seq), group_id))
+        return ready, False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    ready, stopping = self._due(time.monotonic())
+                    if ready or stopping:
+                        break
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+            for group in ready:
+                self._dispatch(group)
+            if stopping:
+                return
+
+    def _dispatch(self, group):
+        with self._cond:
+            self.flushed += 1
+        try:
+            self.on_ready(group)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки альбома {group.group_id}: {e}")
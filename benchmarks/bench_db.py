@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import migrations
+
+# === БЕНЧМАРК: CONNECT-PER-CALL ПРОТИВ ПУЛА СОЕДИНЕНИЙ И ГРУППОВОЙ ЗАПИСИ ===
+# Запуск: python benchmarks/bench_db.py [кол-во операций] [потоков]
+
+OPERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+
+# Старый вариант: новое соединение на каждый вызов, как было в bot.py
+def legacy_insert(db_path, i):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO messages (user_id, user_name, username, message_text, message_type, file_id, file_type, timestamp, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')",
+        (i % 500, 'User', 'user', f"text {i}", 'text', None, None, datetime.now().isoformat())
+    )
+    message_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return message_id
+
+
+def legacy_get(db_path, message_id):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM messages WHERE id = ?", (message_id,))
+    message = cursor.fetchone()
+    conn.close()
+    return message
+
+
+def pooled_insert(db_path, i):
+    return db.insert_message(i % 500, 'User', 'user', 'text', f"text {i}")
+
+
+def pooled_get(db_path, message_id):
+    return db.get_message(message_id)
+
+
+def run_parallel(func, db_path, count, threads):
+    per_thread = count // threads
+
+    def worker(offset):
+        for i in range(offset, offset + per_thread):
+            func(db_path, i + 1)
+
+    workers = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    return per_thread * threads / elapsed
+
+
+def bench(name, insert, get, group_commit=False):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db.configure(db_path)
+        migrations.migrate()
+        if group_commit:
+            db.start_writer()
+        if insert is legacy_insert:
+            # Старый код не включал WAL, сравниваем с журналом по умолчанию
+            db.execute("PRAGMA journal_mode = DELETE")
+            db.close_all()
+
+        inserts = run_parallel(insert, db_path, OPERATIONS, THREADS)
+        lookups = run_parallel(get, db_path, OPERATIONS, THREADS)
+        db.stop_writer()
+        db.close_all()
+
+    print(f"{name:<20} вставок/с: {inserts:>10.0f}   чтений/с: {lookups:>10.0f}")
+    return inserts, lookups
+
+
+if __name__ == "__main__":
+    print(f"📊 Операций: {OPERATIONS}, потоков: {THREADS}")
+    legacy = bench('connect-per-call', legacy_insert, legacy_get)
+    pooled = bench('пул соединений', pooled_insert, pooled_get)
+    grouped = bench('пул + групп. запись', pooled_insert, pooled_get, group_commit=True)
+    print(f"⚡ Ускорение: вставки x{pooled[0] / legacy[0]:.1f}, чтения x{pooled[1] / legacy[1]:.1f}")
+    print(f"⚡ Групповая запись: вставки x{grouped[0] / legacy[0]:.1f}")
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import telebot
+from telebot import asyncio_helper
+
+from load_webhook import setup_environment, text_update
+
+# === СРАВНЕНИЕ ДВИЖКОВ: TeleBot (потоки) vs AsyncTeleBot ===
+# Оба движка обрабатывают одинаковую пачку текстовых сообщений против fake Bot API
+# с искусственной задержкой ответа. Меряется время до подтверждения последнему
+# пользователю и до последнего уведомления админам (они идут строго по порядку
+# в каждом админском чате, поэтому ограничены задержкой API × число сообщений).
+# Запуск: python benchmarks/bench_engines.py [обновлений] [задержка API, мс]
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+LATENCY_MS = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+
+class Progress(threading.Thread):
+    # Фиксирует два момента: все пользователи получили подтверждение
+    # и все админы получили уведомления
+    def __init__(self, fake, admin_ids):
+        super().__init__(daemon=True)
+        self.fake = fake
+        self.admins = {str(a) for a in admin_ids}
+        self.started = time.perf_counter()
+        self.acked = None
+        self.finished = None
+
+    def run(self):
+        deadline = time.monotonic() + 600
+        while time.monotonic() < deadline:
+            counts = dict(self.fake.recipients)
+            users = sum(v for k, v in counts.items() if k not in self.admins)
+            admins = sum(v for k, v in counts.items() if k in self.admins)
+            now = time.perf_counter() - self.started
+            if self.acked is None and users >= UPDATES:
+                self.acked = now
+            if users >= UPDATES and admins >= UPDATES * len(self.admins):
+                self.finished = now
+                return
+            time.sleep(0.002)
+
+
+def make_updates(first_id):
+    return [telebot.types.Update.de_json(text_update(first_id + i)) for i in range(UPDATES)]
+
+
+def run_threaded(bot, updates):
+    bot.bot.process_new_updates(updates)
+
+
+def run_async(bot_async, updates):
+    async def scenario():
+        await bot_async.abot.process_new_updates(updates)
+        while bot_async.background_tasks:
+            await asyncio.gather(*list(bot_async.background_tasks))
+        await bot_async.abot.close_session()
+
+    asyncio.run(scenario())
+
+
+def main():
+    fake = setup_environment(latency=LATENCY_MS / 1000)
+    os.environ['BOT_MODE'] = 'polling'
+    asyncio_helper.API_URL = fake.api_url
+
+    import bot
+    import bot_async
+
+    bot.init_db()
+    bot.db.start_writer()
+    bot.admin_notifier.start()
+
+    print(f"📊 Обновлений: {UPDATES}, задержка API: {LATENCY_MS:.0f} мс, админов: {len(bot.ADMIN_IDS)}")
+    for name, runner, module, first_id in (('threaded', run_threaded, bot, 1), ('async', run_async, bot_async, UPDATES + 1)):
+        updates = make_updates(first_id)
+        fake.calls.clear()
+        fake.recipients.clear()
+        progress = Progress(fake, bot.ADMIN_IDS)
+        progress.start()
+        runner(module, updates)
+        progress.join()
+        print(f"⚡ {name:<8}: подтверждения всем за {progress.acked:6.2f} с ({UPDATES / progress.acked:7.1f} updates/s), "
+              f"уведомления админам за {progress.finished:6.2f} с, вызовы API: {dict(fake.calls)}")
+
+    bot.shutdown()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import migrations
+
+# === БЕНЧМАРК: ЗАПРОСЫ ДО И ПОСЛЕ МИГРАЦИИ С ИНДЕКСАМИ ===
+# Запуск: python benchmarks/bench_indexes.py [кол-во строк]
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+USERS = 20_000
+REPEAT = 20
+INDEX_VERSION = 3
+
+# Запрос /pending в виде до миграции индексов: у db.SQL_SELECT_PENDING есть
+# столбцы, которых на этой версии схемы еще нет (repeats)
+SQL_SELECT_PENDING = (
+    "SELECT id, user_id, user_name, username, message_text, message_type, file_id, file_type, "
+    "timestamp, status, admin_reply, reply_sent, publish_type "
+    "FROM messages WHERE status = 'pending' ORDER BY id DESC LIMIT ?"
+)
+
+QUERIES = [
+    ('/pending (10 последних)', SQL_SELECT_PENDING, lambda: (10,)),
+    ('сообщения пользователя', "SELECT COUNT(*) FROM messages WHERE user_id = ?", lambda: (random.randrange(USERS),)),
+    ('за последний час', "SELECT COUNT(*) FROM messages WHERE timestamp >= ?",
+     lambda: ((datetime.now() - timedelta(hours=1)).isoformat(),)),
+    ('перезапуски', "SELECT COUNT(*) FROM bot_stats WHERE event_type = 'restart'", lambda: ()),
+]
+
+
+def fill(rows):
+    # Почти всё уже промодерировано, в очереди — малая доля, как в реальной базе
+    started = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / rows
+    statuses = ['approved'] * 70 + ['rejected'] * 25 + ['error'] * 4 + ['pending']
+    chunk = 50_000
+    for offset in range(0, rows, chunk):
+        batch = [
+            (random.randrange(USERS), 'User', 'user', f"text {i}", 'text', None, None,
+             (started + step * i).isoformat(), random.choice(statuses))
+            for i in range(offset, min(offset + chunk, rows))
+        ]
+        with db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO messages (user_id, user_name, username, message_text, message_type, file_id, file_type, timestamp, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                batch
+            )
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO bot_stats (event_type, event_time, details) VALUES (?, ?, '')",
+            [(random.choice(['start', 'error', 'restart']), datetime.now().isoformat()) for _ in range(rows // 10)]
+        )
+
+
+def measure():
+    results = {}
+    for name, sql, params in QUERIES:
+        started = time.perf_counter()
+        for _ in range(REPEAT):
+            db.fetchall(sql, params())
+        results[name] = (time.perf_counter() - started) / REPEAT * 1000
+    return results
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, 'bench.db'))
+        migrations.migrate(target=INDEX_VERSION - 1)
+
+        print(f"📥 Заполняем {ROWS} строк...")
+        started = time.perf_counter()
+        fill(ROWS)
+        print(f"   готово за {time.perf_counter() - started:.1f}с")
+
+        before = measure()
+        started = time.perf_counter()
+        migrations.migrate()
+        print(f"🧱 Миграция индексов: {time.perf_counter() - started:.1f}с")
+        after = measure()
+        db.close_all()
+
+    print(f"{'запрос':<26}{'до, мс':>12}{'после, мс':>12}{'ускорение':>12}")
+    for name, _, _ in QUERIES:
+        print(f"{name:<26}{before[name]:>12.3f}{after[name]:>12.3f}{before[name] / after[name]:>11.0f}x")
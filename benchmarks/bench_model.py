@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import migrations
+
+# === МИКРОБЕНЧМАРК: КОРТЕЖИ + СЛОВАРЬ ПРОТИВ Submission ===
+# Сравнивает путь callback'а «загрузить заявку и собрать данные для публикации»:
+# старый — кортеж из 14 полей, позиционная распаковка и словарь message_data_for_send;
+# новый — Submission из row factory с атрибутами и файлами.
+# Печатает время на callback и память на одну загруженную заявку.
+# Запуск: python benchmarks/bench_model.py [итераций]
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+RETAINED = 10000
+
+
+def legacy_load(message_id):
+    rows = db.fetchall(db.SQL_SELECT_MESSAGE, (message_id,))
+    files = [(row[14], row[15]) for row in rows if row[14] is not None]
+    return (*rows[0][:13], files)
+
+
+def legacy_payload(message_data):
+    msg_id, user_id, user_name, username, text, msg_type, file_id, file_type, timestamp, status, admin_reply, reply_sent, publish_type, files = message_data
+    return {
+        'message_type': msg_type,
+        'text': text,
+        'file_id': file_id,
+        'file_ids': [f_id for f_id, _ in files],
+        'file_types': [f_type for _, f_type in files]
+    }, status
+
+
+def legacy_callback(message_id):
+    payload, status = legacy_payload(legacy_load(message_id))
+    return payload['message_type'], payload['text'], payload['file_ids'], payload['file_types'], status
+
+
+def model_load(message_id):
+    # Мимо кэша заявок: меряем запрос, row factory и модель, а не попадание в LRU
+    return db.get_message(message_id, fresh=True)
+
+
+def model_callback(message_id):
+    submission = model_load(message_id)
+    return submission.message_type, submission.text, submission.file_ids, submission.file_types, submission.status
+
+
+def legacy_pending():
+    return [(msg[0], msg[2], msg[4], msg[5]) for msg in db.fetchall(db.SQL_SELECT_PENDING, (10,))]
+
+
+def model_pending():
+    return [(s.id, s.user_name, s.text, s.message_type) for s in db.get_pending(10)]
+
+
+def per_call(func, arg=None):
+    started = time.perf_counter()
+    for i in range(ITERATIONS):
+        func(arg if arg is not None else 1 + i % 100)
+    return (time.perf_counter() - started) / ITERATIONS * 1e6
+
+
+def retained_bytes(loader):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [loader(1 + i % 100) for i in range(RETAINED)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size / RETAINED
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, 'bench.db'))
+        migrations.migrate()
+        for i in range(100):
+            files = [(f"file{i}_{n}", f"u{i}_{n}", 'photo') for n in range(1 + i % 4)]
+            db.insert_message(i, 'User', 'user', 'photo', f"Подпись {i}", files)
+
+        print(f"📊 Итераций: {ITERATIONS}")
+        print(f"⏱ callback публикации: кортеж+dict {per_call(legacy_callback):6.1f} мкс, Submission {per_call(model_callback):6.1f} мкс")
+        print(f"⏱ /pending (10 строк): кортежи {per_call(lambda _: legacy_pending(), 0):6.1f} мкс, Submission {per_call(lambda _: model_pending(), 0):6.1f} мкс")
+        print(f"💾 Память на загруженную заявку: кортеж {retained_bytes(legacy_load):6.0f} Б, Submission {retained_bytes(model_load):6.0f} Б")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+import sys
+import random
+import tempfile
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import migrations
+import pacing
+
+# === СИМУЛЯЦИЯ РАСПИСАНИЯ ПУБЛИКАЦИЙ ===
+# Админы разом одобряют очередь заявок (80% одиночных, 20% альбомов по 2–5 файлов),
+# дальше публикации выпускаются через настоящие db.take_job и pacing.Pacer на
+# виртуальных часах, поэтому часы симуляции проходят за секунды. Канал моделирует
+# лимит Telegram: больше CHANNEL_LIMIT сообщений за скользящие 60 с — ответ 429
+# (планировщик исходящих запросов здесь не участвует, проверяется само расписание).
+# Печатает длительность, публикации и сообщения в минуту, пик за минуту и число 429.
+# Запуск: python benchmarks/bench_pacing.py [заявок]
+
+SUBMISSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CHANNEL_LIMIT = 20
+TICK = 0.5
+CONFIGS = (
+    ('без расписания', pacing.Pacer(interval=0)),
+    ('интервал 3 с', pacing.Pacer(interval=3)),
+    ('интервал 6 с', pacing.Pacer(interval=6)),
+    ('интервал 60 с', pacing.Pacer(interval=60)),
+)
+
+
+class Channel:
+    def __init__(self):
+        self.window = deque()
+        self.messages = 0
+        self.rate_limited = 0
+        self.peak = 0
+
+    def post(self, now, count):
+        for _ in range(count):
+            while self.window and self.window[0] <= now - 60:
+                self.window.popleft()
+            if len(self.window) >= CHANNEL_LIMIT:
+                self.rate_limited += 1
+                continue
+            self.window.append(now)
+            self.messages += 1
+            self.peak = max(self.peak, len(self.window))
+
+
+def fill_queue():
+    rng = random.Random(42)
+    for i in range(SUBMISSIONS):
+        if rng.random() < 0.2:
+            files = [(f"file{i}_{n}", f"u{i}_{n}", 'photo') for n in range(rng.randint(2, 5))]
+            message_id = db.insert_message(i, 'User', 'user', 'photo', f"Альбом {i}", files)
+        else:
+            message_id = db.insert_message(i, 'User', 'user', 'text', f"Текст {i}")
+        db.enqueue_publish(message_id, 1, 'normal')
+
+
+def simulate(pacer):
+    start = 1_000_000.0
+    now = start
+    channel = Channel()
+    posts = 0
+    while True:
+        job = db.take_job(pacer.next_release, now=now)
+        if job is None:
+            if db.next_job_time(pacer.next_release) is None:
+                break
+            now += TICK
+            continue
+        count = max(1, len(db.get_files(job.message_id)))
+        channel.post(now, count)
+        db.finish_job(job, True)
+        posts += 1
+    return max(now - start, 60.0), posts, channel
+
+
+def main():
+    print(f"📊 Заявок: {SUBMISSIONS}, лимит канала: {CHANNEL_LIMIT} сообщений/мин")
+    for name, pacer in CONFIGS:
+        with tempfile.TemporaryDirectory() as tmp:
+            db.configure(os.path.join(tmp, 'bench.db'))
+            migrations.migrate()
+            fill_queue()
+            duration, posts, channel = simulate(pacer)
+            minutes = duration / 60
+            print(f"🗓 {name:<15}: {minutes:7.1f} мин, {posts / minutes:5.1f} публикаций/мин, "
+                  f"{channel.messages / minutes:5.1f} сообщений/мин, пик {channel.peak:3d} за минуту, 429: {channel.rate_limited}")
+            db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import os
+import re
+import sys
+import time
+import random
+import signal
+import resource
+import itertools
+import threading
+import tempfile
+import subprocess
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram
+
+# === МАСШТАБИРОВАНИЕ ПО ПРОЦЕССАМ (BOT_PROCESSES) ===
+# bot.py запускается отдельным процессом (как в проде: python bot.py) против
+# fake Bot API этого процесса (BOT_API_URL) с BOT_PROCESSES = 1, 2, 4...
+# В getUpdates сразу кладется пачка обновлений от USERS пользователей: тексты,
+# фото и альбомы; меряется время до подтверждения последнему пользователю.
+# Пропускная способность сравнивается с первым прогоном (обычно BOT_PROCESSES=1,
+# один процесс с пулом потоков TeleBot). Заодно проверяется, что шардирование
+# ничего не ломает: уведомления первому админу о текстах и фото одного
+# пользователя идут в порядке отправки, а каждый альбом подтверждается один раз.
+# Альбомы в проверку порядка не входят: их уведомление по замыслу ждет ALBUM_QUIET.
+# CPU — суммарное время процессора бота и его воркеров (RUSAGE_CHILDREN).
+# Прирост от процессов ограничен числом ядер: на одном ядре он возможен,
+# только пока обработка ждет сеть, а не процессор.
+# Запуск: python benchmarks/bench_scaling.py [обновлений] [процессы через запятую] [задержка API, мс]
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+PROCESSES = [int(n) for n in (sys.argv[2] if len(sys.argv) > 2 else '1,2,4').split(',')]
+LATENCY_MS = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+USERS = 200
+USER_BASE = 300_000
+MIX = (('text', 0.7), ('photo', 0.2), ('album', 0.1))
+START_TIMEOUT = 30
+DRAIN_TIMEOUT = 120
+MARKER = re.compile(r'u(\d+)s(\d+)#')
+ALBUM_MARKER = re.compile(r'u\d+a\d+#')
+
+
+class Tracker:
+    def __init__(self, admin_id):
+        self.admin_id = str(admin_id)
+        self.lock = threading.Lock()
+        self.acks = 0
+        self.expected = 0
+        self.last_ack = None
+        self.last_seen = {}
+        self.out_of_order = 0
+        self.notified = 0
+        self.albums = 0
+
+    def observe(self, method, params, result):
+        chat_id = str(params.get('chat_id', ''))
+        with self.lock:
+            if chat_id == self.admin_id:
+                # Первое вхождение — подпись заявки (у альбома она в первом элементе)
+                body = str(params.get('text') or params.get('caption') or params.get('media') or '')
+                match = MARKER.search(body)
+                if ALBUM_MARKER.search(body):
+                    self.albums += 1
+                    self.notified += 1
+                elif match:
+                    user, seq = int(match.group(1)), int(match.group(2))
+                    if seq < self.last_seen.get(user, -1):
+                        self.out_of_order += 1
+                    self.last_seen[user] = max(seq, self.last_seen.get(user, -1))
+                    self.notified += 1
+            elif method == 'sendMessage' and chat_id.isdigit() and int(chat_id) >= USER_BASE:
+                self.acks += 1
+                self.last_ack = time.perf_counter()
+
+
+def message(update_id, user_id, **content):
+    body = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f"user{user_id}"},
+    }
+    body.update((key, value) for key, value in content.items() if value is not None)
+    return {'update_id': update_id, 'message': body}
+
+
+def photo(update_id):
+    return [{'file_id': f"photo{update_id}", 'file_unique_id': f"uphoto{update_id}", 'width': 1280, 'height': 960}]
+
+
+def build_updates(update_ids):
+    # → (обновления, ожидаемых подтверждений); у каждого пользователя свой счетчик seq
+    rng = random.Random(11)
+    seqs = Counter()
+    updates = []
+    acks = 0
+    while len(updates) < UPDATES:
+        user_id = USER_BASE + rng.randrange(USERS)
+        kind = rng.choices([name for name, _ in MIX], [share for _, share in MIX])[0]
+        marker = f"u{user_id}s{seqs[user_id]}#"
+        seqs[user_id] += 1
+        if kind == 'text':
+            update_id = next(update_ids)
+            updates.append(message(update_id, user_id, text=f"Анонимное сообщение {marker} " + "текст " * rng.randint(1, 40)))
+        elif kind == 'photo':
+            update_id = next(update_ids)
+            updates.append(message(update_id, user_id, photo=photo(update_id), caption=f"Фото {marker}"))
+        else:
+            marker = f"u{user_id}a{seqs[user_id]}#"
+            for n in range(rng.randint(2, 5)):
+                update_id = next(update_ids)
+                updates.append(message(update_id, user_id, photo=photo(update_id), media_group_id=f"album{update_id - n}",
+                                       caption=f"Альбом {marker}" if n == 0 else None))
+        acks += 1
+    return updates, acks
+
+
+def wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def run(fake, processes, update_ids):
+    data_dir = os.path.join(os.environ['DATA_DIR'], f"p{processes}")
+    os.makedirs(data_dir, exist_ok=True)
+    env = dict(os.environ, BOT_PROCESSES=str(processes), DATA_DIR=data_dir, LOG_LEVEL='WARNING')
+    tracker = Tracker(int(env['ADMIN_IDS'].split(',')[0]))
+    fake.observers[:] = [tracker.observe]
+    fake.calls.clear()
+
+    cpu_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started_at = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'bot.py')], env=env, cwd=data_dir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if not wait_for(lambda: fake.calls.get('getUpdates', 0) > 1 or proc.poll() is not None, START_TIMEOUT):
+        proc.kill()
+        raise RuntimeError("бот не начал polling")
+    ready = time.perf_counter() - started_at
+    # Воркеры поднимаются параллельно с первым getUpdates: даем им загрузиться
+    time.sleep(1 + 0.3 * processes)
+
+    updates, tracker.expected = build_updates(update_ids)
+    started = time.perf_counter()
+    for update in updates:
+        fake.push_update(update)
+    wait_for(lambda: tracker.acks >= tracker.expected, DRAIN_TIMEOUT)
+    elapsed = (tracker.last_ack or time.perf_counter()) - started
+    wait_for(lambda: tracker.notified >= tracker.expected, 10)
+
+    proc.send_signal(signal.SIGTERM)
+    try:
+        _, stderr = proc.communicate(timeout=60)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        _, stderr = proc.communicate()
+    cpu_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (cpu_after.ru_utime + cpu_after.ru_stime) - (cpu_before.ru_utime + cpu_before.ru_stime)
+    errors = [line for line in stderr.splitlines() if 'Traceback' in line or 'ERROR' in line]
+    return {
+        'processes': processes,
+        'ready': ready,
+        'elapsed': elapsed,
+        'throughput': tracker.acks / elapsed,
+        'acks': tracker.acks,
+        'expected': tracker.expected,
+        'notified': tracker.notified,
+        'albums': tracker.albums,
+        'out_of_order': tracker.out_of_order,
+        'cpu_per_update_ms': cpu / len(updates) * 1000,
+        'updates': len(updates),
+        'errors': errors,
+    }
+
+
+def main():
+    fake = FakeTelegram(latency=LATENCY_MS / 1000, jitter=LATENCY_MS / 2000).start()
+    os.environ.update({
+        'BOT_TOKEN': '123456:SCALE-TEST',
+        'ADMIN_IDS': '1001,1002',
+        'CHANNEL_USERNAME': '@load_test_channel',
+        'DATA_DIR': tempfile.mkdtemp(prefix='bot-scale-'),
+        'BOT_MODE': 'polling',
+        'BOT_API_URL': fake.api_url,
+        'PUBLISH_INTERVAL': '0',
+        'ALBUM_QUIET': '0.3',
+        # Fake API не ограничивает частоту, поэтому снимаем лимиты планировщика
+        'OUTBOUND_GLOBAL_RATE': '1000000',
+        'OUTBOUND_PRIVATE_RATE': '1000000',
+        'OUTBOUND_GROUP_RATE_PER_MIN': '1000000',
+        # Заявки пользователей приходят пачкой разом: защиту от флуда выключаем
+        'FLOOD_LIMITS': '',
+    })
+    update_ids = itertools.count(1)
+
+    print(f"📊 Обновлений: {UPDATES} от {USERS} пользователей, задержка API {LATENCY_MS:g} мс, ядер: {os.cpu_count()}")
+    results = []
+    for processes in PROCESSES:
+        result = run(fake, processes, update_ids)
+        results.append(result)
+        base = results[0]['throughput']
+        print(
+            f"   BOT_PROCESSES={processes:<3} {result['throughput']:7.1f} заявок/с (x{result['throughput'] / base:.2f}), "
+            f"{result['elapsed']:.1f} с, CPU {result['cpu_per_update_ms']:.2f} мс/обновление, "
+            f"polling через {result['ready'] * 1000:.0f} мс"
+        )
+        print(
+            f"      подтверждений {result['acks']}/{result['expected']}, уведомлений админу {result['notified']} (альбомов {result['albums']}), "
+            f"нарушений порядка {result['out_of_order']}, ошибок в логе {len(result['errors'])}"
+        )
+        for line in result['errors'][:3]:
+            print(f"      {line}")
+
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
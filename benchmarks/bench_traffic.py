@@ -0,0 +1,289 @@
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import logging
+import itertools
+import threading
+from collections import Counter, defaultdict, deque
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telebot import asyncio_helper
+
+import metrics
+from load_webhook import setup_environment, percentile
+
+# === ВОСПРОИЗВЕДЕНИЕ ТРАФИКА ЧЕРЕЗ FAKE BOT API ===
+# Бот целиком (polling, обработчики, SQLite, планировщик исходящих, очередь
+# публикаций) работает против локального fake Bot API. Генератор кладет
+# обновления в getUpdates пуассоновским потоком заданной интенсивности, смесь
+# типичная для бота: тексты, фото, альбомы по 2–5 фото и нажатия админов на кнопки
+# уведомлений (просмотр, публикация, отклонение) — только по заявкам, уведомления
+# о которых админы уже получили. Задержка end-to-end — от появления обновления
+# в getUpdates до ответа бота: подтверждения пользователю (для альбома включает
+# ALBUM_QUIET) или answerCallbackQuery для кнопок.
+# Печатает пропускную способность, p50/p99 по типам, вызовы Bot API и операции
+# SQLite (гистограмма bot_db_seconds) на одно обновление и внедренные ошибки.
+# Запуск: python benchmarks/bench_traffic.py [обновлений] [обновлений/с] [задержка API, мс] [% 429] [% 5xx] [threaded|async]
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+RATE = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+LATENCY_MS = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+RATE_429 = float(sys.argv[4]) / 100 if len(sys.argv) > 4 else 0.0
+RATE_5XX = float(sys.argv[5]) / 100 if len(sys.argv) > 5 else 0.0
+ENGINE = sys.argv[6] if len(sys.argv) > 6 else 'threaded'
+
+USERS = 1000
+MIX = (('text', 0.55), ('photo', 0.2), ('album', 0.1), ('callback', 0.15))
+CALLBACK_MIX = (('view', 0.2), ('publish_normal', 0.4), ('reject', 0.4))
+DRAIN_TIMEOUT = 15
+KEYBOARD_ID = re.compile(r'publish_normal_(\d+)')
+
+
+class Tracker:
+    # Сопоставляет ответы fake API с ожидающими обновлениями
+    def __init__(self, admin_ids):
+        self.admins = {str(a) for a in admin_ids}
+        self.lock = threading.Lock()
+        self.chats = defaultdict(deque)
+        self.callbacks = {}
+        self.notified = []
+        self.latencies = defaultdict(list)
+        self.pushed = Counter()
+        self.completed = 0
+        self.outstanding = 0
+        self.last_completed = None
+
+    def expect_chat(self, kind, user_id, count=1):
+        with self.lock:
+            self.chats[str(user_id)].append((kind, time.perf_counter(), count))
+            self.pushed[kind] += count
+            self.outstanding += count
+
+    def expect_callback(self, kind, callback_id):
+        with self.lock:
+            self.callbacks[callback_id] = (kind, time.perf_counter())
+            self.pushed[kind] += 1
+            self.outstanding += 1
+
+    def take_notification(self):
+        with self.lock:
+            if not self.notified:
+                return None
+            return self.notified.pop(random.randrange(len(self.notified)))
+
+    def _done(self, kind, started, count):
+        now = time.perf_counter()
+        self.latencies[kind].append((now - started) * 1000)
+        self.completed += count
+        self.outstanding -= count
+        self.last_completed = now
+
+    def observe(self, method, params, result):
+        chat_id = str(params.get('chat_id', ''))
+        with self.lock:
+            if method == 'answerCallbackQuery':
+                entry = self.callbacks.pop(str(params.get('callback_query_id')), None)
+                if entry is not None:
+                    self._done(entry[0], entry[1], 1)
+            elif chat_id in self.admins:
+                match = KEYBOARD_ID.search(str(params.get('reply_markup', '')))
+                if match and isinstance(result, dict):
+                    self.notified.append((int(match.group(1)), int(chat_id), result['message_id']))
+            elif method == 'sendMessage' and self.chats.get(chat_id):
+                self._done(*self.chats[chat_id].popleft())
+
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f"user{user_id}"}
+
+
+def message(update_id, user_id, **content):
+    body = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': user(user_id),
+    }
+    body.update((key, value) for key, value in content.items() if value is not None)
+    return {'update_id': update_id, 'message': body}
+
+
+def photo(update_id):
+    return [{'file_id': f"photo{update_id}", 'file_unique_id': f"uphoto{update_id}", 'width': 1280, 'height': 960}]
+
+
+def pick(rng, mix):
+    roll = rng.random()
+    for name, share in mix:
+        roll -= share
+        if roll < 0:
+            return name
+    return mix[-1][0]
+
+
+def generate(fake, tracker):
+    rng = random.Random(7)
+    update_ids = itertools.count(1)
+    sent = 0
+    next_at = time.perf_counter()
+    while sent < UPDATES:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        kind = pick(rng, MIX)
+        notification = tracker.take_notification() if kind == 'callback' else None
+        if kind == 'callback' and notification is None:
+            kind = 'text'
+        user_id = 20_000 + rng.randrange(USERS)
+
+        if kind == 'text':
+            update_id = next(update_ids)
+            updates = [message(update_id, user_id, text=f"Анонимное сообщение {update_id} " + "текст " * rng.randint(1, 60))]
+            tracker.expect_chat(kind, user_id)
+        elif kind == 'photo':
+            update_id = next(update_ids)
+            updates = [message(update_id, user_id, photo=photo(update_id), caption=rng.choice((None, f"Подпись {update_id}")))]
+            tracker.expect_chat(kind, user_id)
+        elif kind == 'album':
+            group_id = f"album{sent}"
+            updates = []
+            for n in range(rng.randint(2, 5)):
+                update_id = next(update_ids)
+                updates.append(message(update_id, user_id, photo=photo(update_id), media_group_id=group_id,
+                                       caption=f"Альбом {group_id}" if n == 0 else None))
+            tracker.expect_chat(kind, user_id, len(updates))
+        else:
+            message_id, admin_id, admin_message_id = notification
+            update_id = next(update_ids)
+            action = pick(rng, CALLBACK_MIX)
+            kind = f"callback:{action}"
+            updates = [{
+                'update_id': update_id,
+                'callback_query': {
+                    'id': str(update_id),
+                    'from': user(admin_id),
+                    'chat_instance': '1',
+                    'data': f"{action}_{message_id}",
+                    'message': {
+                        'message_id': admin_message_id,
+                        'date': int(time.time()),
+                        'chat': {'id': admin_id, 'type': 'private'},
+                        'text': f"Заявка #{message_id}",
+                    },
+                },
+            }]
+            tracker.expect_callback(kind, str(update_id))
+
+        for update in updates:
+            fake.push_update(update)
+        sent += len(updates)
+        # Альбом приходит пачкой, но интенсивность считается в обновлениях
+        next_at += rng.expovariate(RATE) * len(updates)
+
+
+def start_threaded(bot):
+    bot.album_workers.start()
+    bot.album_aggregator.start()
+    bot.publish_workers.start()
+    thread = threading.Thread(target=bot.bot.infinity_polling, kwargs={'skip_pending': True, 'long_polling_timeout': 1}, daemon=True)
+    thread.start()
+
+    def stop():
+        bot.bot.stop_polling()
+        thread.join(5)
+    return stop
+
+
+def start_async(bot):
+    import bot_async
+
+    thread = threading.Thread(target=lambda: asyncio.run(bot_async.polling()), daemon=True)
+    thread.start()
+
+    def stop():
+        # У AsyncTeleBot нет stop_polling: цикл polling проверяет этот флаг
+        bot_async.abot._polling = False
+        thread.join(10)
+    return stop
+
+
+def settle(fake, quiet=1.0):
+    # Уведомления админам и публикации идут фоном после ответа пользователю:
+    # ждем, пока вызовы API (кроме getUpdates) перестанут появляться
+    last, changed = None, time.monotonic()
+    while time.monotonic() - changed < quiet:
+        total = sum(count for method, count in fake.calls.items() if method != 'getUpdates')
+        if total != last:
+            last, changed = total, time.monotonic()
+        time.sleep(0.05)
+
+
+def db_operations():
+    return Counter({values[0]: state[-1] for (name, values), state in metrics._collect().items() if name == 'bot_db_seconds'})
+
+
+def per_update(counts, updates):
+    return ", ".join(f"{name} {count / updates:.2f}" for name, count in counts.most_common())
+
+
+def main():
+    fake = setup_environment(latency=LATENCY_MS / 1000, jitter=LATENCY_MS / 2000, rate_429=RATE_429, rate_5xx=RATE_5XX)
+    os.environ.update({'BOT_MODE': 'polling', 'PUBLISH_INTERVAL': '0'})
+    asyncio_helper.API_URL = fake.api_url
+
+    import bot
+
+    # Ошибки видны, INFO/WARNING на каждое обновление — нет
+    logging.disable(logging.WARNING)
+    bot.init_db()
+    bot.db.start_writer()
+    bot.admin_notifier.start()
+
+    tracker = Tracker(bot.ADMIN_IDS)
+    fake.observers.append(tracker.observe)
+    stop = start_async(bot) if ENGINE == 'async' else start_threaded(bot)
+    time.sleep(1)
+
+    fake.calls.clear()
+    fake.injected.clear()
+    db_before = db_operations()
+    started = time.perf_counter()
+    generate(fake, tracker)
+    generated = time.perf_counter()
+
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while tracker.outstanding > 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    elapsed = (tracker.last_completed or time.perf_counter()) - started
+    settle(fake)
+    db_ops = db_operations() - db_before
+    api_calls = Counter(fake.calls)
+    polls = api_calls.pop('getUpdates', 0)
+
+    stop()
+
+    pushed = sum(tracker.pushed.values())
+    all_latencies = [value for values in tracker.latencies.values() for value in values]
+    print(f"📊 Обновлений: {pushed} за {generated - started:.1f} с ({RATE:g}/с), движок: {ENGINE}, "
+          f"смесь: {dict(tracker.pushed)}")
+    print(f"📡 Fake API: задержка {LATENCY_MS:g}–{LATENCY_MS * 1.5:g} мс, 429: {RATE_429:.1%}, 5xx: {RATE_5XX:.1%}, "
+          f"внедрено ошибок: {dict(fake.injected)}")
+    print(f"⚡ Пропускная способность: {tracker.completed / elapsed:.1f} updates/s, без ответа: {tracker.outstanding}")
+    print(f"⏱ End-to-end: p50 {percentile(all_latencies, 0.5):.0f} мс, p99 {percentile(all_latencies, 0.99):.0f} мс")
+    for kind, values in sorted(tracker.latencies.items()):
+        print(f"   {kind:<24} n={len(values):<5} p50 {percentile(values, 0.5):7.0f} мс, p99 {percentile(values, 0.99):7.0f} мс")
+    print(f"📨 Bot API на обновление: {sum(api_calls.values()) / pushed:.2f} ({per_update(api_calls, pushed)}), getUpdates: {polls}")
+    print(f"🗄 SQLite на обновление: {sum(db_ops.values()) / pushed:.2f} ({per_update(db_ops, pushed)})")
+
+    bot.shutdown()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import sys
+import json
+import socket
+import time
+import random
+import itertools
+import threading
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# === ЛОКАЛЬНЫЙ FAKE BOT API ===
+# Минимальная замена api.telegram.org для бенчмарков: отвечает на методы,
+# которые вызывает bot.py, и считает вызовы. Подключение:
+#     server = FakeTelegram().start()
+#     telebot.apihelper.API_URL = server.api_url
+# latency — искусственная задержка ответа (сек), имитирует сетевой RTT до Telegram,
+# jitter — случайная добавка к ней (0..jitter сек).
+# rate_429 / rate_5xx — доля запросов, на которые вместо ответа приходит
+# 429 Too Many Requests (с retry_after) или 502 Bad Gateway; getMe и getUpdates
+# не сбоят, иначе бенчмарк мерил бы паузы перезапуска polling.
+# push_update() кладет обновление в очередь, которую бот забирает через getUpdates
+# (long polling с offset, как у Telegram). observers — функции
+# observer(method, params, result), вызываются после каждого успешного ответа.
+
+RELIABLE_METHODS = frozenset(('getMe', 'getUpdates', 'getWebhookInfo', 'deleteWebhook', 'setWebhook'))
+
+
+class _Server(ThreadingHTTPServer):
+    # Стандартный backlog (5) не выдерживает сотни параллельных соединений
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Бот закрыл соединение long polling при остановке — не ошибка
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeTelegram:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, rate_429=0.0, rate_5xx=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.recipients = Counter()
+        self.injected = Counter()
+        self.observers = []
+        self._lock = threading.Lock()
+        self._updates = deque()
+        self._updates_ready = threading.Condition()
+        self._random = random.Random(42)
+        self._message_ids = itertools.count(1000)
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def api_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-telegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def push_update(self, update):
+        with self._updates_ready:
+            self._updates.append(update)
+            self._updates_ready.notify_all()
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = min(float(params.get('timeout') or 0), 0.5)
+        with self._updates_ready:
+            if offset < 0:
+                # skip_pending: последнее обновление без подтверждения остальных
+                return list(self._updates)[offset:]
+            # Подтвержденные (update_id < offset) Telegram больше не отдает
+            while self._updates and self._updates[0]['update_id'] < offset:
+                self._updates.popleft()
+            if not self._updates and timeout > 0:
+                self._updates_ready.wait(timeout)
+            return list(itertools.islice(self._updates, limit))
+
+    def _delay(self):
+        delay = self.latency
+        if self.jitter:
+            with self._lock:
+                delay += self._random.uniform(0, self.jitter)
+        return delay
+
+    def _injected_error(self, method):
+        if method in RELIABLE_METHODS or not (self.rate_429 or self.rate_5xx):
+            return None
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.rate_429:
+            error = (429, {'ok': False, 'error_code': 429, 'description': f"Too Many Requests: retry after {self.retry_after}",
+                           'parameters': {'retry_after': self.retry_after}})
+        elif roll < self.rate_429 + self.rate_5xx:
+            error = (502, {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'})
+        else:
+            return None
+        with self._lock:
+            self.injected[error[0]] += 1
+        return error
+
+    def _message(self, params):
+        chat_id = params.get('chat_id', 0)
+        try:
+            chat_id = int(chat_id)
+            chat = {'id': chat_id, 'type': 'private' if chat_id > 0 else 'channel'}
+        except (TypeError, ValueError):
+            chat = {'id': -1001, 'type': 'channel', 'username': str(chat_id).lstrip('@')}
+        return {'message_id': next(self._message_ids), 'date': int(time.time()), 'chat': chat}
+
+    def respond(self, method, params):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method == 'getChat':
+            return {'id': -1001, 'type': 'channel', 'title': 'Fake Channel'}
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': len(self._updates)}
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'sendMediaGroup':
+            media = params.get('media') or '[]'
+            count = len(json.loads(media)) if isinstance(media, str) else len(media)
+            return [self._message(params) for _ in range(max(1, count))]
+        if method.startswith('send') or method in ('copyMessage', 'forwardMessage'):
+            return self._message(params)
+        if method.startswith('edit'):
+            return self._message(params)
+        return True
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Без TCP_NODELAY заголовки и тело уходят разными пакетами и ловят delayed ACK (~40 мс)
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def _params(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                content_type = self.headers.get('Content-Type', '')
+                if 'json' in content_type and body:
+                    return json.loads(body)
+                if 'x-www-form-urlencoded' in content_type or '?' in self.path:
+                    raw = body.decode() if body else self.path.split('?', 1)[-1]
+                    return {k: v[0] for k, v in parse_qs(raw).items()}
+                return {}
+
+            def _handle(self):
+                method = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+                params = self._params()
+                if method != 'getUpdates':
+                    delay = fake._delay()
+                    if delay:
+                        time.sleep(delay)
+                with fake._lock:
+                    fake.calls[method] += 1
+                error = fake._injected_error(method)
+                if error is not None:
+                    status, body = error
+                else:
+                    with fake._lock:
+                        if 'chat_id' in params:
+                            fake.recipients[str(params['chat_id'])] += 1
+                    status = 200
+                    result = fake.respond(method, params)
+                    body = {'ok': True, 'result': result}
+                    for observer in fake.observers:
+                        observer(method, params, result)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _handle
+            do_POST = _handle
+
+        return Handler
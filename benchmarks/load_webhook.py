@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+import telebot
+from werkzeug.serving import make_server
+
+from fake_telegram import FakeTelegram
+
+# === НАГРУЗОЧНЫЙ ТЕСТ WEBHOOK ===
+# Поднимает fake Bot API и Flask-приложение бота в режиме webhook,
+# шлёт синтетические обновления несколькими клиентами и печатает
+# updates/s и перцентили времени обработки одного обновления.
+# Запуск: python benchmarks/load_webhook.py [обновлений] [клиентов]
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+CLIENTS = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+USERS = 500
+SECRET = 'load-test-secret'
+
+
+def setup_environment(latency=0.0, **options):
+    fake = FakeTelegram(latency=latency, **options).start()
+    telebot.apihelper.API_URL = fake.api_url
+    data_dir = tempfile.mkdtemp(prefix='bot-load-')
+    os.environ.update({
+        'BOT_TOKEN': '123456:LOAD-TEST',
+        'ADMIN_IDS': '1001,1002',
+        'CHANNEL_USERNAME': '@load_test_channel',
+        'DATA_DIR': data_dir,
+        'BOT_MODE': 'webhook',
+        'WEBHOOK_URL': 'http://127.0.0.1',
+        'WEBHOOK_SECRET': SECRET,
+        # Fake API не ограничивает частоту, поэтому снимаем лимиты планировщика
+        'OUTBOUND_GLOBAL_RATE': '1000000',
+        'OUTBOUND_PRIVATE_RATE': '1000000',
+        'OUTBOUND_GROUP_RATE_PER_MIN': '1000000',
+        # Каждый пользователь шлет десятки заявок подряд: защиту от флуда выключаем
+        'FLOOD_LIMITS': '',
+    })
+    return fake
+
+
+def text_update(update_id):
+    user_id = 10_000 + random.randrange(USERS)
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f"user{user_id}"},
+            'text': f"Сообщение {update_id}",
+        },
+    }
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+
+
+def main():
+    fake = setup_environment()
+    import bot
+
+    bot.init_db()
+    bot.db.start_writer()
+    bot.admin_notifier.start()
+    bot.webhook_workers.start()
+    server = make_server('127.0.0.1', 0, bot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}{bot.WEBHOOK_PATH}"
+
+    statuses = {}
+    lock = threading.Lock()
+    ids = iter(range(1, UPDATES + 1))
+
+    def client():
+        session = requests.Session()
+        headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET, 'Content-Type': 'application/json'}
+        while True:
+            with lock:
+                update_id = next(ids, None)
+            if update_id is None:
+                return
+            body = json.dumps(text_update(update_id))
+            while True:
+                code = session.post(url, data=body, headers=headers).status_code
+                with lock:
+                    statuses[code] = statuses.get(code, 0) + 1
+                if code != 503:
+                    break
+                time.sleep(0.01)
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(CLIENTS)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    while bot.webhook_stats['processed'] < UPDATES - bot.webhook_stats['duplicates']:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    latencies = [x * 1000 for x in bot.webhook_latencies]
+    print(f"📊 Обновлений: {UPDATES}, клиентов: {CLIENTS}, воркеров: {bot.WEBHOOK_WORKERS}")
+    print(f"⚡ Пропускная способность: {UPDATES / elapsed:.0f} updates/s")
+    print(f"⏱ Обработка: p50 {percentile(latencies, 0.5):.2f} мс, p99 {percentile(latencies, 0.99):.2f} мс")
+    print(f"📨 HTTP-ответы: {statuses}, счётчики webhook: {bot.webhook_stats}")
+    print(f"📡 Вызовы Bot API: {dict(fake.calls)}")
+
+    server.shutdown()
+    bot.shutdown()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
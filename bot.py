@@ -1,26 +1,55 @@
 import os
+# Первым: от его импорта отсчитывается фаза импорта модулей (startup.Phases)
+import startup
 import telebot
-import sqlite3
+import atexit
+import signal
 from datetime import datetime, timedelta
 import logging
 import requests
 import json
-from flask import Flask, request
+import html
+import hmac
+import secrets
+from collections import OrderedDict, deque
+from flask import Flask, request, jsonify
 import threading
 import time
 import sys
+import db
+import migrations
+from workers import KeyedExecutor
+import outbound
+import albums
+import jobs
+import pacing
+import metrics
+import tracing
+import health
+import retention
+import logs
+import shards
+import flood
+import dedup
 
 # === ПАТИ ДЛЯ БАЗЫ ДАННЫХ ===
-DATA_DIR = '/app/data'
+DATA_DIR = os.environ.get('DATA_DIR', '/app/data')
 DB_PATH = os.path.join(DATA_DIR, 'bot.db')
+DATA_DIR_FALLBACK = not os.path.exists(DATA_DIR)
 
-if not os.path.exists(DATA_DIR):
+if DATA_DIR_FALLBACK:
     DATA_DIR = '/app'
     DB_PATH = os.path.join(DATA_DIR, 'bot.db')
-    print(f"⚠️ Volume не найден, используем рабочую директорию: {DATA_DIR}")
 
-os.makedirs(DATA_DIR, exist_ok=True)
-print(f"📁 База данных будет сохранена в: {DB_PATH}")
+tracing.configure(DATA_DIR)
+# Соединения открываются при первом запросе, схема — в init_db() при запуске
+db.configure(DB_PATH)
+
+def prepare_data_dir():
+    if DATA_DIR_FALLBACK:
+        print(f"⚠️ Volume не найден, используем рабочую директорию: {DATA_DIR}")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    print(f"📁 База данных будет сохранена в: {DB_PATH}")
 
 # === ЗАГРУЗКА КОНФИГУРАЦИИ ===
 def load_config():
@@ -30,373 +59,417 @@ def load_config():
             'ADMIN_IDS': [int(x.strip()) for x in os.environ.get('ADMIN_IDS', '').split(',') if x.strip()],
             'CHANNEL_USERNAME': os.environ.get('CHANNEL_USERNAME')
         }
-        print("✅ Конфигурация загружена из переменных окружения")
         return config
     except Exception as e:
         print(f"❌ Ошибка загрузки конфигурации: {e}")
         return None
 
 config = load_config()
-if not config:
-    print("❌ Не удалось загрузить конфигурацию")
-    exit(1)
 
 # === НАСТРОЙКИ ===
-BOT_TOKEN = config.get('BOT_TOKEN')
-ADMIN_IDS = config.get('ADMIN_IDS', [])
-CHANNEL_USERNAME = config.get('CHANNEL_USERNAME')
-
-if not BOT_TOKEN:
-    print("❌ BOT_TOKEN не найден")
-    exit(1)
-if not ADMIN_IDS:
-    print("❌ ADMIN_IDS не найден")
-    exit(1)
-if not CHANNEL_USERNAME:
-    print("❌ CHANNEL_USERNAME не найден")
-    exit(1)
-
-print(f"✅ BOT_TOKEN: {BOT_TOKEN[:10]}...")
-print(f"✅ ADMIN_IDS: {ADMIN_IDS}")
-print(f"✅ CHANNEL_USERNAME: {CHANNEL_USERNAME}")
+BOT_TOKEN = (config or {}).get('BOT_TOKEN')
+ADMIN_IDS = (config or {}).get('ADMIN_IDS', [])
+CHANNEL_USERNAME = (config or {}).get('CHANNEL_USERNAME')
+
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '100'))
+
+# Движок обработки: threaded — TeleBot с пулом потоков, async — AsyncTeleBot (bot_async.py)
+BOT_ENGINE = os.environ.get('BOT_ENGINE', 'threaded')
+# Свой адрес Bot API (локальный telegram-bot-api сервер), формат 'http://host:port/bot{0}/{1}'
+BOT_API_URL = os.environ.get('BOT_API_URL')
+
+def config_errors():
+    # Проверяется при запуске, а не при импорте
+    if not config:
+        return ["Не удалось загрузить конфигурацию"]
+    errors = []
+    if not BOT_TOKEN:
+        errors.append("BOT_TOKEN не найден")
+    if not ADMIN_IDS:
+        errors.append("ADMIN_IDS не найден")
+    if not CHANNEL_USERNAME:
+        errors.append("CHANNEL_USERNAME не найден")
+    if BOT_ENGINE not in ('threaded', 'async'):
+        errors.append(f"Неизвестный BOT_ENGINE: {BOT_ENGINE}")
+    if BOT_MODE not in ('polling', 'webhook'):
+        errors.append(f"Неизвестный BOT_MODE: {BOT_MODE}")
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        errors.append("WEBHOOK_URL не найден (нужен для BOT_MODE=webhook)")
+    if BOT_MODE == 'webhook' and BOT_ENGINE == 'async':
+        errors.append("BOT_ENGINE=async поддерживает только BOT_MODE=polling")
+    if shards.BOT_PROCESSES > 1 and BOT_ENGINE == 'async':
+        errors.append("BOT_PROCESSES > 1 поддерживается только с BOT_ENGINE=threaded")
+    return errors
+
+def check_config():
+    errors = config_errors()
+    for error in errors:
+        print(f"❌ {error}")
+    if errors:
+        exit(1)
+    print("✅ Конфигурация загружена из переменных окружения")
+    print(f"✅ BOT_TOKEN: {BOT_TOKEN[:10]}...")
+    print(f"✅ ADMIN_IDS: {ADMIN_IDS}")
+    print(f"✅ CHANNEL_USERNAME: {CHANNEL_USERNAME}")
+    print(f"✅ Режим получения обновлений: {BOT_MODE}, движок: {BOT_ENGINE}")
 
 HEALTH_CHECK_INTERVAL = 300
+# Цикл polling отмечается на каждом getUpdates (long polling до 30–60 с)
+HEALTH_POLL_STALE = float(os.environ.get('HEALTH_POLL_STALE', '120'))
+HEALTH_MAX_PUBLISH_LAG = float(os.environ.get('HEALTH_MAX_PUBLISH_LAG', '300'))
+NOTIFY_WORKERS = int(os.environ.get('NOTIFY_WORKERS', '8'))
 MAX_ERROR_COUNT = 3
 RESTART_DELAY = 60
 
 BOT_START_TIME = datetime.now()
-MESSAGE_COUNT = 0
 LAST_RESTART_TIME = datetime.now()
-ERROR_COUNT = 0
 LAST_ERROR_TIME = None
+# Общие для всех процессов бота (см. shards.py)
+message_count = shards.SharedCounter()
+error_count = shards.SharedCounter()
 HEALTH_MONITOR_RUNNING = False
-media_groups = {}
-
-logging.basicConfig(
-    level=logging.INFO, 
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler(os.path.join(DATA_DIR, 'bot_health.log'))
-    ]
-)
+
+# Запись в консоль и файл идет фоновым потоком (logs.py, включается при запуске,
+# до этого — простой вывод в консоль);
+# строки на каждое обновление — через update_log с сэмплированием LOG_SAMPLE_RATE
+logs.fallback()
 logger = logging.getLogger(__name__)
+update_log = logs.SampledLogger(logger)
 
-bot = telebot.TeleBot(BOT_TOKEN)
+# В режиме webhook обновления обрабатывают наши воркеры (см. WEBHOOK И FLASK),
+# поэтому собственный пул потоков telebot не нужен
+if BOT_API_URL:
+    telebot.apihelper.API_URL = BOT_API_URL
+bot = telebot.TeleBot(BOT_TOKEN, threaded=BOT_MODE != 'webhook')
 app = Flask(__name__)
 
-try:
-    bot_info = bot.get_me()
-    logger.info(f"✅ Бот запущен: {bot_info.first_name} (@{bot_info.username})")
-except Exception as e:
-    logger.error(f"❌ Ошибка доступа к боту: {e}")
-    logger.error("⚠️ Проверьте правильность BOT_TOKEN")
-    exit(1)
-
-try:
-    chat = bot.get_chat(CHANNEL_USERNAME)
-    logger.info(f"✅ Канал найден: {chat.title}")
-except Exception as e:
-    logger.error(f"❌ Ошибка доступа к каналу {CHANNEL_USERNAME}: {e}")
-    logger.error("⚠️ Проверьте: 1) Юзернейм канала 2) Бот добавлен как администратор")
+# === ОГРАНИЧЕНИЕ ИСХОДЯЩИХ ЗАПРОСОВ ===
+def outbound_priority(chat_id):
+    if chat_id == CHANNEL_USERNAME:
+        return outbound.PRIORITY_CHANNEL
+    if chat_id in ADMIN_IDS:
+        return outbound.PRIORITY_ADMIN
+    return outbound.PRIORITY_USER
+
+outbound_scheduler = outbound.OutboundScheduler(classify=outbound_priority)
+outbound.install(bot, outbound_scheduler)
+
+if shards.BOT_PROCESSES > 1:
+    # Лимит бота делят главный процесс и воркеры
+    outbound_scheduler.set_global_rate(outbound.GLOBAL_RATE / (shards.BOT_PROCESSES + 1))
+    db.submission_cache.ttl = min(db.submission_cache.ttl, shards.SHARD_CACHE_TTL)
 
 # === СИСТЕМА МОНИТОРИНГА ЗДОРОВЬЯ ===
 def log_error(error_type, error_message):
-    global ERROR_COUNT, LAST_ERROR_TIME
-    ERROR_COUNT += 1
+    global LAST_ERROR_TIME
+    count = error_count.add()
     LAST_ERROR_TIME = datetime.now()
     logger.error(f"🚨 Ошибка [{error_type}]: {error_message}")
-    logger.error(f"📊 Счетчик ошибок: {ERROR_COUNT}/{MAX_ERROR_COUNT}")
+    logger.error(f"📊 Счетчик ошибок: {count}/{MAX_ERROR_COUNT}")
     log_bot_event('error', f"{error_type}: {error_message}")
 
 def reset_error_count():
-    global ERROR_COUNT
-    ERROR_COUNT = 0
+    error_count.reset()
     logger.info("🔄 Счетчик ошибок сброшен")
 
-def health_check():
+# Проверки выполняет только поток мониторинга, эндпоинты /health отдают
+# последний снимок (см. health.py). Bot API проверяется раз в HEALTH_CHECK_INTERVAL,
+# остальное — на каждом проходе (HEALTH_REFRESH).
+health_status = health.Health()
+
+def check_telegram():
     try:
         bot.get_me()
         bot.get_chat(CHANNEL_USERNAME)
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        conn.close()
-        logger.info("❤️ Проверка здоровья: все системы работают нормально")
-        reset_error_count()
-        return True
     except Exception as e:
         log_error('health_check', str(e))
-        return False
+        raise
+    logger.info("❤️ Проверка здоровья: Bot API и канал доступны")
+    reset_error_count()
+    return {'channel': CHANNEL_USERNAME}
+
+def check_database():
+    db.check_writable()
+    return {'path': DB_PATH}
+
+def heartbeat_seconds(name):
+    age = health.heartbeat_age(name)
+    return None if age is None else round(age, 1)
+
+def check_updates():
+    if shard_pool.running:
+        detail = dict(shard_pool.stats(), mode=BOT_MODE, last_update_seconds=heartbeat_seconds(BOT_MODE))
+        if detail['alive'] < detail['processes']:
+            raise health.CheckFailed(f"работают {detail['alive']} из {detail['processes']} процессов-воркеров", detail)
+        if BOT_MODE == 'webhook':
+            return detail
+    if BOT_MODE == 'webhook':
+        detail = {'mode': 'webhook', 'queue': webhook_workers.pending(), 'last_update_seconds': heartbeat_seconds('webhook')}
+        if not webhook_workers.running:
+            raise health.CheckFailed("воркеры webhook остановлены", detail)
+        return detail
+    age = health.heartbeat_age('polling')
+    detail = {'mode': 'polling', 'heartbeat_seconds': heartbeat_seconds('polling')}
+    if age is None:
+        age = (datetime.now() - BOT_START_TIME).total_seconds()
+    if age > HEALTH_POLL_STALE:
+        raise health.CheckFailed(f"цикл polling не отмечался {age:.0f} с", detail)
+    return detail
+
+def check_queues():
+    lag = db.publish_lag()
+    detail = {
+        'publish_lag_seconds': round(lag, 1),
+        'outbound_queue': metrics.gauge_value('bot_outbound_queue_depth'),
+        'album_groups': metrics.gauge_value('bot_album_open_groups'),
+        'pending_age_seconds': metrics.gauge_value('bot_pending_backlog_age_seconds'),
+        'last_api_ok_seconds': heartbeat_seconds('api'),
+    }
+    if lag > HEALTH_MAX_PUBLISH_LAG:
+        raise health.CheckFailed(f"публикации отстают на {lag:.0f} с", detail)
+    return detail
+
+health_status.register('telegram', check_telegram, interval=HEALTH_CHECK_INTERVAL)
+health_status.register('database', check_database)
+health_status.register('updates', check_updates, live=True)
+health_status.register('queues', check_queues, critical=False)
 
 def health_monitor():
     global HEALTH_MONITOR_RUNNING
     HEALTH_MONITOR_RUNNING = True
+    was_ready = True
     while HEALTH_MONITOR_RUNNING:
         try:
-            if not health_check():
+            health_status.refresh()
+            ready = health_status.ready()
+            if was_ready and not ready:
                 logger.error("🔄 Проблемы с здоровьем бота")
+            was_ready = ready
+            expired = db.expire_claims()
+            if expired:
+                logger.warning(f"⏳ Истекшие захваты возвращены на модерацию: {expired}")
         except Exception as e:
             logger.error(f"❌ Ошибка в мониторе здоровья: {e}")
-        time.sleep(HEALTH_CHECK_INTERVAL)
+        time.sleep(health_status.refresh_interval)
+
+# Сворачивание старых событий, incremental vacuum и checkpoint WAL (см. retention.py)
+db_maintenance = retention.Maintenance(retention.default_tasks(), retention.manual_tasks())
+# /maintenance run в процессе-воркере будит поток обслуживания главного процесса
+maintenance_wakeup = shards.SharedWakeup(db_maintenance.wake, 'maintenance-wakeup')
 
 # === БАЗА ДАННЫХ ===
 def init_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            user_name TEXT,
-            username TEXT,
-            message_text TEXT,
-            message_type TEXT,
-            file_id TEXT,
-            file_type TEXT,
-            timestamp TEXT,
-            status TEXT DEFAULT 'pending',
-            admin_reply TEXT DEFAULT NULL,
-            reply_sent BOOLEAN DEFAULT FALSE,
-            publish_type TEXT DEFAULT 'normal'
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bot_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            event_type TEXT,
-            event_time TEXT,
-            details TEXT
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bot_errors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            error_type TEXT,
-            error_message TEXT,
-            error_time TEXT,
-            resolved BOOLEAN DEFAULT FALSE
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-    logger.info(f"✅ База данных инициализирована: {DB_PATH}")
-
-init_db()
-
-def save_message_to_db(user_id, user_name, username, message_type, text, file_id=None, file_type=None):
-    global MESSAGE_COUNT
-    MESSAGE_COUNT += 1
-    
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO messages (user_id, user_name, username, message_text, message_type, file_id, file_type, timestamp, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')",
-        (user_id, user_name, username, text, message_type, file_id, file_type, datetime.now().isoformat())
-    )
-    message_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return message_id
-
-def get_message_from_db(message_id):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM messages WHERE id = ?", (message_id,))
-    message = cursor.fetchone()
-    conn.close()
-    
-    if message and message[5] == 'photo' and message[6]:
-        try:
-            file_ids = json.loads(message[6])
-            if isinstance(file_ids, list) and len(file_ids) > 0:
-                message_list = list(message)
-                message_list[6] = file_ids[0]
-                message_list.append(file_ids)
-                return tuple(message_list)
-        except (json.JSONDecodeError, TypeError):
-            pass
-    
-    return message
+    version = migrations.migrate()
+    logger.info(f"✅ База данных инициализирована: {DB_PATH} (схема v{version})")
+    return version
+
+def submit_message_to_db(user_id, user_name, username, message_type, text, files=()):
+    # → Future с (id заявки, повторов); повтор ожидающей заявки новую не создает (dedup.py)
+    files = list(files)
+    content_hash = None
+    if dedup.DEDUP_WINDOW > 0:
+        content_hash = dedup.content_hash(message_type, text, [file_unique_id for _, file_unique_id, _ in files])
+    future = db.submit_unique_message(user_id, user_name, username, message_type, text, files, content_hash, dedup.DEDUP_WINDOW)
+    future.add_done_callback(count_new_message)
+    return future
+
+def count_new_message(future):
+    # Счетчик заявок растет только при новой строке, повтор считает dedup.repeats_total
+    if future.exception() is None and future.result()[1] == 0:
+        message_count.add()
+
+def save_message_to_db(user_id, user_name, username, message_type, text, files=()):
+    return submit_message_to_db(user_id, user_name, username, message_type, text, files).result()
+
+def get_message_from_db(message_id, fresh=False):
+    # models.Submission вместе с файлами (один запрос) или None; читается через кэш,
+    # fresh=True — напрямую из БД, когда по статусу принимается решение
+    return db.get_message(message_id, fresh)
 
 def update_publish_type(message_id, publish_type):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE messages SET publish_type = ? WHERE id = ?", (publish_type, message_id))
-    conn.commit()
-    conn.close()
+    db.set_publish_type(message_id, publish_type)
 
 def update_admin_reply(message_id, reply_text, reply_sent=False):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE messages SET admin_reply = ?, reply_sent = ? WHERE id = ?", (reply_text, reply_sent, message_id))
-    conn.commit()
-    conn.close()
+    db.set_admin_reply(message_id, reply_text, reply_sent)
 
 def log_bot_event(event_type, details=""):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO bot_stats (event_type, event_time, details) VALUES (?, ?, ?)",
-        (event_type, datetime.now().isoformat(), details)
-    )
-    conn.commit()
-    conn.close()
+    db.insert_event(event_type, details)
+
+# === ПЛАНЫ ОТПРАВКИ ===
+# Цепочки вызовов Bot API описаны данными: список (метод, args, kwargs).
+# Их одинаково исполняют синхронный движок (run_sends) и асинхронный (bot_async).
+def run_sends(sends):
+    result = None
+    for method, args, kwargs in sends:
+        result = getattr(bot, method)(*args, **kwargs)
+    return result
+
+# Типы файлов, которые Telegram принимает в альбоме (sendMediaGroup)
+ALBUM_MEDIA = {
+    'photo': telebot.types.InputMediaPhoto,
+    'video': telebot.types.InputMediaVideo,
+    'document': telebot.types.InputMediaDocument,
+}
+ALBUM_LABELS = {'photo': '📷 Фото', 'video': '🎥 Видео', 'document': '📄 Документ'}
+
+def album_media(file_ids, file_types, caption=None, parse_mode=None):
+    media = []
+    for i, (file_id, file_type) in enumerate(zip(file_ids, file_types)):
+        media.append(ALBUM_MEDIA.get(file_type, telebot.types.InputMediaPhoto)(
+            file_id,
+            caption=caption if i == 0 else None,
+            parse_mode=parse_mode
+        ))
+    return media
 
 # === ОТПРАВКА СООБЩЕНИЙ (ИСПРАВЛЕНА) ===
-def send_to_channel(message_data, publish_type='normal', admin_id=None):
-    try:
-        message_type = message_data.get('message_type')
-        text = message_data.get('text', '')
-        file_id = message_data.get('file_id')
-        file_ids = message_data.get('file_ids', [])
-        
-        if not file_ids and file_id:
-            file_ids = [file_id]
-
-        if publish_type == 'forward' and admin_id:
-            target_chat = admin_id
-            forward_text = "🔄 <b>Перешлите это сообщение в канал:</b>"
-        else:
-            target_chat = CHANNEL_USERNAME
-            forward_text = ""
-
-        if forward_text:
-            bot.send_message(target_chat, forward_text, parse_mode='HTML')
+def channel_sends(submission, publish_type='normal', admin_id=None):
+    message_type = submission.message_type
+    text = submission.text or ''
+    file_ids = submission.file_ids
+    file_types = submission.file_types
+
+    if publish_type == 'forward' and admin_id:
+        target_chat = admin_id
+        forward_text = "🔄 <b>Перешлите это сообщение в канал:</b>"
+    else:
+        target_chat = CHANNEL_USERNAME
+        forward_text = ""
 
-        if message_type == 'text':
-            bot.send_message(target_chat, text, parse_mode='HTML')
-            return True
-            
-        elif message_type == 'photo':
-            if len(file_ids) > 1:
-                media = []
-                for i, photo_id in enumerate(file_ids):
-                    media.append(telebot.types.InputMediaPhoto(
-                        photo_id, 
-                        caption=text if i == 0 else None,
-                        parse_mode='HTML'
-                    ))
-                bot.send_media_group(target_chat, media)
-            else:
-                bot.send_photo(target_chat, file_ids[0], caption=text, parse_mode='HTML')
-            return True
-            
-        elif message_type == 'video':
-            bot.send_video(target_chat, file_ids[0], caption=text, parse_mode='HTML')
-            return True
-            
-        elif message_type == 'voice':
-            bot.send_voice(target_chat, file_ids[0], caption=text, parse_mode='HTML')
-            return True
-            
-        elif message_type == 'document':
-            bot.send_document(target_chat, file_ids[0], caption=text, parse_mode='HTML')
-            return True
-            
-        elif message_type == 'sticker':
-            bot.send_sticker(target_chat, file_ids[0])
-            return True
-            
-        else:
-            logger.error(f"❌ Неподдерживаемый тип: {message_type}")
-            return False
+    sends = []
+    if forward_text:
+        sends.append(('send_message', (target_chat, forward_text), {'parse_mode': 'HTML'}))
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка отправки в канал: {e}")
-        log_error('send_to_channel', str(e))
-        return False
+    if message_type in ALBUM_MEDIA and len(file_ids) > 1:
+        sends.append(('send_media_group', (target_chat, album_media(file_ids, file_types, text, 'HTML')), {}))
 
-# === ОБРАБОТКА ГРУПП МЕДИА (ИСПРАВЛЕНА) ===
-def process_media_group(media_group_id):
-    if media_group_id not in media_groups:
-        return
+    elif message_type == 'text':
+        sends.append(('send_message', (target_chat, text), {'parse_mode': 'HTML'}))
         
-    group_data = media_groups[media_group_id]
-    user = group_data['user']
-    caption = group_data['caption']
-    file_ids = group_data['file_ids']
-    
-    if not file_ids:
-        return
-    
-    file_ids_json = json.dumps(file_ids)
+    elif message_type == 'photo':
+        sends.append(('send_photo', (target_chat, file_ids[0]), {'caption': text, 'parse_mode': 'HTML'}))
+        
+    elif message_type == 'video':
+        sends.append(('send_video', (target_chat, file_ids[0]), {'caption': text, 'parse_mode': 'HTML'}))
+        
+    elif message_type == 'voice':
+        sends.append(('send_voice', (target_chat, file_ids[0]), {'caption': text, 'parse_mode': 'HTML'}))
+        
+    elif message_type == 'document':
+        sends.append(('send_document', (target_chat, file_ids[0]), {'caption': text, 'parse_mode': 'HTML'}))
+        
+    elif message_type == 'sticker':
+        sends.append(('send_sticker', (target_chat, file_ids[0]), {}))
+        
+    else:
+        return None
+
+    return sends
+
+# === ОЧЕРЕДЬ ПУБЛИКАЦИЙ ===
+# Callback только ставит задачу (db.enqueue_publish) и отвечает админу,
+# отправку в канал выполняют воркеры jobs.JobWorkers
+def publish_job_sends(job):
+    submission = get_message_from_db(job.message_id, fresh=True)
+    if submission is None:
+        raise jobs.PermanentJobError(f"Заявка #{job.message_id} не найдена")
+    sends = channel_sends(submission, job.publish_type, job.admin_id)
+    if sends is None:
+        raise jobs.PermanentJobError(f"Неподдерживаемый тип: {submission.message_type}")
+    return sends
+
+def execute_publish_job(job):
+    # Части плана, отправленные до падения или ошибки, не повторяются
+    sends = publish_job_sends(job)
+    for step in range(job.step, len(sends)):
+        method, args, kwargs = sends[step]
+        getattr(bot, method)(*args, **kwargs)
+        db.advance_job(job.id, step + 1)
+        job.step = step + 1
+
+def publish_job_result_text(job, success):
+    submission = get_message_from_db(job.message_id)
+    file_count = len(submission.files) if submission else 0
+    return publish_result_text(job.message_id, job.publish_type, success, file_count)
+
+def publish_job_finished(job, success, error=None):
+    if not success:
+        log_error('send_to_channel', error)
+    status_text = publish_job_result_text(job, success)
+    skip = None
+    if job.reply_chat_id:
+        skip = (job.reply_chat_id, job.reply_message_id)
+        edit_moderation_message(job.reply_chat_id, job.reply_message_id, job.admin_name, status_text)
+    update_admin_notifications(job.message_id, 'approved' if success else 'error', job.admin_name, skip)
+
+publish_workers = jobs.JobWorkers(execute_publish_job, publish_job_finished, pacer=pacing.pacer)
+# Процесс-воркер (BOT_PROCESSES > 1) будит очередь главного процесса через Event
+publish_wakeup = shards.SharedWakeup(publish_workers.wake, 'publish-wakeup')
+
+# === ОБРАБОТКА ГРУПП МЕДИА ===
+# Файлы альбома копит albums.MediaGroupAggregator (один поток на все альбомы),
+# готовый альбом обрабатывается в пуле, чтобы медленная отправка не задерживала
+# сборку остальных.
+def album_ack_text(media_type, count):
+    if media_type == 'photo':
+        return f"✅ {count} фото отправлено на модерацию"
+    return f"✅ Альбом ({count} шт.) отправлен на модерацию"
+
+@tracing.traced('process_media_group')
+def process_media_group(group):
+    user = group.user
+    media_type = group.media_type
+    caption = group.caption or ALBUM_LABELS.get(media_type, '📎 Альбом')
     
-    message_id = save_message_to_db(
+    message_id, repeats = save_message_to_db(
         user.id,
         user.first_name or 'User',
         user.username or '',
-        'photo',
+        media_type,
         caption,
-        file_ids_json,
-        'photo'
+        zip(group.file_ids, group.file_unique_ids, group.file_types)
     )
+    if repeats:
+        count_repeat(user, message_id, media_type, repeats)
+        bot.send_message(group.chat_id, REPEAT_ACK_TEXT)
+        return
     
-    bot.send_message(user.id, f"✅ {len(file_ids)} фото отправлено на модерацию")
-    notify_admins_group(message_id, user, caption, 'photo', file_ids)
-    
-    del media_groups[media_group_id]
+    bot.send_message(group.chat_id, album_ack_text(media_type, len(group.file_ids)))
+    notify_admins_group(message_id, user, caption, media_type, group.file_ids, group.file_types)
 
-# === УВЕДОМЛЕНИЯ АДМИНАМ ДЛЯ ГРУПП ===
-def notify_admins_group(message_id, user, text, media_type, file_ids):
-    icons = {'text': '📝', 'photo': '📷', 'video': '🎥', 'voice': '🎤', 'document': '📄', 'sticker': '🎭'}
-    icon = icons.get(media_type, '📨')
-    username_display = f"@{user.username}" if user.username else "нет юзернейма"
-
-    admin_msg = f"""{icon} <b>Новое сообщение</b> #{message_id}
+album_workers = KeyedExecutor(2, 'albums')
+album_aggregator = albums.MediaGroupAggregator(
+    lambda group: album_workers.submit(group.chat_id, process_media_group, group)
+)
 
-👤 <b>От:</b> {user.first_name} ({username_display})
-🆔 <b>ID:</b> {user.id}
-📋 <b>Тип:</b> {media_type} ({len(file_ids)} шт.)
-📝 <b>Текст:</b> {text if text else 'Нет текста'}"""
+def collect_album_item(message):
+    if flood_blocked(message):
+        return
+    message_type, _, file_id, file_unique_id, _ = describe_submission(message)
+    album_aggregator.add(message.media_group_id, message.from_user, message.chat.id, message_type, file_id, file_unique_id, message.caption)
 
-    from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+# === УВЕДОМЛЕНИЯ АДМИНАМ ДЛЯ ГРУПП ===
+def notify_admins_group(message_id, user, text, media_type, file_ids, file_types):
+    admin_msg = admin_notification_text(message_id, user, text, media_type, len(file_ids))
+    keyboard = moderation_keyboard(message_id, "📝 Обычная публикация", "💬 Ответить пользователю")
 
     for admin_id in ADMIN_IDS:
-        try:
-            if len(file_ids) > 1:
-                media = []
-                for i, file_id in enumerate(file_ids):
-                    media.append(telebot.types.InputMediaPhoto(
-                        file_id, 
-                        caption=admin_msg if i == 0 else None,
-                        parse_mode='HTML'
-                    ))
-                sent_messages = bot.send_media_group(admin_id, media)
-                
-                keyboard = InlineKeyboardMarkup()
-                keyboard.row(
-                    InlineKeyboardButton("📝 Обычная публикация", callback_data=f"publish_normal_{message_id}"),
-                    InlineKeyboardButton("🔄 Переслать", callback_data=f"publish_forward_{message_id}")
-                )
-                keyboard.row(
-                    InlineKeyboardButton("💬 Ответить пользователю", callback_data=f"reply_{message_id}"),
-                    InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{message_id}")
-                )
-                
-                bot.send_message(admin_id, "📋 Выберите действие для группы медиа:", reply_markup=keyboard)
-                
-            else:
-                msg = bot.send_photo(admin_id, file_ids[0], caption=admin_msg, parse_mode='HTML')
-                
-                keyboard = InlineKeyboardMarkup()
-                keyboard.row(
-                    InlineKeyboardButton("📝 Обычная публикация", callback_data=f"publish_normal_{message_id}"),
-                    InlineKeyboardButton("🔄 Переслать", callback_data=f"publish_forward_{message_id}")
-                )
-                keyboard.row(
-                    InlineKeyboardButton("💬 Ответить пользователю", callback_data=f"reply_{message_id}"),
-                    InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{message_id}")
-                )
-                
-                bot.edit_message_reply_markup(admin_id, msg.message_id, reply_markup=keyboard)
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка отправки админу {admin_id}: {e}")
+        sends = admin_group_notification_sends(admin_id, admin_msg, file_ids, file_types, keyboard)
+        admin_notifier.submit(admin_id, send_admin_sends, admin_id, sends, message_id)
+
+def admin_group_notification_sends(admin_id, admin_msg, file_ids, file_types, keyboard):
+    if len(file_ids) > 1:
+        # У альбома не может быть клавиатуры, поэтому кнопки идут отдельным сообщением
+        return [
+            ('send_media_group', (admin_id, album_media(file_ids, file_types, admin_msg, 'HTML')), {}),
+            ('send_message', (admin_id, "📋 Выберите действие для группы медиа:"), {'reply_markup': keyboard}),
+        ]
+    return [(f"send_{file_types[0]}", (admin_id, file_ids[0]), {'caption': admin_msg, 'parse_mode': 'HTML', 'reply_markup': keyboard})]
 
 # === СТАТИСТИКА ===
 def get_bot_uptime():
@@ -411,56 +484,49 @@ def get_bot_uptime():
         return f"{hours}ч {minutes}м {seconds}с"
 
 def get_bot_stats():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM messages")
-    total_messages = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM messages WHERE status = 'approved'")
-    approved_messages = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM messages WHERE status = 'pending'")
-    pending_messages = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(DISTINCT user_id) FROM messages")
-    unique_users = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM bot_stats WHERE event_type = 'restart'")
-    restarts_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM bot_errors")
-    total_errors = cursor.fetchone()[0]
-    
-    conn.close()
+    counts = db.count_stats()
     
     return {
         'uptime': get_bot_uptime(),
-        'total_messages': total_messages,
-        'approved_messages': approved_messages,
-        'pending_messages': pending_messages,
-        'unique_users': unique_users,
-        'restarts_count': restarts_count,
-        'total_errors': total_errors,
-        'current_error_count': ERROR_COUNT,
-        'current_message_count': MESSAGE_COUNT
+        'total_messages': counts['total_messages'],
+        'approved_messages': counts['approved_messages'],
+        'pending_messages': counts['pending_messages'],
+        'unique_users': counts['unique_users'],
+        'restarts_count': counts['restarts_count'],
+        'total_errors': counts['total_errors'],
+        'current_error_count': error_count.value,
+        'current_message_count': message_count.value,
+        'outbound': outbound_scheduler.stats(),
+        'cache': db.submission_cache.stats(),
+        'publish_jobs': db.job_stats()
     }
 
+def stats_text(stats):
+    return f"""📊 <b>Статистика бота</b>
+
+⏱ Время работы: <b>{stats['uptime']}</b>
+📨 Всего сообщений: <b>{stats['total_messages']}</b>
+👥 Уникальных пользователей: <b>{stats['unique_users']}</b>
+✅ Одобрено: <b>{stats['approved_messages']}</b>
+⏳ Ожидают модерации: <b>{stats['pending_messages']}</b>
+🔄 Перезапусков: <b>{stats['restarts_count']}</b>
+🚨 Ошибок: <b>{stats['total_errors']}</b>
+📤 Очередь отправки: <b>{stats['outbound']['queue_depth']}</b> (пик {stats['outbound']['queue_peak']}), ожидание ср. {stats['outbound']['avg_wait_ms']:.0f} мс / макс. {stats['outbound']['max_wait_ms']:.0f} мс, 429: {stats['outbound']['rate_limited']}
+🗃 Кэш заявок: {stats['cache']['size']} шт., попаданий {stats['cache']['hits']}, промахов {stats['cache']['misses']} ({stats['cache']['hit_rate']:.0%})
+📬 Публикации: в очереди {stats['publish_jobs']['queued']}, выполняются {stats['publish_jobs']['running']}, с ошибкой {stats['publish_jobs']['failed']} (расписание: {pacing.pacer.describe()})"""
+
 # === ОБРАБОТКА ОТВЕТОВ АДМИНОВ ===
-user_reply_mode = {}
+# Админ → заявка, на которую он отвечает; в SQLite, чтобы видели все процессы
+user_reply_mode = shards.SharedMap('reply_mode')
 
 @bot.message_handler(func=lambda message: message.from_user.id in ADMIN_IDS and message.text and not message.text.startswith('/'))
 def handle_admin_reply(message):
     admin_id = message.from_user.id
+    target_message_id = user_reply_mode.pop(admin_id)
     
-    if admin_id in user_reply_mode:
-        target_message_id = user_reply_mode[admin_id]
-        
+    if target_message_id is not None:
         try:
-            conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-            cursor = conn.cursor()
-            cursor.execute("SELECT user_id, user_name, message_text FROM messages WHERE id = ?", (target_message_id,))
-            message_data = cursor.fetchone()
+            message_data = db.get_reply_target(target_message_id)
             
             if message_data:
                 user_id, user_name, original_text = message_data
@@ -486,30 +552,28 @@ def handle_admin_reply(message):
             logger.error(f"❌ Ошибка обработки ответа админа: {e}")
             bot.send_message(admin_id, "❌ Ошибка при обработке ответа")
         
-        del user_reply_mode[admin_id]
-        
     else:
         handle_text(message)
 
 # === ОСНОВНЫЕ КОМАНДЫ ===
-@bot.message_handler(commands=['start'])
-def start(message):
-    user = message.from_user
-    logger.info(f"👤 /start от {user.first_name} (ID: {user.id})")
-    bot.send_message(message.chat.id, 
-                    "👋 <b>Привет!</b>\n\n"
-                    "Отправь мне сообщение или любой файл(медиа) для публикации в канале.\n"
-                    "Почти все будет опубликовано (не заходя за рамки кнш)", 
-                    parse_mode='HTML')
+START_TEXT = ("👋 <b>Привет!</b>\n\n"
+              "Отправь мне сообщение или любой файл(медиа) для публикации в канале.\n"
+              "Почти все будет опубликовано (не заходя за рамки кнш)")
 
-@bot.message_handler(commands=['help'])
-def help_command(message):
-    help_text = """
+HELP_TEXT = """
 🤖 <b>Доступные команды:</b>
 /start - Начать работу
 /help - Показать информацию
 /stats - Статистика бота (админы)
 /pending - Сообщения на модерации (админы)
+/rebuild_stats - Пересчитать статистику (админы)
+/queue - Очередь публикаций в канал (админы)
+/move ID ПОЗИЦИЯ - Переставить публикацию в очереди (админы)
+/unqueue ID - Снять публикацию и вернуть на модерацию (админы)
+/slow - Самые медленные обновления (админы)
+/maintenance [run [ЗАДАЧИ]|convert] - Хранение событий и обслуживание БД (админы)
+/flood - Защита от флуда: кто ограничен (админы)
+/unflood ID|all - Снять ограничение флуда (админы)
 
 📨 <b>Что можно отправить:</b>
 • Текстовые сообщения
@@ -520,7 +584,16 @@ def help_command(message):
 • Стикеры
 • Опросы (просто отправьте текст опроса)
 """
-    bot.send_message(message.chat.id, help_text, parse_mode='HTML')
+
+@bot.message_handler(commands=['start'])
+def start(message):
+    user = message.from_user
+    update_log.info(f"👤 /start от {user.first_name} (ID: {user.id})")
+    bot.send_message(message.chat.id, START_TEXT, parse_mode='HTML')
+
+@bot.message_handler(commands=['help'])
+def help_command(message):
+    bot.send_message(message.chat.id, HELP_TEXT, parse_mode='HTML')
 
 @bot.message_handler(commands=['stats'])
 def stats_command(message):
@@ -530,34 +603,56 @@ def stats_command(message):
 
     try:
         stats = get_bot_stats()
-        
-        stats_text = f"""📊 <b>Статистика бота</b>
-
-⏱ Время работы: <b>{stats['uptime']}</b>
-📨 Всего сообщений: <b>{stats['total_messages']}</b>
-👥 Уникальных пользователей: <b>{stats['unique_users']}</b>
-✅ Одобрено: <b>{stats['approved_messages']}</b>
-⏳ Ожидают модерации: <b>{stats['pending_messages']}</b>
-🔄 Перезапусков: <b>{stats['restarts_count']}</b>
-🚨 Ошибок: <b>{stats['total_errors']}</b>"""
 
-        bot.send_message(message.chat.id, stats_text, parse_mode='HTML')
+        bot.send_message(message.chat.id, stats_text(stats), parse_mode='HTML')
 
     except Exception as e:
         logger.error(f"❌ Ошибка статистики: {e}")
         bot.send_message(message.chat.id, "❌ Ошибка при получении статистики")
 
+@bot.message_handler(commands=['rebuild_stats'])
+def rebuild_stats_command(message):
+    if message.from_user.id not in ADMIN_IDS:
+        bot.send_message(message.chat.id, "❌ Нет прав для пересчета статистики")
+        return
+
+    try:
+        db.rebuild_counters()
+        bot.send_message(message.chat.id, "✅ Статистика пересчитана по исходным таблицам")
+    except Exception as e:
+        logger.error(f"❌ Ошибка пересчета статистики: {e}")
+        bot.send_message(message.chat.id, "❌ Ошибка при пересчете статистики")
+
+def pending_item(submission):
+    from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+    msg_id = submission.id
+    text = submission.text
+    
+    message_text = f"📨 <b>#{msg_id}</b> - {submission.user_name} - {submission.message_type}\n"
+    if text and len(text) > 100:
+        message_text += f"📝 {text[:100]}..."
+    elif text:
+        message_text += f"📝 {text}"
+    else:
+        message_text += "📝 Нет текста"
+    if submission.repeats:
+        message_text += f"\n🔁 Повторов: {submission.repeats}"
+    
+    quick_keyboard = InlineKeyboardMarkup()
+    quick_keyboard.row(
+        InlineKeyboardButton("👁 Просмотреть", callback_data=f"view_{msg_id}"),
+        InlineKeyboardButton("💬 Ответить", callback_data=f"reply_{msg_id}")
+    )
+    return message_text, quick_keyboard
+
 @bot.message_handler(commands=['pending'])
 def pending_messages(message):
     if message.from_user.id not in ADMIN_IDS:
         return
 
     try:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id, user_id, user_name, username, message_text, message_type, file_id, file_type, timestamp, status FROM messages WHERE status = 'pending' ORDER BY id DESC LIMIT 10")
-        pending_messages = cursor.fetchall()
+        pending_messages = db.get_pending(10)
         
         if not pending_messages:
             bot.send_message(message.chat.id, "📭 Нет сообщений, ожидающих модерации")
@@ -566,24 +661,7 @@ def pending_messages(message):
         bot.send_message(message.chat.id, "📋 <b>Сообщения ожидающие модерации:</b>", parse_mode='HTML')
         
         for msg in pending_messages:
-            msg_id, user_id, user_name, username, text, msg_type, file_id, file_type, timestamp, status = msg
-            
-            message_text = f"📨 <b>#{msg_id}</b> - {user_name} - {msg_type}\n"
-            if text and len(text) > 100:
-                message_text += f"📝 {text[:100]}..."
-            elif text:
-                message_text += f"📝 {text}"
-            else:
-                message_text += "📝 Нет текста"
-            
-            from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-            
-            quick_keyboard = InlineKeyboardMarkup()
-            quick_keyboard.row(
-                InlineKeyboardButton("👁 Просмотреть", callback_data=f"view_{msg_id}"),
-                InlineKeyboardButton("💬 Ответить", callback_data=f"reply_{msg_id}")
-            )
-            
+            message_text, quick_keyboard = pending_item(msg)
             bot.send_message(
                 message.chat.id, 
                 message_text,
@@ -591,200 +669,504 @@ def pending_messages(message):
                 reply_markup=quick_keyboard
             )
         
-        conn.close()
-        
     except Exception as e:
         logger.error(f"❌ Ошибка получения ожидающих сообщений: {e}")
         bot.send_message(message.chat.id, "❌ Ошибка при получении списка сообщений")
 
-# === ОБРАБОТЧИКИ СООБЩЕНИЙ ===
-@bot.message_handler(content_types=['text'])
-def handle_text(message):
-    if message.text.startswith('/'):
+# === РАСПИСАНИЕ ПУБЛИКАЦИЙ ===
+def release_time_text(release, now):
+    moment = datetime.fromtimestamp(release)
+    if moment.date() != datetime.fromtimestamp(now).date():
+        return moment.strftime('%d.%m %H:%M')
+    return moment.strftime('%H:%M')
+
+def queue_command_text(limit=20):
+    rows, last_released, last_cost = db.get_schedule(limit)
+    if not rows:
+        return "📭 Очередь публикаций пуста"
+
+    now = time.time()
+    releases = pacing.pacer.schedule(last_released, last_cost, [row[4] for row in rows], now)
+    lines = [f"🗓 <b>Очередь публикаций</b> ({pacing.pacer.describe()}):", ""]
+    for index, (row, release) in enumerate(zip(rows, releases), 1):
+        message_id, message_type, text, user_name, cost, admin_name = row
+        preview = html.escape((text or '')[:40]) + ('...' if text and len(text) > 40 else '')
+        lines.append(f"{index}. <b>#{message_id}</b> ~{release_time_text(release, now)} — {message_type}, {html.escape(user_name or '')}: {preview}")
+    lines.append("")
+    lines.append("/move ID ПОЗИЦИЯ — переставить, /unqueue ID — снять с публикации")
+    return "\n".join(lines)
+
+def move_command_text(args):
+    try:
+        message_id, index = int(args[0]), int(args[1])
+    except (IndexError, ValueError):
+        return "❌ Использование: /move ID ПОЗИЦИЯ"
+    if not db.move_scheduled(message_id, index):
+        return f"❌ Сообщения #{message_id} нет в очереди публикаций"
+    logger.info(f"🗓 Сообщение #{message_id} перемещено на позицию {index}")
+    return f"✅ Сообщение #{message_id} перемещено на позицию {index}"
+
+def unqueue_command_text(args):
+    try:
+        message_id = int(args[0])
+    except (IndexError, ValueError):
+        return "❌ Использование: /unqueue ID"
+    if not db.cancel_scheduled(message_id):
+        return f"❌ Сообщения #{message_id} нет в очереди публикаций (или оно уже публикуется)"
+    logger.info(f"🗑 Сообщение #{message_id} снято с публикации")
+    return f"🗑 Сообщение #{message_id} снято с публикации и возвращено на модерацию (/pending)"
+
+def slow_command_text(limit=5):
+    reports = tracing.slow_report(limit)
+    if not reports:
+        return f"🐢 Медленных обновлений нет (порог {tracing.TRACE_SLOW_MS:g} мс)"
+    body = "\n\n".join(reports)
+    if len(body) > 3500:
+        body = body[:3500] + "\n…"
+    return f"🐢 <b>Медленные обновления</b> (порог {tracing.TRACE_SLOW_MS:g} мс):\n<pre>{html.escape(body)}</pre>"
+
+@bot.message_handler(commands=['slow'])
+def slow_command(message):
+    if message.from_user.id not in ADMIN_IDS:
         return
+    bot.send_message(message.chat.id, slow_command_text(), parse_mode='HTML')
+
+def maintenance_command_text(args):
+    if args and args[0] in ('run', 'convert'):
+        # Задачи выполняет поток обслуживания, обработчик команды не ждет их
+        try:
+            names = db_maintenance.request((args[1:] or None) if args[0] == 'run' else ['convert'])
+        except ValueError as e:
+            return f"❌ {html.escape(str(e))} (есть: {', '.join(db_maintenance.names())})"
+        maintenance_wakeup.wake()
+        return f"🧹 <b>Обслуживание БД запущено в фоне:</b> {', '.join(names)}\nРезультаты — в /maintenance"
+
+    info = retention.storage_info()
+    rollups = info['rollups']
+    lines = [
+        "🧹 <b>Хранение и обслуживание БД</b>",
+        f"📜 События и ошибки: {retention.EVENTS_RETENTION_DAYS:g} дн. целиком, затем почасовые сводки "
+        f"{retention.ROLLUP_HOURLY_DAYS:g} дн., затем суточные",
+        f"⏱ Сворачивание и vacuum раз в {retention.MAINTENANCE_INTERVAL / 60:g} мин, checkpoint раз в {retention.CHECKPOINT_INTERVAL / 60:g} мин",
+        f"🗄 База {info['size'] / 1048576:.1f} МБ (свободно {info['free'] / 1048576:.1f} МБ), WAL {info['wal'] / 1048576:.1f} МБ"
+        + ("" if info['incremental'] else ", incremental vacuum выключен"),
+        f"📊 Событий {info['raw_events']}, ошибок {info['raw_errors']}, сводок: часовых {rollups.get('hour', 0)}, суточных {rollups.get('day', 0)}",
+    ]
+    runs = retention.recent_runs(10)
+    if runs:
+        lines.append("\n<b>Последние запуски:</b>")
+        for task, started_at, duration, _, details in runs:
+            lines.append(f"• {started_at[5:16].replace('T', ' ')} {task} ({duration:.2f}с): {html.escape(details or '')}")
+    else:
+        lines.append("\nЗапусков еще не было (/maintenance run — выполнить сейчас)")
+    return "\n".join(lines)
 
+@bot.message_handler(commands=['maintenance'])
+def maintenance_command(message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    try:
+        bot.send_message(message.chat.id, maintenance_command_text(message.text.split()[1:]), parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"❌ Ошибка команды обслуживания: {e}")
+        bot.send_message(message.chat.id, "❌ Ошибка при обслуживании базы")
+
+def schedule_command_text(command_text):
+    command, *args = command_text.split()
+    command = command.lstrip('/').split('@')[0]
+    if command == 'move':
+        return move_command_text(args)
+    if command == 'unqueue':
+        return unqueue_command_text(args)
+    return queue_command_text()
+
+@bot.message_handler(commands=['queue', 'move', 'unqueue'])
+def schedule_command(message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    try:
+        bot.send_message(message.chat.id, schedule_command_text(message.text), parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"❌ Ошибка команды очереди публикаций: {e}")
+        bot.send_message(message.chat.id, "❌ Ошибка при работе с очередью публикаций")
+
+# === ЗАЩИТА ОТ ФЛУДА ===
+# Частота заявок ограничивается в памяти (flood.py) до записи в БД и уведомлений
+flood_limiter = flood.FloodLimiter()
+
+def wait_text(seconds):
+    if seconds >= 120:
+        return f"{seconds / 60:.0f} мин"
+    return f"{max(1, round(seconds))} сек"
+
+def flood_notice_text(wait):
+    return f"⏳ Слишком много сообщений подряд. Следующее можно отправить через {wait_text(wait)}"
+
+def flood_check(message):
+    # → (отклонить, предупреждение пользователю или None); админов не ограничиваем
     user = message.from_user
-    
-    if user.id in ADMIN_IDS and user.id in user_reply_mode:
+    if user.id in ADMIN_IDS:
+        return False, None
+    allowed, notify, wait = flood_limiter.check(user.id, message.media_group_id)
+    if allowed:
+        return False, None
+    update_log.info(f"🚫 Флуд от {user.first_name} (ID: {user.id}): заявка отклонена")
+    return True, flood_notice_text(wait) if notify else None
+
+def flood_blocked(message):
+    blocked, notice = flood_check(message)
+    if notice:
+        bot.send_message(message.chat.id, notice)
+    return blocked
+
+def flood_command_text(limit=20):
+    stats = flood_limiter.stats()
+    lines = [
+        "🚫 <b>Защита от флуда</b>",
+        html.escape(flood_limiter.describe()),
+        f"👥 Пользователей в памяти {stats['users']} (вытеснено {stats['evicted']}), "
+        f"заявок принято {stats['allowed']}, отклонено {stats['rejected']}",
+    ]
+    rows = flood_limiter.limited(limit)
+    if rows:
+        lines.append("\n<b>Ограниченные пользователи:</b>")
+        for user_id, rejected, left in rows:
+            lines.append(f"• <code>{user_id}</code>: отклонено {rejected}" + (f", пауза еще {wait_text(left)}" if left else ""))
+        lines.append("\n/unflood ID — снять ограничение, /unflood all — со всех")
+    else:
+        lines.append("\nОграниченных пользователей нет")
+    return "\n".join(lines)
+
+def unflood_command_text(args):
+    if args and args[0] == 'all':
+        count = flood_limiter.lift_all()
+        logger.info(f"🚫 Ограничения флуда сняты со всех ({count})")
+        return f"✅ Ограничения сняты со всех пользователей ({count})"
+    try:
+        user_id = int(args[0])
+    except (IndexError, ValueError):
+        return "❌ Использование: /unflood ID или /unflood all"
+    if not flood_limiter.lift(user_id):
+        return f"❌ Пользователь {user_id} не ограничен"
+    logger.info(f"🚫 Ограничение флуда снято с {user_id}")
+    return f"✅ Ограничение с пользователя {user_id} снято"
+
+def flood_admin_text(command_text):
+    command, *args = command_text.split()
+    if command.lstrip('/').split('@')[0] == 'unflood':
+        return unflood_command_text(args)
+    return flood_command_text()
+
+@bot.message_handler(commands=['flood', 'unflood'])
+def flood_command(message):
+    if message.from_user.id not in ADMIN_IDS:
         return
-    
-    logger.info(f"📝 Текст от {user.first_name} (ID: {user.id})")
+    bot.send_message(message.chat.id, flood_admin_text(message.text), parse_mode='HTML')
+
+# === ОБРАБОТЧИКИ СООБЩЕНИЙ ===
+def describe_submission(message):
+    # Тип, текст, file_id, file_unique_id и подтверждение пользователю для одиночного сообщения
+    content_type = message.content_type
+    if content_type == 'text':
+        return 'text', message.text, None, None, "✅ Сообщение отправлено админам"
+    if content_type == 'photo':
+        photo = message.photo[-1]
+        return 'photo', message.caption or '📷 Фото', photo.file_id, photo.file_unique_id, "✅ Фото отправлено админам"
+    if content_type == 'video':
+        return 'video', message.caption or '🎥 Видео', message.video.file_id, message.video.file_unique_id, "✅ Видео отправлено админам"
+    if content_type == 'voice':
+        return 'voice', '🎤 Голосовое сообщение', message.voice.file_id, message.voice.file_unique_id, "✅ Голосовое сообщение отправлено админам"
+    if content_type == 'document':
+        return 'document', message.caption or '📄 Документ', message.document.file_id, message.document.file_unique_id, "✅ Документ отправлен админам"
+    if content_type == 'sticker':
+        sticker_emoji = message.sticker.emoji or '🎭'
+        return 'sticker', f"{sticker_emoji} Стикер", message.sticker.file_id, message.sticker.file_unique_id, "✅ Стикер отправлен админам"
+    return None
+
+def submission_files(message_type, file_id, file_unique_id):
+    return [(file_id, file_unique_id, message_type)] if file_id else []
+
+# Повтор заявки, которая еще на модерации (dedup.py): ни новой строки, ни уведомлений
+REPEAT_ACK_TEXT = "🔁 Это уже ждет модерации, повторно отправлять не нужно"
+
+def count_repeat(user, message_id, message_type, repeats):
+    dedup.repeats_total.inc(message_type)
+    update_log.info(f"🔁 Повтор заявки #{message_id} от {user.first_name} (ID: {user.id}), повторов: {repeats}")
+
+def submit_user_message(message):
+    if flood_blocked(message):
+        return
+    message_type, text, file_id, file_unique_id, ack_text = describe_submission(message)
+    user = message.from_user
 
-    message_id = save_message_to_db(
+    message_id, repeats = save_message_to_db(
         user.id,
         user.first_name or 'User',
         user.username or '',
-        'text',
-        message.text
+        message_type,
+        text,
+        submission_files(message_type, file_id, file_unique_id)
     )
+    if repeats:
+        count_repeat(user, message_id, message_type, repeats)
+        bot.send_message(message.chat.id, REPEAT_ACK_TEXT)
+        return
 
-    bot.send_message(message.chat.id, "✅ Сообщение отправлено админам")
-    notify_admins(message_id, user, message.text, 'text', None, message.message_id)
+    bot.send_message(message.chat.id, ack_text)
+    notify_admins(message_id, user, text, message_type, file_id, message.message_id)
+
+@bot.message_handler(content_types=['text'])
+def handle_text(message):
+    if message.text.startswith('/'):
+        return
 
-@bot.message_handler(content_types=['photo'])
-def handle_photo(message):
     user = message.from_user
-    caption = message.caption or '📷 Фото'
     
-    file_id = message.photo[-1].file_id
+    if user.id in ADMIN_IDS and user.id in user_reply_mode:
+        return
     
+    update_log.info(f"📝 Текст от {user.first_name} (ID: {user.id})")
+    submit_user_message(message)
+
+@bot.message_handler(content_types=['photo'])
+def handle_photo(message):
     if message.media_group_id:
-        media_group_id = message.media_group_id
-        
-        if media_group_id not in media_groups:
-            media_groups[media_group_id] = {
-                'user': user,
-                'caption': caption,
-                'file_ids': [],
-                'timestamp': datetime.now()
-            }
-            threading.Timer(1.0, process_media_group, [media_group_id]).start()
-        
-        media_groups[media_group_id]['file_ids'].append(file_id)
-        
+        collect_album_item(message)
     else:
-        message_id = save_message_to_db(
-            user.id,
-            user.first_name or 'User',
-            user.username or '',
-            'photo',
-            caption,
-            file_id,
-            'photo'
-        )
-
-        bot.send_message(message.chat.id, "✅ Фото отправлено админам")
-        notify_admins(message_id, user, caption, 'photo', file_id, message.message_id)
+        submit_user_message(message)
 
 @bot.message_handler(content_types=['video'])
 def handle_video(message):
-    user = message.from_user
-    caption = message.caption or '🎥 Видео'
-    file_id = message.video.file_id
-
-    message_id = save_message_to_db(
-        user.id,
-        user.first_name or 'User',
-        user.username or '',
-        'video',
-        caption,
-        file_id,
-        'video'
-    )
-
-    bot.send_message(message.chat.id, "✅ Видео отправлено админам")
-    notify_admins(message_id, user, caption, 'video', file_id, message.message_id)
+    if message.media_group_id:
+        collect_album_item(message)
+    else:
+        submit_user_message(message)
 
 @bot.message_handler(content_types=['voice'])
 def handle_voice(message):
-    user = message.from_user
-    file_id = message.voice.file_id
-
-    message_id = save_message_to_db(
-        user.id,
-        user.first_name or 'User',
-        user.username or '',
-        'voice',
-        '🎤 Голосовое сообщение',
-        file_id,
-        'voice'
-    )
-
-    bot.send_message(message.chat.id, "✅ Голосовое сообщение отправлено админам")
-    notify_admins(message_id, user, '🎤 Голосовое сообщение', 'voice', file_id, message.message_id)
+    submit_user_message(message)
 
 @bot.message_handler(content_types=['document'])
 def handle_document(message):
-    user = message.from_user
-    caption = message.caption or '📄 Документ'
-    file_id = message.document.file_id
-
-    message_id = save_message_to_db(
-        user.id,
-        user.first_name or 'User',
-        user.username or '',
-        'document',
-        caption,
-        file_id,
-        'document'
-    )
-
-    bot.send_message(message.chat.id, "✅ Документ отправлен админам")
-    notify_admins(message_id, user, caption, 'document', file_id, message.message_id)
+    if message.media_group_id:
+        collect_album_item(message)
+    else:
+        submit_user_message(message)
 
 @bot.message_handler(content_types=['sticker'])
 def handle_sticker(message):
     user = message.from_user
-    logger.info(f"🎭 Стикер от {user.first_name} (ID: {user.id})")
-    
-    sticker_emoji = message.sticker.emoji or '🎭'
-    message_id = save_message_to_db(
-        user.id,
-        user.first_name or 'User',
-        user.username or '',
-        'sticker',
-        f"{sticker_emoji} Стикер",
-        message.sticker.file_id,
-        'sticker'
-    )
-
-    bot.send_message(message.chat.id, "✅ Стикер отправлен админам")
-    notify_admins(message_id, user, f"{sticker_emoji} Стикер", 'sticker', message.sticker.file_id, message.message_id)
+    update_log.info(f"🎭 Стикер от {user.first_name} (ID: {user.id})")
+    submit_user_message(message)
 
 # === УВЕДОМЛЕНИЯ АДМИНАМ ===
-def notify_admins(message_id, user, text, media_type, file_id=None, original_message_id=None):
+# Рассылка идет через пул: у каждого админа своя очередь (порядок сохраняется),
+# разные админы обслуживаются параллельно, а обработчик не ждет Telegram.
+admin_notifier = KeyedExecutor(NOTIFY_WORKERS, 'notify')
+
+def moderation_keyboard(message_id, publish_label, reply_label):
+    from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+    keyboard = InlineKeyboardMarkup()
+    keyboard.row(
+        InlineKeyboardButton(publish_label, callback_data=f"publish_normal_{message_id}"),
+        InlineKeyboardButton("🔄 Переслать", callback_data=f"publish_forward_{message_id}")
+    )
+    keyboard.row(
+        InlineKeyboardButton(reply_label, callback_data=f"reply_{message_id}"),
+        InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{message_id}")
+    )
+    return keyboard
+
+def admin_notification_text(message_id, user, text, media_type, file_count=None):
     icons = {'text': '📝', 'photo': '📷', 'video': '🎥', 'voice': '🎤', 'document': '📄', 'sticker': '🎭'}
     icon = icons.get(media_type, '📨')
     username_display = f"@{user.username}" if user.username else "нет юзернейма"
+    type_display = f"{media_type} ({file_count} шт.)" if file_count is not None else media_type
 
-    admin_msg = f"""{icon} <b>Новое сообщение</b> #{message_id}
+    return f"""{icon} <b>Новое сообщение</b> #{message_id}
 
 👤 <b>От:</b> {user.first_name} ({username_display})
 🆔 <b>ID:</b> {user.id}
-📋 <b>Тип:</b> {media_type}
+📋 <b>Тип:</b> {type_display}
 📝 <b>Текст:</b> {text if text else 'Нет текста'}"""
 
-    from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+def notify_admins(message_id, user, text, media_type, file_id=None, original_message_id=None):
+    admin_msg = admin_notification_text(message_id, user, text, media_type)
+    keyboard = moderation_keyboard(message_id, "📝 Опуб. не тыкать", "💬 Ответить")
 
     for admin_id in ADMIN_IDS:
-        try:
-            if media_type == 'photo' and file_id:
-                msg = bot.send_photo(admin_id, file_id, caption=admin_msg, parse_mode='HTML')
-            elif media_type == 'video' and file_id:
-                msg = bot.send_video(admin_id, file_id, caption=admin_msg, parse_mode='HTML')
-            elif media_type == 'voice' and file_id:
-                msg = bot.send_voice(admin_id, file_id, caption=admin_msg, parse_mode='HTML')
-            elif media_type == 'document' and file_id:
-                msg = bot.send_document(admin_id, file_id, caption=admin_msg, parse_mode='HTML')
-            elif media_type == 'sticker' and file_id:
-                bot.send_message(admin_id, admin_msg, parse_mode='HTML')
-                sent_sticker = bot.send_sticker(admin_id, file_id)
-                msg = sent_sticker
-            else:
-                msg = bot.send_message(admin_id, admin_msg, parse_mode='HTML')
-            
-            keyboard = InlineKeyboardMarkup()
-            keyboard.row(
-                InlineKeyboardButton("📝 Опуб. не тыкать", callback_data=f"publish_normal_{message_id}"),
-                InlineKeyboardButton("🔄 Переслать", callback_data=f"publish_forward_{message_id}")
-            )
-            keyboard.row(
-                InlineKeyboardButton("💬 Ответить", callback_data=f"reply_{message_id}"),
-                InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{message_id}")
-            )
-            
-            if media_type != 'sticker':
-                bot.edit_message_reply_markup(admin_id, msg.message_id, reply_markup=keyboard)
-            else:
-                bot.send_message(admin_id, "Выберите действие:", reply_markup=keyboard)
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка отправки админу {admin_id}: {e}")
+        sends = admin_notification_sends(admin_id, admin_msg, media_type, file_id, keyboard)
+        admin_notifier.submit(admin_id, send_admin_sends, admin_id, sends, message_id)
+
+def admin_notification_sends(admin_id, admin_msg, media_type, file_id, keyboard):
+    media_kwargs = {'caption': admin_msg, 'parse_mode': 'HTML', 'reply_markup': keyboard}
+    if media_type == 'photo' and file_id:
+        return [('send_photo', (admin_id, file_id), media_kwargs)]
+    elif media_type == 'video' and file_id:
+        return [('send_video', (admin_id, file_id), media_kwargs)]
+    elif media_type == 'voice' and file_id:
+        return [('send_voice', (admin_id, file_id), media_kwargs)]
+    elif media_type == 'document' and file_id:
+        return [('send_document', (admin_id, file_id), media_kwargs)]
+    elif media_type == 'sticker' and file_id:
+        return [
+            ('send_message', (admin_id, admin_msg), {'parse_mode': 'HTML'}),
+            ('send_sticker', (admin_id, file_id), {'reply_markup': keyboard}),
+        ]
+    return [('send_message', (admin_id, admin_msg), {'parse_mode': 'HTML', 'reply_markup': keyboard})]
+
+def send_admin_sends(admin_id, sends, message_id=None):
+    try:
+        result = run_sends(sends)
+    except Exception as e:
+        logger.error(f"❌ Ошибка отправки админу {admin_id}: {e}")
+        return
+    # Клавиатура модерации всегда в последнем сообщении плана: запоминаем его,
+    # чтобы после решения другого админа обновить кнопки
+    if message_id is not None and result is not None:
+        db.add_notification(message_id, admin_id, result.message_id)
+
+# Когда один админ принял решение, кнопки в уведомлениях остальных заменяются
+# итогом: повторные нажатия не уходят в БД, а админы видят, кто обработал заявку
+RESOLUTION_LABELS = {
+    'approved': '✅ Опубликовано',
+    'rejected': '❌ Отклонено',
+    'error': '⚠️ Ошибка публикации',
+}
+
+def notification_update_sends(notifications, message_id, status, admin_name, skip=None):
+    from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+    keyboard = InlineKeyboardMarkup()
+    keyboard.row(InlineKeyboardButton(
+        f"{RESOLUTION_LABELS.get(status, status)} — {admin_name}",
+        callback_data=f"view_{message_id}"
+    ))
+    plans = []
+    for chat_id, notification_id in notifications:
+        if (chat_id, notification_id) == skip:
+            continue
+        plans.append((chat_id, [('edit_message_reply_markup', (chat_id, notification_id), {'reply_markup': keyboard})]))
+    return plans
+
+def update_admin_notifications(message_id, status, admin_name, skip=None):
+    plans = notification_update_sends(db.get_notifications(message_id), message_id, status, admin_name, skip)
+    for chat_id, sends in plans:
+        admin_notifier.submit(chat_id, send_admin_sends, chat_id, sends)
 
 # === ОБРАБОТКА CALLBACK (ИСПРАВЛЕНА) ===
+def message_view_sends(chat_id, submission):
+    from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+    msg_id = submission.id
+    msg_type = submission.message_type
+    text = submission.text
+    file_id = submission.file_id
+    files = submission.files
+    username = submission.username
+
+    username_display = f"@{username}" if username else "нет юзернейма"
+    
+    file_count = len(files) or 1
+    detail_text = f"""📋 <b>Детали сообщения #{msg_id}</b>
+
+👤 <b>Пользователь:</b> {submission.user_name} ({username_display})
+🆔 <b>ID пользователя:</b> {submission.user_id}
+📋 <b>Тип:</b> {msg_type} ({file_count} шт.)
+📝 <b>Текст:</b> {text if text else 'Нет текста'}
+⏰ <b>Время:</b> {submission.timestamp[:16]}
+📊 <b>Статус:</b> {submission.status}"""
+
+    if submission.repeats:
+        detail_text += f"\n🔁 <b>Прислано повторно:</b> {submission.repeats} раз"
+
+    if submission.admin_reply:
+        detail_text += f"\n💬 <b>Ответ админа:</b> {submission.admin_reply}"
+
+    sends = [('send_message', (chat_id, detail_text), {'parse_mode': 'HTML'})]
+
+    if msg_type in ALBUM_MEDIA and len(files) > 1:
+        caption = f"{ALBUM_LABELS[msg_type]} 1 из {len(files)} из сообщения #{msg_id}"
+        file_ids, file_types = zip(*files)
+        sends.append(('send_media_group', (chat_id, album_media(file_ids, file_types, caption)), {}))
+
+    elif msg_type == 'photo' and file_id:
+        sends.append(('send_photo', (chat_id, file_id), {'caption': f"📷 Фото из сообщения #{msg_id}"}))
+    elif msg_type == 'video' and file_id:
+        sends.append(('send_video', (chat_id, file_id), {'caption': f"🎥 Видео из сообщения #{msg_id}"}))
+    elif msg_type == 'document' and file_id:
+        sends.append(('send_document', (chat_id, file_id), {'caption': f"📄 Документ из сообщения #{msg_id}"}))
+    elif msg_type == 'voice' and file_id:
+        sends.append(('send_voice', (chat_id, file_id), {'caption': f"🎤 Голосовое из сообщения #{msg_id}"}))
+
+    keyboard = InlineKeyboardMarkup()
+    keyboard.row(
+        InlineKeyboardButton("💬 Ответить", callback_data=f"reply_{msg_id}"),
+        InlineKeyboardButton("📝 Опуб. не тыкать", callback_data=f"publish_normal_{msg_id}")
+    )
+    keyboard.row(
+        InlineKeyboardButton("🔄 Переслать", callback_data=f"publish_forward_{msg_id}"),
+        InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{msg_id}")
+    )
+
+    sends.append(('send_message', (chat_id, "Выберите действие:"), {'reply_markup': keyboard}))
+    return sends
+
+def already_processed_text(status):
+    status_texts = {
+        'approved': '✅ уже одобрено',
+        'rejected': '❌ уже отклонено', 
+        'error': '⚠️ ошибка публикации',
+        'publishing': '⏳ уже публикуется другим админом'
+    }
+    return f"Сообщение {status_texts.get(status, status)}"
+
+def claim_failed_text(message_id):
+    submission = get_message_from_db(message_id, fresh=True)
+    if not submission:
+        return "❌ Сообщение не найдено"
+    return already_processed_text(submission.status)
+
+def queued_text(message_id):
+    return f"⏳ Сообщение #{message_id} в очереди на публикацию"
+
+def publish_result_text(message_id, action, success, file_count):
+    if success:
+        action_text = "опубликовано" if action == 'normal' else "отправлено для пересылки"
+        logger.info(f"✅ Сообщение #{message_id} {action_text} ({file_count} файлов)")
+        return f"✅ Сообщение #{message_id} {action_text}"
+    return f"❌ Сообщение #{message_id} не удалось отправить"
+
+def reply_context_text(message_id, submission):
+    user_name = submission.user_name
+    message_text = submission.text or ''
+    
+    context_text = f"💬 <b>Ответ на сообщение #{message_id}</b>\n\n"
+    context_text += f"👤 <b>Пользователь:</b> {user_name}\n"
+    context_text += f"📝 <b>Сообщение:</b> {message_text[:100]}{'...' if len(message_text) > 100 else ''}\n\n"
+    context_text += "✍️ <b>Введите ваш ответ:</b>"
+    return context_text
+
+def edit_moderation_message(chat_id, message_id, admin_name, status_text):
+    try:
+        bot.edit_message_text(
+            f"{status_text}\n👤 Обработал: {admin_name}", 
+            chat_id, 
+            message_id,
+            reply_markup=None
+        )
+    except:
+        bot.send_message(chat_id, f"{status_text}\n👤 Обработал: {admin_name}")
+
+def finish_moderation(call, status_text):
+    edit_moderation_message(call.message.chat.id, call.message.message_id, call.from_user.first_name, status_text)
+
 @bot.callback_query_handler(func=lambda call: True)
 def handle_callback(call):
-    logger.info(f"🔄 Callback: {call.data} от {call.from_user.id}")
+    update_log.info(f"🔄 Callback: {call.data} от {call.from_user.id}")
 
     if call.from_user.id not in ADMIN_IDS:
         bot.answer_callback_query(call.id, "❌ Нет прав для модерации")
@@ -793,171 +1175,58 @@ def handle_callback(call):
     try:
         if call.data.startswith('view_'):
             message_id = int(call.data.split('_')[1])
-            message_data = get_message_from_db(message_id)
+            submission = get_message_from_db(message_id)
 
-            if not message_data:
+            if not submission:
                 bot.answer_callback_query(call.id, "❌ Сообщение не найдено")
                 return
 
-            if len(message_data) > 13:
-                msg_id, user_id, user_name, username, text, msg_type, file_id, file_type, timestamp, status, admin_reply, reply_sent, publish_type, all_file_ids = message_data
-            else:
-                msg_id, user_id, user_name, username, text, msg_type, file_id, file_type, timestamp, status, admin_reply, reply_sent, publish_type = message_data
-                all_file_ids = [file_id]
-
-            username_display = f"@{username}" if username else "нет юзернейма"
-            
-            file_count = len(all_file_ids) if isinstance(all_file_ids, list) else 1
-            detail_text = f"""📋 <b>Детали сообщения #{msg_id}</b>
-
-👤 <b>Пользователь:</b> {user_name} ({username_display})
-🆔 <b>ID пользователя:</b> {user_id}
-📋 <b>Тип:</b> {msg_type} ({file_count} шт.)
-📝 <b>Текст:</b> {text if text else 'Нет текста'}
-⏰ <b>Время:</b> {timestamp[:16]}
-📊 <b>Статус:</b> {status}"""
-
-            if admin_reply:
-                detail_text += f"\n💬 <b>Ответ админа:</b> {admin_reply}"
-
-            bot.send_message(call.message.chat.id, detail_text, parse_mode='HTML')
-
-            if msg_type == 'photo':
-                if isinstance(all_file_ids, list) and len(all_file_ids) > 1:
-                    media = []
-                    for i, photo_id in enumerate(all_file_ids):
-                        media.append(telebot.types.InputMediaPhoto(
-                            photo_id,
-                            caption=f"📷 Фото {i+1} из {len(all_file_ids)} из сообщения #{msg_id}" if i == 0 else None
-                        ))
-                    bot.send_media_group(call.message.chat.id, media)
-                elif file_id:
-                    bot.send_photo(call.message.chat.id, file_id, caption=f"📷 Фото из сообщения #{msg_id}")
-            
-            elif msg_type == 'video' and file_id:
-                bot.send_video(call.message.chat.id, file_id, caption=f"🎥 Видео из сообщения #{msg_id}")
-            elif msg_type == 'document' and file_id:
-                bot.send_document(call.message.chat.id, file_id, caption=f"📄 Документ из сообщения #{msg_id}")
-            elif msg_type == 'voice' and file_id:
-                bot.send_voice(call.message.chat.id, file_id, caption=f"🎤 Голосовое из сообщения #{msg_id}")
-
-            from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-            
-            keyboard = InlineKeyboardMarkup()
-            keyboard.row(
-                InlineKeyboardButton("💬 Ответить", callback_data=f"reply_{msg_id}"),
-                InlineKeyboardButton("📝 Опуб. не тыкать", callback_data=f"publish_normal_{msg_id}")
-            )
-            keyboard.row(
-                InlineKeyboardButton("🔄 Переслать", callback_data=f"publish_forward_{msg_id}"),
-                InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{msg_id}")
-            )
-
-            bot.send_message(call.message.chat.id, "Выберите действие:", reply_markup=keyboard)
+            run_sends(message_view_sends(call.message.chat.id, submission))
             bot.answer_callback_query(call.id, "✅ Детали сообщения")
 
         elif call.data.startswith('publish_normal_') or call.data.startswith('publish_forward_'):
             message_id = int(call.data.split('_')[2])
             action = call.data.split('_')[1]
-            message_data = get_message_from_db(message_id)
-            
-            if not message_data:
-                bot.answer_callback_query(call.id, "❌ Сообщение не найдено")
-                return
-                
-            if len(message_data) > 13:
-                msg_id, user_id, user_name, username, text, msg_type, file_id, file_type, timestamp, status, admin_reply, reply_sent, publish_type, all_file_ids = message_data
-            else:
-                msg_id, user_id, user_name, username, text, msg_type, file_id, file_type, timestamp, status, admin_reply, reply_sent, publish_type = message_data
-                all_file_ids = [file_id]
-                
-            if status != 'pending':
-                status_texts = {
-                    'approved': '✅ уже одобрено',
-                    'rejected': '❌ уже отклонено', 
-                    'error': '⚠️ ошибка публикации'
-                }
-                bot.answer_callback_query(call.id, f"Сообщение {status_texts.get(status, status)}")
+
+            # Заявку публикует только тот, чей UPDATE ... WHERE status = 'pending' прошел;
+            # в той же транзакции ставится задача публикации
+            job_id = db.enqueue_publish(
+                message_id, call.from_user.id, action, call.from_user.first_name,
+                call.message.chat.id, call.message.message_id
+            )
+            if job_id is None:
+                bot.answer_callback_query(call.id, claim_failed_text(message_id))
                 return
 
-            update_publish_type(message_id, action)
-            
-            message_data_for_send = {
-                'message_type': msg_type,
-                'text': text,
-                'file_id': file_id,
-                'file_ids': all_file_ids if isinstance(all_file_ids, list) else [file_id]
-            }
-            
-            if action == 'forward':
-                success = send_to_channel(message_data_for_send, 'forward', call.from_user.id)
-            else:
-                success = send_to_channel(message_data_for_send, 'normal')
-
-            conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-            cursor = conn.cursor()
-            if success:
-                cursor.execute("UPDATE messages SET status = 'approved' WHERE id = ?", (message_id,))
-                action_text = "опубликовано" if action == 'normal' else "отправлено для пересылки"
-                status_text = f"✅ Сообщение #{message_id} {action_text}"
-                logger.info(f"✅ Сообщение #{message_id} {action_text} ({len(all_file_ids) if isinstance(all_file_ids, list) else 1} файлов)")
-            else:
-                cursor.execute("UPDATE messages SET status = 'error' WHERE id = ?", (message_id,))
-                status_text = f"❌ Сообщение #{message_id} не удалось отправить"
-            conn.commit()
-            conn.close()
-
-            try:
-                bot.edit_message_text(
-                    f"{status_text}\n👤 Обработал: {call.from_user.first_name}", 
-                    call.message.chat.id, 
-                    call.message.message_id,
-                    reply_markup=None
-                )
-            except:
-                bot.send_message(call.message.chat.id, f"{status_text}\n👤 Обработал: {call.from_user.first_name}")
+            publish_wakeup.wake()
+            logger.info(f"📤 Сообщение #{message_id} поставлено в очередь публикации (задача #{job_id})")
+            finish_moderation(call, queued_text(message_id))
 
         elif call.data.startswith('reply_'):
             message_id = int(call.data.split('_')[1])
-            message_data = get_message_from_db(message_id)
+            submission = get_message_from_db(message_id)
             
-            if not message_data:
+            if not submission:
                 bot.answer_callback_query(call.id, "❌ Сообщение не найдено")
                 return
             
             user_reply_mode[call.from_user.id] = message_id
             
-            user_name = message_data[2]
-            message_text = message_data[4]
-            
-            context_text = f"💬 <b>Ответ на сообщение #{message_id}</b>\n\n"
-            context_text += f"👤 <b>Пользователь:</b> {user_name}\n"
-            context_text += f"📝 <b>Сообщение:</b> {message_text[:100]}{'...' if len(message_text) > 100 else ''}\n\n"
-            context_text += "✍️ <b>Введите ваш ответ:</b>"
-            
-            bot.send_message(call.message.chat.id, context_text, parse_mode='HTML')
+            bot.send_message(call.message.chat.id, reply_context_text(message_id, submission), parse_mode='HTML')
             bot.answer_callback_query(call.id, "💬 Введите ответ пользователю")
 
         elif call.data.startswith('reject_'):
             message_id = int(call.data.split('_')[1])
-            conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE messages SET status = 'rejected' WHERE id = ?", (message_id,))
-            conn.commit()
-            conn.close()
+            if not db.claim_message(message_id, call.from_user.id, 'rejected'):
+                bot.answer_callback_query(call.id, claim_failed_text(message_id))
+                return
 
-            status_text = f"❌ Сообщение #{message_id} отклонено"
             logger.info(f"❌ Сообщение #{message_id} отклонено")
-
-            try:
-                bot.edit_message_text(
-                    f"{status_text}\n👤 Обработал: {call.from_user.first_name}", 
-                    call.message.chat.id, 
-                    call.message.message_id,
-                    reply_markup=None
-                )
-            except:
-                bot.send_message(call.message.chat.id, f"{status_text}\n👤 Обработал: {call.from_user.first_name}")
+            finish_moderation(call, f"❌ Сообщение #{message_id} отклонено")
+            update_admin_notifications(
+                message_id, 'rejected', call.from_user.first_name,
+                skip=(call.message.chat.id, call.message.message_id)
+            )
 
         bot.answer_callback_query(call.id, "✅ Действие выполнено")
 
@@ -965,28 +1234,158 @@ def handle_callback(call):
         logger.error(f"❌ Ошибка callback: {e}")
         bot.answer_callback_query(call.id, "❌ Ошибка обработки")
 
+# === МЕТРИКИ ===
+# Обработчики выше уже зарегистрированы: оборачиваем их таймерами.
+# Gauge по БД обновляет фоновый поток metrics, сам /metrics в базу не ходит.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+metrics.instrument_api()
+metrics.instrument_handlers(bot)
+
+def pending_age(oldest):
+    return max(0.0, time.time() - oldest) if oldest else 0
+
+metrics.Gauge('bot_outbound_queue_depth', 'Запросы в очереди планировщика исходящих', lambda: outbound_scheduler.stats()['queue_depth'])
+metrics.Gauge('bot_album_open_groups', 'Альбомы, которые еще собираются', lambda: album_aggregator.open_groups())
+metrics.Gauge('bot_webhook_queue_depth', 'Обновления webhook в очередях воркеров', lambda: webhook_workers.pending())
+metrics.Gauge('bot_uptime_seconds', 'Время работы процесса', lambda: (datetime.now() - BOT_START_TIME).total_seconds())
+metrics.Gauge('bot_flood_tracked_users', 'Пользователи в памяти защиты от флуда', lambda: flood_limiter.stats()['users'])
+metrics.Gauge('bot_error_count', 'Текущий счетчик ошибок мониторинга здоровья', lambda: error_count.value)
+metrics.SampledGauge('bot_pending_backlog_age_seconds', 'Возраст самой старой заявки на модерации', db.oldest_pending_time, transform=pending_age)
+metrics.SampledGauge('bot_pending_messages', 'Заявки на модерации', lambda: db.count_stats()['pending_messages'])
+metrics.Gauge('bot_health_component_ok', 'Последняя проверка компонента здоровья успешна', health_status.component_ok, ('component',))
+metrics.SampledGauge('bot_publish_jobs', 'Задачи публикации по состоянию', lambda: {(state,): count for state, count in db.job_stats().items()}, ('state',))
+
 # === WEBHOOK И FLASK ===
 @app.route('/')
 def home():
     return "🤖 Бот работает! Статус: ONLINE"
 
+# /health — прежний ответ для существующих проверок (текст, 500 при сбое);
+# снимок с компонентами в JSON отдают /health/live и /health/ready
 @app.route('/health')
 def health_endpoint():
-    if health_check():
+    if health_status.ready():
         return "OK", 200
     else:
         return "ERROR", 500
 
-def delete_webhook():
+@app.route('/health/live')
+def liveness_endpoint():
+    status = health_status.status()
+    return jsonify(status), 200 if status['live'] else 503
+
+@app.route('/health/ready')
+def readiness_endpoint():
+    status = health_status.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        return "Forbidden", 403
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Входящие обновления раскладываются по воркерам по id чата: порядок сообщений
+# одного пользователя сохраняется, а при переполнении очереди Telegram получает
+# 503 и повторит доставку позже.
+class RecentIds:
+    def __init__(self, limit):
+        self.limit = limit
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        with self._lock:
+            if item in self._ids:
+                return False
+            self._ids[item] = None
+            if len(self._ids) > self.limit:
+                self._ids.popitem(last=False)
+            return True
+
+    def discard(self, item):
+        with self._lock:
+            self._ids.pop(item, None)
+
+webhook_workers = KeyedExecutor(WEBHOOK_WORKERS, 'webhook', max_queue=WEBHOOK_QUEUE_SIZE)
+recent_updates = RecentIds(10000)
+webhook_stats = {'received': 0, 'duplicates': 0, 'rejected': 0, 'processed': 0}
+webhook_stats_lock = threading.Lock()
+webhook_latencies = deque(maxlen=10000)
+
+def count_webhook(name):
+    with webhook_stats_lock:
+        webhook_stats[name] += 1
+
+def update_shard_key(update):
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    return update.update_id
+
+def process_webhook_update(update):
+    started = time.perf_counter()
     try:
-        logger.info("🔄 Удаление webhook...")
-        bot.remove_webhook()
-        time.sleep(1)
-        logger.info("✅ Webhook удален")
-        return True
+        bot.process_new_updates([update])
+    finally:
+        webhook_latencies.append(time.perf_counter() - started)
+        count_webhook('processed')
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def webhook():
+    if BOT_MODE != 'webhook':
+        return "Not Found", 404
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(token, WEBHOOK_SECRET):
+        return "Forbidden", 403
+
+    try:
+        if shard_pool.running:
+            # Разбор и обработка — в процессе-воркере, сюда нужен только ключ
+            update = json.loads(request.get_data(as_text=True))
+            update_id, key = update['update_id'], shards.shard_key(update)
+        else:
+            update = telebot.types.Update.de_json(request.get_data(as_text=True))
+            update_id, key = update.update_id, update_shard_key(update)
     except Exception as e:
-        logger.error(f"❌ Ошибка удаления webhook: {e}")
-        return False
+        logger.error(f"❌ Некорректное обновление webhook: {e}")
+        return "Bad Request", 400
+
+    count_webhook('received')
+    health.beat('webhook')
+    if not recent_updates.add(update_id):
+        count_webhook('duplicates')
+        return "OK", 200
+
+    if shard_pool.running:
+        accepted = shard_pool.offer(key, update)
+    else:
+        accepted = webhook_workers.offer(key, process_webhook_update, update)
+    if not accepted:
+        recent_updates.discard(update_id)
+        count_webhook('rejected')
+        return "Busy", 503
+
+    return "OK", 200
+
+def set_webhook(drop_pending=True):
+    bot.remove_webhook()
+    bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_WORKERS,
+        drop_pending_updates=drop_pending
+    )
+    logger.info(f"✅ Webhook установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+def delete_webhook():
+    # Ошибку разбирает вызывающий (проверки запуска)
+    logger.info("🔄 Удаление webhook...")
+    bot.remove_webhook()
+    logger.info("✅ Webhook удален")
+    return True
 
 def auto_ping():
     time.sleep(15)
@@ -999,10 +1398,12 @@ def auto_ping():
             logger.error(f"❌ Ошибка авто-пинга: {e}")
         time.sleep(300)
 
-def run_flask():
-    time.sleep(5)
+def run_flask(delay=0):
+    time.sleep(delay)
     
     ports = [8080, 8081, 8082, 8083, 8084]
+    if os.environ.get('PORT'):
+        ports.insert(0, int(os.environ['PORT']))
     
     for port in ports:
         try:
@@ -1019,33 +1420,272 @@ def run_flask():
     else:
         logger.error("❌ Не удалось запустить Flask сервер: все порты заняты")
 
-if __name__ == "__main__":
-    logger.info("🚀 Запуск бота...")
-    logger.info(f"📁 База данных: {DB_PATH}")
-    
+# === ЗАВЕРШЕНИЕ РАБОТЫ ===
+def shutdown():
+    global HEALTH_MONITOR_RUNNING
+    HEALTH_MONITOR_RUNNING = False
+    shard_pool.stop()
+    publish_wakeup.stop()
+    maintenance_wakeup.stop()
+    webhook_workers.stop()
+    album_aggregator.stop()
+    album_workers.stop()
+    publish_workers.stop()
+    db_maintenance.stop()
+    admin_notifier.stop()
+    db.stop_writer()
+    db.close_all()
+    logs.stop()
+
+atexit.register(shutdown)
+
+def handle_stop_signal(signum, frame):
+    logger.info(f"🛑 Получен сигнал {signum}, останавливаемся...")
+    bot.stop_polling()
+    sys.exit(0)
+
+# === ЗАПУСК ===
+# Фазы запуска и теплый рестарт — см. startup.py. Проверки Bot API (getMe,
+# getChat, установка или удаление webhook) идут параллельно; при теплом рестарте —
+# фоном, и обновления, пришедшие за время перезапуска, не пропускаются.
+STARTUP_STATE_PATH = os.path.join(DATA_DIR, 'startup_state.json')
+POLLING_RESTART_DELAY = float(os.environ.get('POLLING_RESTART_DELAY', '1'))
+POLLING_RESTART_MAX = 60
+
+def startup_identity():
+    # Теплый рестарт возможен, только если бот, канал и режим не менялись
+    return {
+        'bot_id': (BOT_TOKEN or '').split(':')[0],
+        'channel': CHANNEL_USERNAME,
+        'mode': BOT_MODE,
+        'webhook_url': WEBHOOK_URL if BOT_MODE == 'webhook' else None,
+    }
+
+def check_bot():
+    info = bot.get_me()
+    return {'first_name': info.first_name, 'username': info.username}
+
+def check_channel():
+    return bot.get_chat(CHANNEL_USERNAME).title
+
+def startup_checks(warm, report=False):
+    checks = [('getMe', check_bot), ('getChat', check_channel)]
+    if report:
+        # Отчет ничего не меняет в Telegram: вместо установки или удаления webhook — чтение
+        checks.append(('getWebhookInfo', bot.get_webhook_info))
+    elif BOT_MODE == 'webhook':
+        checks.append(('setWebhook', lambda: set_webhook(drop_pending=not warm)))
+    else:
+        checks.append(('deleteWebhook', delete_webhook))
+    return checks
+
+def apply_startup_checks(results, save=True):
+    # True, если без провалившихся проверок работать нельзя (нет доступа к боту или webhook)
+    me, channel = results['getMe'], results['getChat']
+    if me.ok:
+        logger.info(f"✅ Бот запущен: {me.value['first_name']} (@{me.value['username']})")
+    else:
+        logger.error(f"❌ Ошибка доступа к боту: {me.error}")
+        logger.error("⚠️ Проверьте правильность BOT_TOKEN")
+    if channel.ok:
+        logger.info(f"✅ Канал найден: {channel.value}")
+    else:
+        logger.error(f"❌ Ошибка доступа к каналу {CHANNEL_USERNAME}: {channel.error}")
+        logger.error("⚠️ Проверьте: 1) Юзернейм канала 2) Бот добавлен как администратор")
+    for name in ('setWebhook', 'deleteWebhook', 'getWebhookInfo'):
+        if name in results and not results[name].ok:
+            logger.error(f"❌ {name}: {results[name].error}")
+
+    if save and all(result.ok for result in results.values()):
+        startup.save_state(STARTUP_STATE_PATH, dict(startup_identity(), bot=me.value, channel_title=channel.value))
+    elif save:
+        startup.forget_state(STARTUP_STATE_PATH)
+    return not me.ok or ('setWebhook' in results and not results['setWebhook'].ok)
+
+def apply_background_checks(results):
+    logger.info(f"📡 Фоновые проверки Bot API: {startup.describe(results)}")
+    if apply_startup_checks(results):
+        log_error('startup', "проверка Bot API после теплого рестарта не прошла")
+
+def start_workers():
+    db.start_writer()
+    admin_notifier.start()
+    album_workers.start()
+    album_aggregator.start()
     log_bot_event('start', f"Bot started at {BOT_START_TIME}")
 
+    metrics.start()
+
     health_monitor_thread = threading.Thread(target=health_monitor, daemon=True)
     health_monitor_thread.start()
     logger.info("❤️ Мониторинг здоровья запущен")
 
-    delete_webhook()
+    db_maintenance.start()
 
     ping_thread = threading.Thread(target=auto_ping, daemon=True)
     ping_thread.start()
 
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    if shards.BOT_PROCESSES > 1:
+        shard_pool.start(logs.shared_queue(), (message_count.share(), error_count.share()),
+                        (publish_wakeup.share(), maintenance_wakeup.share()))
+    elif BOT_MODE == 'webhook':
+        webhook_workers.start()
+    # Асинхронный движок запускает очередь публикаций из своего event loop
+    if BOT_ENGINE == 'threaded':
+        publish_workers.start()
+
+def start(report=False):
+    # Возвращает True для теплого рестарта; report — только замер фаз, без потоков
+    phases = startup.phases
+    phases.since_start('импорт модулей')
+    with phases.phase('конфигурация'):
+        check_config()
+    with phases.phase('папка данных'):
+        prepare_data_dir()
+    with phases.phase('логирование'):
+        logs.setup(os.path.join(DATA_DIR, 'bot_health.log'), shards.BOT_PROCESSES)
+    # atexit вызывает функции в обратном порядке: перерегистрируем shutdown после
+    # logs.setup, чтобы он отработал раньше финализаторов межпроцессной очереди логов
+    atexit.unregister(shutdown)
+    atexit.register(shutdown)
+    logger.info("🚀 Запуск бота...")
+    with phases.phase('база данных'):
+        version = init_db()
+
+    warm = startup.warm_state(STARTUP_STATE_PATH, **startup_identity()) is not None
+    checks = startup_checks(warm, report)
+    if warm and not report:
+        startup.run_checks_background(checks, apply_background_checks)
+        phases.add('Bot API', 0.0, 'фоном (теплый рестарт)', local=False)
+    else:
+        started = time.perf_counter()
+        results = startup.run_checks(checks)
+        phases.add('Bot API (параллельно)', time.perf_counter() - started, startup.describe(results), local=False)
+        if apply_startup_checks(results, save=not report) and not report:
+            exit(1)
+
+    if report:
+        print(f"⏱ Отчет о запуске: схема v{version}, теплый рестарт {'возможен' if warm else 'невозможен (нет свежего startup_state.json)'}")
+        for line in phases.report():
+            print(line)
+        return warm
+
+    with phases.phase('фоновые потоки'):
+        start_workers()
+    logger.info(
+        f"🚀 {'Теплый' if warm else 'Холодный'} запуск: локальная работа {phases.local_seconds() * 1000:.0f} мс, "
+        f"ожидание Bot API {phases.network_seconds() * 1000:.0f} мс"
+    )
+    return warm
 
-    logger.info("🤖 Запуск polling...")
+def run_polling(skip_pending=True):
+    # Перезапуск после ошибки теплый: БД, воркеры и webhook уже готовы, заново
+    # запускается только цикл polling, и накопившиеся обновления не пропускаются
+    delay = POLLING_RESTART_DELAY
+    while True:
+        logger.info("🤖 Запуск polling...")
+        try:
+            bot.infinity_polling(skip_pending=skip_pending, timeout=60, long_polling_timeout=30)
+            return
+        except Exception as e:
+            logger.error(f"❌ Ошибка polling: {e}")
+            log_error('polling', str(e))
+            log_bot_event('restart', f"Restart due to error: {e}")
+            logger.info(f"🔄 Перезапуск polling через {delay:g} секунд...")
+            time.sleep(delay)
+            delay = min(delay * 2, POLLING_RESTART_MAX)
+            skip_pending = False
+
+# === НЕСКОЛЬКО ПРОЦЕССОВ ===
+# При BOT_PROCESSES > 1 этот процесс только получает обновления и раскладывает
+# их по процессам-воркерам (shards.py); воркер — тот же модуль, запущенный через run_shard.
+def process_update_json(update):
+    bot.process_new_updates([telebot.types.Update.de_json(update)])
+
+def run_shard(index, count, updates, log_queue, counters, wakeups):
+    # Модуль импортирован в воркере как __mp_main__ (или bot): пусть import bot находит его же
+    sys.modules.setdefault('bot', sys.modules[__name__])
+    # Останавливает воркер главный процесс (None в очереди): Ctrl+C приходит всей группе
+    # процессов, его игнорируем; SIGTERM оставляем — им multiprocessing снимает зависший воркер
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logs.attach(log_queue)
+    message_count.attach(counters[0])
+    error_count.attach(counters[1])
+    publish_wakeup.attach(wakeups[0])
+    maintenance_wakeup.attach(wakeups[1])
+
+    # Порядок обработки задает executor по ключу шарда, а не пул потоков TeleBot
+    bot.threaded = False
+    db.start_writer()
+    admin_notifier.start()
+    album_workers.start()
+    album_aggregator.start()
+    executor = KeyedExecutor(shards.SHARD_THREADS, f"shard{index}")
+    executor.start()
+    logger.info(f"🧩 Процесс-воркер {index + 1}/{count} запущен (pid {os.getpid()})")
     try:
-        bot.infinity_polling(skip_pending=True, timeout=60, long_polling_timeout=30)
-    except Exception as e:
-        logger.error(f"❌ Ошибка polling: {e}")
-        log_error('polling', str(e))
-        logger.info("🔄 Перезапуск polling через 10 секунд...")
-        log_bot_event('restart', f"Restart due to error: {e}")
-        time.sleep(10)
-        delete_webhook()
-        bot.infinity_polling(skip_pending=True, timeout=60, long_polling_timeout=30)
+        shards.serve(updates, lambda update: executor.submit(shards.shard_key(update), process_update_json, update))
+    finally:
+        executor.stop()
+        shutdown()
+
+shard_pool = shards.ShardPool(shards.BOT_PROCESSES, run_shard)
+
+def run_sharded_polling(skip_pending=True):
+    # getUpdates отдает обновления одному получателю — этому процессу
+    offset = None
+    if skip_pending:
+        pending = telebot.apihelper.get_updates(BOT_TOKEN, offset=-1)
+        if pending:
+            offset = pending[-1]['update_id'] + 1
+    delay = POLLING_RESTART_DELAY
+    logger.info(f"🤖 Запуск polling с раздачей по {shards.BOT_PROCESSES} процессам...")
+    while True:
+        try:
+            updates = telebot.apihelper.get_updates(BOT_TOKEN, offset, 100, 60, None, 30)
+        except Exception as e:
+            logger.error(f"❌ Ошибка polling: {e}")
+            log_error('polling', str(e))
+            time.sleep(delay)
+            delay = min(delay * 2, POLLING_RESTART_MAX)
+            continue
+        delay = POLLING_RESTART_DELAY
+        for update in updates:
+            shard_pool.dispatch(shards.shard_key(update), update)
+            offset = update['update_id'] + 1
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, handle_stop_signal)
 
+    if '--startup-report' in sys.argv[1:]:
+        start(report=True)
+        sys.exit(0)
+
+    warm = start()
+
+    if BOT_ENGINE == 'async':
+        # bot_async импортирует этот модуль как bot: не даем ему выполниться второй раз
+        sys.modules['bot'] = sys.modules[__name__]
+        import bot_async
+        bot_async.main(skip_pending=not warm)
+        sys.exit(0)
+
+    if BOT_MODE == 'webhook':
+        logger.info("🪝 Запуск в режиме webhook...")
+        try:
+            run_flask()
+        finally:
+            shard_pool.stop()
+        sys.exit(0)
+
+    flask_thread = threading.Thread(target=run_flask, daemon=True)
+    flask_thread.start()
+
+    if shard_pool.running:
+        # Воркеры дорабатывают очереди до atexit (там multiprocessing просто завершает их)
+        try:
+            run_sharded_polling(skip_pending=not warm)
+        finally:
+            shard_pool.stop()
+    else:
+        run_polling(skip_pending=not warm)
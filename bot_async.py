@@ -0,0 +1,499 @@
+import os
+import sys
+import asyncio
+import logging
+import contextvars
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+import bot
+import db
+import outbound
+import albums
+import jobs
+import pacing
+import metrics
+import tracing
+import logs
+
+logger = logging.getLogger(__name__)
+update_log = logs.SampledLogger(logger)
+
+# === АСИНХРОННЫЙ ДВИЖОК (BOT_ENGINE=async) ===
+# Все обновления обслуживает один event loop: пока запрос к Bot API ждет ответа,
+# поток не простаивает, а обрабатывает следующие обновления. HTTP идет через одну
+# сессию aiohttp с ограниченным пулом соединений, SQLite (синхронный модуль) —
+# через пул потоков размером с пул соединений БД. Тексты, клавиатуры и планы
+# отправки берутся из bot.py, поэтому поведение обоих движков совпадает.
+# Альбомы собирает тот же albums.MediaGroupAggregator, готовый альбом
+# передается в event loop. Очередь публикаций — те же jobs.JobWorkers:
+# их потоки выполняют отправку корутиной в event loop и ждут результата.
+
+HTTP_CONNECTIONS = int(os.environ.get('ASYNC_HTTP_CONNECTIONS', '50'))
+
+asyncio_helper.REQUEST_LIMIT = HTTP_CONNECTIONS
+if bot.BOT_API_URL:
+    asyncio_helper.API_URL = bot.BOT_API_URL
+
+abot = AsyncTeleBot(bot.BOT_TOKEN)
+scheduler = outbound.AsyncOutboundScheduler(classify=bot.outbound_priority)
+outbound.install(abot, scheduler)
+
+db_executor = ThreadPoolExecutor(max_workers=db.POOL_SIZE, thread_name_prefix='db')
+loop = None
+background_tasks = set()
+admin_locks = defaultdict(asyncio.Lock)
+
+
+async def run_db(func, *args):
+    # Контекст (текущий span трассы) переносится в поток БД
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(context.run, func, *args))
+
+
+def spawn(coro):
+    # Держим ссылку на задачу, иначе сборщик мусора может удалить ее до завершения
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def run_sends(sends):
+    result = None
+    for method, args, kwargs in sends:
+        result = await getattr(abot, method)(*args, **kwargs)
+    return result
+
+
+async def save_message(user, message_type, text, files=()):
+    future = bot.submit_message_to_db(
+        user.id,
+        user.first_name or 'User',
+        user.username or '',
+        message_type,
+        text,
+        files
+    )
+    return await asyncio.wrap_future(future)
+
+
+# === УВЕДОМЛЕНИЯ АДМИНАМ ===
+# Каждому админу — своя задача; блокировка на админа сохраняет порядок уведомлений
+async def send_to_admin(admin_id, sends, message_id=None):
+    async with admin_locks[admin_id]:
+        try:
+            result = await run_sends(sends)
+        except Exception as e:
+            logger.error(f"❌ Ошибка отправки админу {admin_id}: {e}")
+            return
+    if message_id is not None and result is not None:
+        db.add_notification(message_id, admin_id, result.message_id)
+
+
+def update_admin_notifications(message_id, status, admin_name, skip, notifications):
+    plans = bot.notification_update_sends(notifications, message_id, status, admin_name, skip)
+    for chat_id, sends in plans:
+        spawn(send_to_admin(chat_id, sends))
+
+
+def notify_admins(message_id, user, text, media_type, file_id=None):
+    admin_msg = bot.admin_notification_text(message_id, user, text, media_type)
+    keyboard = bot.moderation_keyboard(message_id, "📝 Опуб. не тыкать", "💬 Ответить")
+    for admin_id in bot.ADMIN_IDS:
+        spawn(send_to_admin(admin_id, bot.admin_notification_sends(admin_id, admin_msg, media_type, file_id, keyboard), message_id))
+
+
+def notify_admins_group(message_id, user, text, media_type, file_ids, file_types):
+    admin_msg = bot.admin_notification_text(message_id, user, text, media_type, len(file_ids))
+    keyboard = bot.moderation_keyboard(message_id, "📝 Обычная публикация", "💬 Ответить пользователю")
+    for admin_id in bot.ADMIN_IDS:
+        spawn(send_to_admin(admin_id, bot.admin_group_notification_sends(admin_id, admin_msg, file_ids, file_types, keyboard), message_id))
+
+
+# === ОЧЕРЕДЬ ПУБЛИКАЦИЙ ===
+async def execute_publish_job(job):
+    sends = await run_db(bot.publish_job_sends, job)
+    for step in range(job.step, len(sends)):
+        method, args, kwargs = sends[step]
+        await getattr(abot, method)(*args, **kwargs)
+        await run_db(db.advance_job, job.id, step + 1)
+        job.step = step + 1
+
+
+async def publish_job_finished(job, success, error=None):
+    if not success:
+        await run_db(bot.log_error, 'send_to_channel', error)
+    status_text = await run_db(bot.publish_job_result_text, job, success)
+    skip = None
+    if job.reply_chat_id:
+        skip = (job.reply_chat_id, job.reply_message_id)
+        await edit_moderation_message(job.reply_chat_id, job.reply_message_id, job.admin_name, status_text)
+    notifications = await run_db(db.get_notifications, job.message_id)
+    update_admin_notifications(job.message_id, 'approved' if success else 'error', job.admin_name, skip, notifications)
+
+
+def in_loop(coro_func):
+    # Вызов из потока воркера: корутина выполняется в event loop, поток ждет ее результата
+    def run(*args):
+        return asyncio.run_coroutine_threadsafe(coro_func(*args), loop).result()
+    return run
+
+
+publish_workers = jobs.JobWorkers(in_loop(execute_publish_job), in_loop(publish_job_finished), pacer=pacing.pacer)
+
+
+# === ОБРАБОТКА ГРУПП МЕДИА ===
+async def process_media_group(group):
+    with tracing.trace('process_media_group', group.group_id):
+        user = group.user
+        media_type = group.media_type
+        caption = group.caption or bot.ALBUM_LABELS.get(media_type, '📎 Альбом')
+        message_id, repeats = await save_message(user, media_type, caption, zip(group.file_ids, group.file_unique_ids, group.file_types))
+        if repeats:
+            bot.count_repeat(user, message_id, media_type, repeats)
+            await abot.send_message(group.chat_id, bot.REPEAT_ACK_TEXT)
+            return
+
+        await abot.send_message(group.chat_id, bot.album_ack_text(media_type, len(group.file_ids)))
+        notify_admins_group(message_id, user, caption, media_type, group.file_ids, group.file_types)
+
+
+def album_ready(group):
+    # Вызывается из потока сборщика альбомов
+    loop.call_soon_threadsafe(lambda: spawn(process_media_group(group)))
+
+
+album_aggregator = albums.MediaGroupAggregator(album_ready)
+
+
+async def flood_blocked(message):
+    blocked, notice = bot.flood_check(message)
+    if notice:
+        await abot.send_message(message.chat.id, notice)
+    return blocked
+
+
+async def collect_album_item(message):
+    if await flood_blocked(message):
+        return
+    message_type, _, file_id, file_unique_id, _ = bot.describe_submission(message)
+    album_aggregator.add(message.media_group_id, message.from_user, message.chat.id, message_type, file_id, file_unique_id, message.caption)
+
+
+# === ОБРАБОТЧИКИ ===
+@abot.message_handler(func=lambda message: message.from_user.id in bot.ADMIN_IDS and message.text and not message.text.startswith('/'))
+async def handle_admin_reply(message):
+    admin_id = message.from_user.id
+
+    # Режим ответа хранится в SQLite (shards.SharedMap): как и остальная БД — через run_db
+    target_message_id = await run_db(bot.user_reply_mode.pop, admin_id)
+    if target_message_id is None:
+        await handle_text(message)
+        return
+
+    try:
+        message_data = await run_db(db.get_reply_target, target_message_id)
+
+        if not message_data:
+            await abot.send_message(admin_id, "❌ Сообщение не найдено в базе данных")
+            return
+
+        user_id, user_name, original_text = message_data
+        try:
+            reply_text = f"💬 <b>Ответ от администратора:</b>\n\n{message.text}"
+            await abot.send_message(user_id, reply_text, parse_mode='HTML')
+
+            await run_db(bot.update_admin_reply, target_message_id, message.text, True)
+
+            await abot.send_message(admin_id, f"✅ Ответ отправлен пользователю {user_name}")
+            logger.info(f"💬 Ответ админа {admin_id} отправлен пользователю {user_id}")
+
+        except Exception as e:
+            await abot.send_message(admin_id, f"❌ Не удалось отправить ответ пользователю: {e}")
+            logger.error(f"❌ Ошибка отправки ответа пользователю: {e}")
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка обработки ответа админа: {e}")
+        await abot.send_message(admin_id, "❌ Ошибка при обработке ответа")
+
+
+@abot.message_handler(commands=['start'])
+async def start(message):
+    user = message.from_user
+    update_log.info(f"👤 /start от {user.first_name} (ID: {user.id})")
+    await abot.send_message(message.chat.id, bot.START_TEXT, parse_mode='HTML')
+
+
+@abot.message_handler(commands=['help'])
+async def help_command(message):
+    await abot.send_message(message.chat.id, bot.HELP_TEXT, parse_mode='HTML')
+
+
+@abot.message_handler(commands=['stats'])
+async def stats_command(message):
+    if message.from_user.id not in bot.ADMIN_IDS:
+        await abot.send_message(message.chat.id, "❌ Нет прав для просмотра статистики")
+        return
+
+    try:
+        stats = await run_db(bot.get_bot_stats)
+        stats['outbound'] = scheduler.stats()
+        await abot.send_message(message.chat.id, bot.stats_text(stats), parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"❌ Ошибка статистики: {e}")
+        await abot.send_message(message.chat.id, "❌ Ошибка при получении статистики")
+
+
+@abot.message_handler(commands=['rebuild_stats'])
+async def rebuild_stats_command(message):
+    if message.from_user.id not in bot.ADMIN_IDS:
+        await abot.send_message(message.chat.id, "❌ Нет прав для пересчета статистики")
+        return
+
+    try:
+        await run_db(db.rebuild_counters)
+        await abot.send_message(message.chat.id, "✅ Статистика пересчитана по исходным таблицам")
+    except Exception as e:
+        logger.error(f"❌ Ошибка пересчета статистики: {e}")
+        await abot.send_message(message.chat.id, "❌ Ошибка при пересчете статистики")
+
+
+@abot.message_handler(commands=['pending'])
+async def pending_messages(message):
+    if message.from_user.id not in bot.ADMIN_IDS:
+        return
+
+    try:
+        pending = await run_db(db.get_pending, 10)
+
+        if not pending:
+            await abot.send_message(message.chat.id, "📭 Нет сообщений, ожидающих модерации")
+            return
+
+        await abot.send_message(message.chat.id, "📋 <b>Сообщения ожидающие модерации:</b>", parse_mode='HTML')
+
+        for msg in pending:
+            message_text, quick_keyboard = bot.pending_item(msg)
+            await abot.send_message(message.chat.id, message_text, parse_mode='HTML', reply_markup=quick_keyboard)
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения ожидающих сообщений: {e}")
+        await abot.send_message(message.chat.id, "❌ Ошибка при получении списка сообщений")
+
+
+@abot.message_handler(commands=['slow'])
+async def slow_command(message):
+    if message.from_user.id not in bot.ADMIN_IDS:
+        return
+    await abot.send_message(message.chat.id, bot.slow_command_text(), parse_mode='HTML')
+
+
+@abot.message_handler(commands=['maintenance'])
+async def maintenance_command(message):
+    if message.from_user.id not in bot.ADMIN_IDS:
+        return
+
+    try:
+        text = await run_db(bot.maintenance_command_text, message.text.split()[1:])
+        await abot.send_message(message.chat.id, text, parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"❌ Ошибка команды обслуживания: {e}")
+        await abot.send_message(message.chat.id, "❌ Ошибка при обслуживании базы")
+
+
+@abot.message_handler(commands=['queue', 'move', 'unqueue'])
+async def schedule_command(message):
+    if message.from_user.id not in bot.ADMIN_IDS:
+        return
+
+    try:
+        text = await run_db(bot.schedule_command_text, message.text)
+        await abot.send_message(message.chat.id, text, parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"❌ Ошибка команды очереди публикаций: {e}")
+        await abot.send_message(message.chat.id, "❌ Ошибка при работе с очередью публикаций")
+
+
+@abot.message_handler(commands=['flood', 'unflood'])
+async def flood_command(message):
+    if message.from_user.id not in bot.ADMIN_IDS:
+        return
+    await abot.send_message(message.chat.id, bot.flood_admin_text(message.text), parse_mode='HTML')
+
+
+async def submit_user_message(message):
+    if await flood_blocked(message):
+        return
+    message_type, text, file_id, file_unique_id, ack_text = bot.describe_submission(message)
+    user = message.from_user
+
+    message_id, repeats = await save_message(user, message_type, text, bot.submission_files(message_type, file_id, file_unique_id))
+    if repeats:
+        bot.count_repeat(user, message_id, message_type, repeats)
+        await abot.send_message(message.chat.id, bot.REPEAT_ACK_TEXT)
+        return
+
+    await abot.send_message(message.chat.id, ack_text)
+    notify_admins(message_id, user, text, message_type, file_id)
+
+
+@abot.message_handler(content_types=['text'])
+async def handle_text(message):
+    if message.text.startswith('/'):
+        return
+
+    user = message.from_user
+    if user.id in bot.ADMIN_IDS and await run_db(bot.user_reply_mode.get, user.id) is not None:
+        return
+
+    update_log.info(f"📝 Текст от {user.first_name} (ID: {user.id})")
+    await submit_user_message(message)
+
+
+@abot.message_handler(content_types=['photo', 'video', 'document'])
+async def handle_media(message):
+    if message.media_group_id:
+        await collect_album_item(message)
+    else:
+        await submit_user_message(message)
+
+
+@abot.message_handler(content_types=['voice'])
+async def handle_voice(message):
+    await submit_user_message(message)
+
+
+@abot.message_handler(content_types=['sticker'])
+async def handle_sticker(message):
+    user = message.from_user
+    update_log.info(f"🎭 Стикер от {user.first_name} (ID: {user.id})")
+    await submit_user_message(message)
+
+
+# === CALLBACK ===
+async def edit_moderation_message(chat_id, message_id, admin_name, status_text):
+    text = f"{status_text}\n👤 Обработал: {admin_name}"
+    try:
+        await abot.edit_message_text(text, chat_id, message_id, reply_markup=None)
+    except Exception:
+        await abot.send_message(chat_id, text)
+
+
+async def finish_moderation(call, status_text):
+    await edit_moderation_message(call.message.chat.id, call.message.message_id, call.from_user.first_name, status_text)
+
+
+@abot.callback_query_handler(func=lambda call: True)
+async def handle_callback(call):
+    update_log.info(f"🔄 Callback: {call.data} от {call.from_user.id}")
+
+    if call.from_user.id not in bot.ADMIN_IDS:
+        await abot.answer_callback_query(call.id, "❌ Нет прав для модерации")
+        return
+
+    try:
+        if call.data.startswith('view_'):
+            message_id = int(call.data.split('_')[1])
+            submission = await run_db(bot.get_message_from_db, message_id)
+
+            if not submission:
+                await abot.answer_callback_query(call.id, "❌ Сообщение не найдено")
+                return
+
+            await run_sends(bot.message_view_sends(call.message.chat.id, submission))
+            await abot.answer_callback_query(call.id, "✅ Детали сообщения")
+
+        elif call.data.startswith('publish_normal_') or call.data.startswith('publish_forward_'):
+            message_id = int(call.data.split('_')[2])
+            action = call.data.split('_')[1]
+            job_id = await run_db(
+                db.enqueue_publish, message_id, call.from_user.id, action, call.from_user.first_name,
+                call.message.chat.id, call.message.message_id
+            )
+            if job_id is None:
+                await abot.answer_callback_query(call.id, await run_db(bot.claim_failed_text, message_id))
+                return
+
+            publish_workers.wake()
+            logger.info(f"📤 Сообщение #{message_id} поставлено в очередь публикации (задача #{job_id})")
+            await finish_moderation(call, bot.queued_text(message_id))
+
+        elif call.data.startswith('reply_'):
+            message_id = int(call.data.split('_')[1])
+            submission = await run_db(bot.get_message_from_db, message_id)
+
+            if not submission:
+                await abot.answer_callback_query(call.id, "❌ Сообщение не найдено")
+                return
+
+            await run_db(bot.user_reply_mode.set, call.from_user.id, message_id)
+
+            await abot.send_message(call.message.chat.id, bot.reply_context_text(message_id, submission), parse_mode='HTML')
+            await abot.answer_callback_query(call.id, "💬 Введите ответ пользователю")
+
+        elif call.data.startswith('reject_'):
+            message_id = int(call.data.split('_')[1])
+            if not await run_db(db.claim_message, message_id, call.from_user.id, 'rejected'):
+                await abot.answer_callback_query(call.id, await run_db(bot.claim_failed_text, message_id))
+                return
+
+            logger.info(f"❌ Сообщение #{message_id} отклонено")
+            await finish_moderation(call, f"❌ Сообщение #{message_id} отклонено")
+            update_admin_notifications(
+                message_id, 'rejected', call.from_user.first_name, (call.message.chat.id, call.message.message_id),
+                await run_db(db.get_notifications, message_id)
+            )
+
+        await abot.answer_callback_query(call.id, "✅ Действие выполнено")
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка callback: {e}")
+        await abot.answer_callback_query(call.id, "❌ Ошибка обработки")
+
+
+# === МЕТРИКИ ===
+# Запросы AsyncTeleBot, обработчики и очереди этого движка вместо очередей bot.py
+metrics.instrument_async_api()
+metrics.instrument_handlers(abot, metrics.timed_async_handler)
+metrics.Gauge('bot_outbound_queue_depth', 'Запросы в очереди планировщика исходящих', lambda: scheduler.stats()['queue_depth'])
+metrics.Gauge('bot_album_open_groups', 'Альбомы, которые еще собираются', lambda: album_aggregator.open_groups())
+
+
+# === ЗАПУСК ===
+async def polling(skip_pending=True):
+    global loop
+    loop = asyncio.get_running_loop()
+    album_aggregator.start()
+    await loop.run_in_executor(None, publish_workers.start)
+    try:
+        await abot.infinity_polling(skip_pending=skip_pending, timeout=60, request_timeout=90)
+    finally:
+        album_aggregator.stop()
+        # Воркеры ждут корутины в этом же loop: останавливаем их из другого потока
+        await loop.run_in_executor(None, publish_workers.stop)
+        await asyncio.sleep(0)
+        if background_tasks:
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+        await abot.close_session()
+
+
+def main(skip_pending=True):
+    # Webhook удален, БД и общие воркеры запущены в bot.start()
+    if bot.BOT_MODE == 'webhook':
+        logger.error("❌ BOT_ENGINE=async поддерживает только BOT_MODE=polling")
+        sys.exit(1)
+
+    flask_thread = threading.Thread(target=bot.run_flask, daemon=True)
+    flask_thread.start()
+
+    logger.info(f"⚡ Запуск асинхронного polling (HTTP-соединений: {HTTP_CONNECTIONS}, потоков БД: {db.POOL_SIZE})...")
+    try:
+        asyncio.run(polling(skip_pending))
+    finally:
+        db_executor.shutdown(wait=True)
@@ -0,0 +1,939 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import partial
+from datetime import datetime, timedelta
+
+from models import submission_row, publish_job_row
+from metrics import db_seconds
+
+logger = logging.getLogger(__name__)
+
+# === СЛОЙ ДОСТУПА К БАЗЕ ДАННЫХ ===
+# Все обращения к SQLite идут через пул долгоживущих соединений.
+# Соединение открывается один раз, переводится в WAL и держит кэш
+# подготовленных выражений, поэтому на каждый запрос не тратится
+# время на connect/close и повторный разбор SQL.
+# Время запросов и транзакций пишется в гистограмму bot_db_seconds (metrics.py).
+
+DB_PATH = None
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = 10
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    # Действует для новой базы; существующую переводит /maintenance convert (retention.convert_vacuum)
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    # После checkpoint файл WAL обрезается до 64 МБ, а не остается размером с пик
+    "PRAGMA journal_size_limit = 67108864",
+    "PRAGMA foreign_keys = ON",
+)
+
+_idle = queue.LifoQueue()
+_all_connections = []
+_pool_lock = threading.Lock()
+_local = threading.local()
+_pid = os.getpid()
+
+
+def configure(db_path, pool_size=None):
+    global DB_PATH, POOL_SIZE
+    close_all()
+    DB_PATH = db_path
+    if pool_size:
+        POOL_SIZE = pool_size
+
+
+def _open_connection():
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        timeout=5,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _reset_after_fork():
+    # Соединения, унаследованные от родительского процесса, использовать нельзя
+    global _idle, _all_connections, _pool_lock, _local, _pid
+    _idle = queue.LifoQueue()
+    _all_connections = []
+    _pool_lock = threading.Lock()
+    _local = threading.local()
+    _pid = os.getpid()
+
+
+def _acquire():
+    if os.getpid() != _pid:
+        _reset_after_fork()
+
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.depth += 1
+        return conn
+
+    try:
+        conn = _idle.get_nowait()
+    except queue.Empty:
+        conn = None
+        with _pool_lock:
+            if len(_all_connections) < POOL_SIZE:
+                conn = _open_connection()
+                _all_connections.append(conn)
+        if conn is None:
+            try:
+                conn = _idle.get(timeout=POOL_TIMEOUT)
+            except queue.Empty:
+                raise sqlite3.OperationalError("Пул соединений исчерпан")
+
+    _local.conn = conn
+    _local.depth = 1
+    return conn
+
+
+def _release(conn):
+    _local.depth -= 1
+    if _local.depth:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    if conn in _all_connections:
+        _idle.put(conn)
+
+
+@contextmanager
+def connection():
+    conn = _acquire()
+    try:
+        yield conn
+    finally:
+        _release(conn)
+
+
+@contextmanager
+def transaction():
+    # Вложенные transaction() в одном потоке работают внутри внешней транзакции
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        with db_seconds.time('transaction'):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+
+def execute(sql, params=()):
+    with db_seconds.time('execute'), connection() as conn:
+        return conn.execute(sql, params)
+
+
+def fetchone(sql, params=(), row_factory=None):
+    with db_seconds.time('fetchone'), connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = row_factory
+        return cursor.execute(sql, params).fetchone()
+
+
+def fetchall(sql, params=(), row_factory=None):
+    with db_seconds.time('fetchall'), connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = row_factory
+        return cursor.execute(sql, params).fetchall()
+
+
+def close_all():
+    if os.getpid() != _pid:
+        _reset_after_fork()
+        return
+    with _pool_lock:
+        connections = list(_all_connections)
+        _all_connections.clear()
+    while True:
+        try:
+            _idle.get_nowait()
+        except queue.Empty:
+            break
+    for conn in connections:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка закрытия соединения с БД: {e}")
+    if connections:
+        logger.info(f"🔒 Соединения с БД закрыты ({len(connections)})")
+
+
+# === ОТЛОЖЕННАЯ ГРУППОВАЯ ЗАПИСЬ ===
+# Вставки из обработчиков складываются в очередь, фоновый поток
+# коммитит их пачками: до WRITE_BATCH_SIZE строк или раз в WRITE_FLUSH_MS.
+# При WRITE_FLUSH_MS = 0 поток не ждёт, а коммитит всё, что накопилось,
+# пока шла предыдущая транзакция. Вызывающий получает Future с rowid.
+# Запись, которой нужно несколько выражений (сообщение и его файлы),
+# передаётся функцией op(conn) и попадает в ту же пачку целиком.
+
+WRITE_BATCH_SIZE = int(os.environ.get('DB_WRITE_BATCH_SIZE', '100'))
+WRITE_FLUSH_MS = int(os.environ.get('DB_WRITE_FLUSH_MS', '0'))
+
+_STOP = object()
+
+
+def _insert(sql, params, conn):
+    return conn.execute(sql, params).lastrowid
+
+
+def _apply_single(op, future):
+    try:
+        with transaction() as conn:
+            result = op(conn)
+    except Exception as e:
+        future.set_exception(e)
+    else:
+        future.set_result(result)
+
+
+class GroupCommitWriter:
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, flush_ms=WRITE_FLUSH_MS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._accepting = False
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._accepting
+
+    def start(self):
+        with self._lock:
+            if self._accepting:
+                return
+            self._accepting = True
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+        logger.info(f"✍️ Групповая запись в БД запущена (пачка {self.batch_size}, {int(self.flush_interval * 1000)} мс)")
+
+    def submit(self, sql, params=()):
+        return self.submit_op(partial(_insert, sql, params))
+
+    def submit_op(self, op):
+        future = Future()
+        with self._lock:
+            if self._accepting:
+                self._queue.put((op, future))
+                return future
+        _apply_single(op, future)
+        return future
+
+    def stop(self, timeout=30):
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info(f"✍️ Групповая запись остановлена: {self.rows} строк в {self.batches} транзакциях")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                # Сначала забираем всё, что уже накопилось, и только потом ждём до дедлайна
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stopping:
+                return
+
+    def _commit(self, batch):
+        try:
+            with transaction() as conn:
+                results = [op(conn) for op, _ in batch]
+        except Exception as e:
+            # Пачка откатилась целиком: повторяем по одной, чтобы ошибку получила только виновная запись
+            logger.error(f"❌ Ошибка групповой записи ({len(batch)} строк): {e}")
+            for op, future in batch:
+                _apply_single(op, future)
+            return
+        self.batches += 1
+        self.rows += len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+writer = GroupCommitWriter()
+
+
+def start_writer():
+    writer.start()
+
+
+def stop_writer():
+    writer.stop()
+
+
+# === КЭШ ЗАЯВОК ===
+# Один сценарий модерации читает заявку несколько раз (просмотр, ответ,
+# публикация), а при нескольких админах — еще чаще. Заявки кэшируются
+# в LRU с TTL; любое изменение строки через этот модуль удаляет ее из кэша.
+# Чтобы чтение, начатое до изменения, не положило в кэш старую версию,
+# читатель берет token() до запроса, а put() отклоняется, если ключ
+# инвалидировали после этого момента.
+
+SUBMISSION_CACHE_SIZE = int(os.environ.get('SUBMISSION_CACHE_SIZE', '1024'))
+SUBMISSION_CACHE_TTL = float(os.environ.get('SUBMISSION_CACHE_TTL', '300'))
+
+
+class LRUCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._items = OrderedDict()
+        self._invalidated = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > time.monotonic():
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def token(self):
+        with self._lock:
+            return self._clock
+
+    def put(self, key, value, token=None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if token is not None and self._invalidated.get(key, self._floor) > token:
+                return
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+            self._clock += 1
+            self._invalidated.pop(key, None)
+            self._invalidated[key] = self._clock
+            self.invalidations += 1
+            if len(self._invalidated) > self.maxsize * 4:
+                # Старые отметки забываем, запоминая самую позднюю из них как нижнюю границу
+                while len(self._invalidated) > self.maxsize:
+                    _, self._floor = self._invalidated.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._clock += 1
+            self._floor = self._clock
+            self._invalidated.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+submission_cache = LRUCache(SUBMISSION_CACHE_SIZE, SUBMISSION_CACHE_TTL)
+
+
+# === ЗАПРОСЫ ===
+SQL_INSERT_MESSAGE = (
+    "INSERT INTO messages (user_id, user_name, username, message_text, message_type, file_id, file_type, timestamp, status) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')"
+)
+SQL_INSERT_FILE = (
+    "INSERT INTO message_files (message_id, position, file_id, file_unique_id, media_type) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+# Сообщение и его файлы одним запросом: файлы берутся по первичному ключу message_files
+SQL_SELECT_MESSAGE = (
+    "SELECT m.id, m.user_id, m.user_name, m.username, m.message_text, m.message_type, m.file_id, m.file_type, "
+    "m.timestamp, m.status, m.admin_reply, m.reply_sent, m.publish_type, m.repeats, f.file_id, f.media_type "
+    "FROM messages m LEFT JOIN message_files f ON f.message_id = m.id "
+    "WHERE m.id = ? ORDER BY f.position"
+)
+SQL_SELECT_FILES = "SELECT file_id, media_type FROM message_files WHERE message_id = ? ORDER BY position"
+SQL_SELECT_PENDING = (
+    "SELECT id, user_id, user_name, username, message_text, message_type, file_id, file_type, "
+    "timestamp, status, admin_reply, reply_sent, publish_type, repeats "
+    "FROM messages WHERE status = 'pending' ORDER BY id DESC LIMIT ?"
+)
+SQL_UPDATE_STATUS = "UPDATE messages SET status = ? WHERE id = ?"
+SQL_UPDATE_PUBLISH_TYPE = "UPDATE messages SET publish_type = ? WHERE id = ?"
+SQL_UPDATE_ADMIN_REPLY = "UPDATE messages SET admin_reply = ?, reply_sent = ? WHERE id = ?"
+SQL_INSERT_EVENT = "INSERT INTO bot_stats (event_type, event_time, details) VALUES (?, ?, ?)"
+SQL_INSERT_NOTIFICATION = (
+    "INSERT OR IGNORE INTO admin_notifications (message_id, chat_id, notification_id) VALUES (?, ?, ?)"
+)
+SQL_SELECT_NOTIFICATIONS = "SELECT chat_id, notification_id FROM admin_notifications WHERE message_id = ?"
+
+
+def _insert_message(params, files, conn):
+    message_id = conn.execute(SQL_INSERT_MESSAGE, params).lastrowid
+    conn.executemany(SQL_INSERT_FILE, [
+        (message_id, position, file_id, file_unique_id, media_type)
+        for position, (file_id, file_unique_id, media_type) in enumerate(files)
+    ])
+    return message_id
+
+
+def _message_params(user_id, user_name, username, message_type, text, files):
+    # files — список (file_id, file_unique_id, media_type); в messages остается первый файл
+    file_id, _, file_type = files[0] if files else (None, None, None)
+    return (user_id, user_name, username, text, message_type, file_id, file_type, datetime.now().isoformat())
+
+
+def submit_message(user_id, user_name, username, message_type, text, files=()):
+    files = list(files)
+    params = _message_params(user_id, user_name, username, message_type, text, files)
+    return writer.submit_op(partial(_insert_message, params, files))
+
+
+def insert_message(user_id, user_name, username, message_type, text, files=()):
+    return submit_message(user_id, user_name, username, message_type, text, files).result()
+
+
+def _load_message(message_id):
+    rows = fetchall(SQL_SELECT_MESSAGE, (message_id,))
+    if not rows:
+        return None
+    submission = submission_row(None, rows[0][:14])
+    submission._files = [(row[14], row[15]) for row in rows if row[14] is not None]
+    return submission
+
+
+def get_message(message_id, fresh=False):
+    # Submission вместе с файлами или None. fresh=True читает мимо кэша —
+    # так делает публикация, где решение принимается по статусу
+    if not fresh:
+        submission = submission_cache.get(message_id)
+        if submission is not None:
+            return submission
+    token = submission_cache.token()
+    submission = _load_message(message_id)
+    if submission is not None:
+        submission_cache.put(message_id, submission, token)
+    return submission
+
+
+def get_files(message_id):
+    return fetchall(SQL_SELECT_FILES, (message_id,))
+
+
+def get_reply_target(message_id):
+    # Автор и текст заявки не меняются, поэтому берутся из кэша
+    submission = get_message(message_id)
+    if submission is None:
+        return None
+    return submission.user_id, submission.user_name, submission.text
+
+
+def get_pending(limit=10):
+    # Файлы заявок из списка подгружаются лениво, только если понадобятся
+    return fetchall(SQL_SELECT_PENDING, (limit,), submission_row)
+
+
+def set_status(message_id, status):
+    try:
+        execute(SQL_UPDATE_STATUS, (status, message_id))
+    finally:
+        submission_cache.invalidate(message_id)
+
+
+def set_publish_type(message_id, publish_type):
+    try:
+        execute(SQL_UPDATE_PUBLISH_TYPE, (publish_type, message_id))
+    finally:
+        submission_cache.invalidate(message_id)
+
+
+def set_admin_reply(message_id, reply_text, reply_sent=False):
+    try:
+        execute(SQL_UPDATE_ADMIN_REPLY, (reply_text, reply_sent, message_id))
+    finally:
+        submission_cache.invalidate(message_id)
+
+
+# === ПОВТОРНЫЕ ЗАЯВКИ ===
+# Отпечаток заявки считает dedup.py; здесь — поиск ожидающей заявки с тем же
+# отпечатком и вставка новой, одной операцией групповой записи
+SQL_FIND_REPEAT = (
+    "SELECT h.message_id FROM submission_hashes h JOIN messages m ON m.id = h.message_id "
+    "WHERE h.user_id = ? AND h.content_hash = ? AND h.seen_at >= ? AND m.status = 'pending'"
+)
+SQL_COUNT_REPEAT = "UPDATE messages SET repeats = repeats + 1 WHERE id = ?"
+SQL_SELECT_REPEATS = "SELECT repeats FROM messages WHERE id = ?"
+SQL_TOUCH_HASH = "UPDATE submission_hashes SET seen_at = ? WHERE user_id = ? AND content_hash = ?"
+SQL_UPSERT_HASH = (
+    "INSERT INTO submission_hashes (user_id, content_hash, message_id, seen_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (user_id, content_hash) DO UPDATE SET message_id = excluded.message_id, seen_at = excluded.seen_at"
+)
+
+
+def _insert_unique_message(params, files, content_hash, window, conn):
+    if content_hash is None:
+        return _insert_message(params, files, conn), 0
+    user_id = params[0]
+    now = time.time()
+    row = conn.execute(SQL_FIND_REPEAT, (user_id, content_hash, now - window)).fetchone()
+    if row is not None:
+        message_id = row[0]
+        conn.execute(SQL_COUNT_REPEAT, (message_id,))
+        conn.execute(SQL_TOUCH_HASH, (now, user_id, content_hash))
+        return message_id, conn.execute(SQL_SELECT_REPEATS, (message_id,)).fetchone()[0]
+    message_id = _insert_message(params, files, conn)
+    conn.execute(SQL_UPSERT_HASH, (user_id, content_hash, message_id, now))
+    return message_id, 0
+
+
+def _forget_repeated(future):
+    if future.exception() is None:
+        message_id, repeats = future.result()
+        if repeats:
+            submission_cache.invalidate(message_id)
+
+
+def submit_unique_message(user_id, user_name, username, message_type, text, files, content_hash, window):
+    # → Future с (id заявки, повторов). Повтор (тот же отпечаток за window секунд,
+    # пока исходная заявка на модерации) строку не создает: у исходной растет repeats.
+    # content_hash=None — без проверки
+    files = list(files)
+    params = _message_params(user_id, user_name, username, message_type, text, files)
+    future = writer.submit_op(partial(_insert_unique_message, params, files, content_hash, window))
+    future.add_done_callback(_forget_repeated)
+    return future
+
+
+# === ЗАХВАТ ЗАЯВОК МОДЕРАТОРАМИ ===
+# Публикация и отклонение начинаются с атомарного UPDATE ... WHERE status = 'pending':
+# строку получает ровно один админ (rowcount = 1), остальные видят, что она занята.
+# Публикующий держит промежуточный статус 'publishing'; захват, не завершенный
+# за CLAIM_TIMEOUT секунд (упал процесс, завис запрос), можно перехватить,
+# а expire_claims() возвращает такие заявки в 'pending'. Захват, за которым
+# стоит незавершенная задача в publish_jobs, не истекает: его держит очередь.
+
+CLAIM_TIMEOUT = int(os.environ.get('CLAIM_TIMEOUT', '120'))
+
+SQL_ACTIVE_JOB = (
+    "EXISTS (SELECT 1 FROM publish_jobs j WHERE j.message_id = messages.id AND j.state IN ('queued', 'running'))"
+)
+SQL_CLAIM = (
+    "UPDATE messages SET status = ?, claimed_by = ?, claimed_at = ? "
+    "WHERE id = ? AND (status = 'pending' OR (status = 'publishing' AND claimed_at < ? AND NOT " + SQL_ACTIVE_JOB + "))"
+)
+SQL_EXPIRE_CLAIMS = (
+    "UPDATE messages SET status = 'pending', claimed_by = NULL, claimed_at = NULL "
+    "WHERE status = 'publishing' AND claimed_at < ? AND NOT " + SQL_ACTIVE_JOB
+)
+
+
+def _claim_cutoff():
+    return (datetime.now() - timedelta(seconds=CLAIM_TIMEOUT)).isoformat()
+
+
+def claim_message(message_id, admin_id, status='publishing'):
+    # True, если заявку получил этот админ. status='rejected' — отклонение одним шагом
+    try:
+        cursor = execute(SQL_CLAIM, (status, admin_id, datetime.now().isoformat(), message_id, _claim_cutoff()))
+        return cursor.rowcount == 1
+    finally:
+        submission_cache.invalidate(message_id)
+
+
+def expire_claims():
+    cutoff = _claim_cutoff()
+    with transaction() as conn:
+        expired = [row[0] for row in conn.execute(
+            "SELECT id FROM messages WHERE status = 'publishing' AND claimed_at < ? AND NOT " + SQL_ACTIVE_JOB, (cutoff,)
+        )]
+        if expired:
+            conn.execute(SQL_EXPIRE_CLAIMS, (cutoff,))
+    for message_id in expired:
+        submission_cache.invalidate(message_id)
+    return expired
+
+
+def add_notification(message_id, chat_id, notification_id):
+    # Какие сообщения админам относятся к заявке: их клавиатуры обновляются после решения
+    return writer.submit(SQL_INSERT_NOTIFICATION, (message_id, chat_id, notification_id))
+
+
+def get_notifications(message_id):
+    return fetchall(SQL_SELECT_NOTIFICATIONS, (message_id,))
+
+
+# === ОЧЕРЕДЬ ПУБЛИКАЦИЙ ===
+# Публикация в канал — задача в publish_jobs, а не вызов внутри callback:
+# захват заявки, тип публикации и задача пишутся одной транзакцией, дальше
+# задачу выполняют воркеры (jobs.py). Ключ идемпотентности publish:<id заявки>
+# не дает поставить одну заявку дважды. После каждой успешной отправки плана
+# сохраняется step, поэтому задача, прерванная падением процесса, продолжает
+# с первой неотправленной части, а не повторяет заголовок или альбом целиком.
+# Состояния: queued → running → done | failed; running при старте — это
+# задачи упавшего процесса, они возвращаются в queued.
+#
+# Публикации в канал (publish_type = 'normal') идут через расписание (pacing.py):
+# у такой задачи есть position в очереди канала, и take_job выпускает ее
+# (ставит released_at) только когда расписание разрешает следующую публикацию.
+# Выпущенная задача дальше живет как обычная, в том числе при повторах.
+# До выпуска задачу можно переставить в очереди или отменить (cancelled):
+# заявка тогда возвращается на модерацию.
+
+# Позиция в очереди канала — в конец; число сообщений — файлы альбома или 1
+SQL_INSERT_JOB = (
+    "INSERT OR IGNORE INTO publish_jobs (idempotency_key, message_id, publish_type, admin_id, admin_name, "
+    "reply_chat_id, reply_message_id, run_after, created_at, updated_at, position, cost) "
+    "SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+    "CASE WHEN ? THEN COALESCE((SELECT MAX(position) FROM publish_jobs), 0) + 1 END, "
+    "MAX(1, (SELECT COUNT(*) FROM message_files WHERE message_id = ?))"
+)
+SQL_JOB_COLUMNS = (
+    "SELECT id, message_id, publish_type, admin_id, admin_name, reply_chat_id, reply_message_id, state, attempts, step "
+    "FROM publish_jobs "
+)
+# Задачи вне расписания и уже выпущенные расписанием — по сроку
+SQL_SELECT_DUE_JOB = (
+    SQL_JOB_COLUMNS + "WHERE state = 'queued' AND run_after <= ? AND (position IS NULL OR released_at IS NOT NULL) "
+    "ORDER BY run_after, id LIMIT 1"
+)
+SQL_PUBLISH_LAG = (
+    "SELECT MIN(run_after) FROM publish_jobs "
+    "WHERE state = 'queued' AND run_after <= ? AND (position IS NULL OR released_at IS NOT NULL)"
+)
+SQL_SELECT_NEXT_SCHEDULED = (
+    SQL_JOB_COLUMNS + "WHERE state = 'queued' AND position IS NOT NULL AND released_at IS NULL ORDER BY position LIMIT 1"
+)
+SQL_LAST_RELEASE = "SELECT released_at, cost FROM publish_jobs WHERE released_at IS NOT NULL ORDER BY released_at DESC LIMIT 1"
+SQL_RELEASE_JOB = "UPDATE publish_jobs SET released_at = ? WHERE id = ?"
+SQL_SELECT_SCHEDULED = (
+    "SELECT j.message_id, m.message_type, m.message_text, m.user_name, j.cost, j.admin_name "
+    "FROM publish_jobs j JOIN messages m ON m.id = j.message_id "
+    "WHERE j.state = 'queued' AND j.position IS NOT NULL AND j.released_at IS NULL ORDER BY j.position LIMIT ?"
+)
+SQL_START_JOB = (
+    "UPDATE publish_jobs SET state = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ? AND state = 'queued'"
+)
+SQL_ADVANCE_JOB = "UPDATE publish_jobs SET step = ?, updated_at = ? WHERE id = ?"
+SQL_RETRY_JOB = (
+    "UPDATE publish_jobs SET state = 'queued', run_after = ?, last_error = ?, updated_at = ? WHERE id = ?"
+)
+SQL_FINISH_JOB = "UPDATE publish_jobs SET state = ?, last_error = ?, updated_at = ? WHERE id = ?"
+# Итог задачи переводит заявку из 'publishing' независимо от того, кто ее захватывал
+SQL_FINISH_JOB_MESSAGE = "UPDATE messages SET status = ? WHERE id = ? AND status = 'publishing'"
+
+
+def enqueue_publish(message_id, admin_id, publish_type, admin_name=None, reply_chat_id=None, reply_message_id=None):
+    # id задачи или None, если заявку уже захватил кто-то другой
+    now = datetime.now().isoformat()
+    try:
+        with transaction() as conn:
+            claimed = conn.execute(SQL_CLAIM, ('publishing', admin_id, now, message_id, _claim_cutoff())).rowcount
+            if claimed != 1:
+                return None
+            conn.execute(SQL_UPDATE_PUBLISH_TYPE, (publish_type, message_id))
+            conn.execute(SQL_INSERT_JOB, (
+                f"publish:{message_id}", message_id, publish_type, admin_id, admin_name,
+                reply_chat_id, reply_message_id, time.time(), now, now,
+                publish_type == 'normal', message_id
+            ))
+            return conn.execute("SELECT id FROM publish_jobs WHERE idempotency_key = ?", (f"publish:{message_id}",)).fetchone()[0]
+    finally:
+        submission_cache.invalidate(message_id)
+
+
+def _last_release(conn):
+    row = conn.execute(SQL_LAST_RELEASE).fetchone()
+    return row if row else (None, None)
+
+
+def take_job(next_release=None, now=None):
+    # Следующая задача, чей срок наступил, переводится в running; None — нечего делать.
+    # next_release(last_released, last_cost, now) — расписание канала (pacing.Pacer);
+    # без него задачи из очереди канала выпускаются сразу
+    now = time.time() if now is None else now
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = publish_job_row
+        job = cursor.execute(SQL_SELECT_DUE_JOB, (now,)).fetchone()
+        if job is None:
+            if next_release is not None and next_release(*_last_release(conn), now) > now:
+                return None
+            job = cursor.execute(SQL_SELECT_NEXT_SCHEDULED).fetchone()
+            if job is None:
+                return None
+            conn.execute(SQL_RELEASE_JOB, (now, job.id))
+        conn.execute(SQL_START_JOB, (datetime.now().isoformat(), job.id))
+    job.state = 'running'
+    job.attempts += 1
+    return job
+
+
+def advance_job(job_id, step):
+    execute(SQL_ADVANCE_JOB, (step, datetime.now().isoformat(), job_id))
+
+
+def retry_job(job_id, delay, error):
+    execute(SQL_RETRY_JOB, (time.time() + delay, error, datetime.now().isoformat(), job_id))
+
+
+def finish_job(job, success, error=None):
+    # done → заявка 'approved', failed → 'error'; одной транзакцией
+    try:
+        with transaction() as conn:
+            conn.execute(SQL_FINISH_JOB, ('done' if success else 'failed', error, datetime.now().isoformat(), job.id))
+            conn.execute(SQL_FINISH_JOB_MESSAGE, ('approved' if success else 'error', job.message_id))
+    finally:
+        submission_cache.invalidate(job.message_id)
+
+
+def recover_jobs():
+    return execute(
+        "UPDATE publish_jobs SET state = 'queued', updated_at = ? WHERE state = 'running'",
+        (datetime.now().isoformat(),)
+    ).rowcount
+
+
+def next_job_time(next_release=None):
+    # Ближайший момент, когда take_job может что-то вернуть; None — очередь пуста
+    now = time.time()
+    with connection() as conn:
+        due = conn.execute(
+            "SELECT MIN(run_after) FROM publish_jobs "
+            "WHERE state = 'queued' AND (position IS NULL OR released_at IS NOT NULL)"
+        ).fetchone()[0]
+        if conn.execute(SQL_SELECT_NEXT_SCHEDULED).fetchone() is not None:
+            release = now if next_release is None else next_release(*_last_release(conn), now)
+            due = release if due is None else min(due, release)
+    return due
+
+
+def get_schedule(limit=20):
+    # Очередь канала по порядку и данные для расчета времени выхода:
+    # (строки, время последнего выпуска, его число сообщений)
+    with connection() as conn:
+        rows = conn.execute(SQL_SELECT_SCHEDULED, (limit,)).fetchall()
+        last_released, last_cost = _last_release(conn)
+    return rows, last_released, last_cost
+
+
+def move_scheduled(message_id, index):
+    # Ставит заявку на место index (с 1) в очереди канала; False — ее нет в очереди
+    with transaction() as conn:
+        rows = conn.execute(
+            "SELECT id, message_id, position FROM publish_jobs "
+            "WHERE state = 'queued' AND position IS NOT NULL AND released_at IS NULL ORDER BY position"
+        ).fetchall()
+        moved = [row for row in rows if row[1] == message_id]
+        if not moved:
+            return False
+        base = rows[0][2]
+        rows.remove(moved[0])
+        rows.insert(max(0, min(len(rows), index - 1)), moved[0])
+        conn.executemany(
+            "UPDATE publish_jobs SET position = ? WHERE id = ?",
+            [(base + i, row[0]) for i, row in enumerate(rows)]
+        )
+    return True
+
+
+def cancel_scheduled(message_id):
+    # Снимает невыпущенную публикацию и возвращает заявку на модерацию.
+    # Ключ идемпотентности освобождается, чтобы заявку можно было одобрить снова
+    try:
+        with transaction() as conn:
+            cancelled = conn.execute(
+                "UPDATE publish_jobs SET state = 'cancelled', idempotency_key = idempotency_key || ':cancelled:' || id, "
+                "updated_at = ? WHERE message_id = ? AND state = 'queued' AND position IS NOT NULL AND released_at IS NULL",
+                (datetime.now().isoformat(), message_id)
+            ).rowcount
+            if not cancelled:
+                return False
+            conn.execute(
+                "UPDATE messages SET status = 'pending', claimed_by = NULL, claimed_at = NULL "
+                "WHERE id = ? AND status = 'publishing'", (message_id,)
+            )
+        return True
+    finally:
+        submission_cache.invalidate(message_id)
+
+
+def oldest_pending_time():
+    # Время самой старой заявки на модерации (секунды Unix) или None
+    row = fetchone("SELECT timestamp FROM messages WHERE status = 'pending' ORDER BY id LIMIT 1")
+    if not row or not row[0]:
+        return None
+    try:
+        return datetime.fromisoformat(row[0]).timestamp()
+    except ValueError:
+        return None
+
+
+def publish_lag(now=None):
+    # Насколько самая старая готовая к выполнению задача ждет воркера (секунды);
+    # задачи, ждущие своего места в расписании, не считаются
+    now = time.time() if now is None else now
+    row = fetchone(SQL_PUBLISH_LAG, (now,))
+    return max(0.0, now - row[0]) if row and row[0] is not None else 0.0
+
+
+def job_stats():
+    counts = dict(fetchall("SELECT state, COUNT(*) FROM publish_jobs WHERE state IN ('queued', 'running', 'failed') GROUP BY state"))
+    return {'queued': counts.get('queued', 0), 'running': counts.get('running', 0), 'failed': counts.get('failed', 0)}
+
+
+def insert_event(event_type, details=""):
+    # Событие не ждёт коммита: обработчик не блокируется на записи статистики
+    return writer.submit(SQL_INSERT_EVENT, (event_type, datetime.now().isoformat(), details))
+
+
+# === ОБЩЕЕ СОСТОЯНИЕ ПРОЦЕССОВ ===
+# Значения, которые должны видеть все процессы бота (BOT_PROCESSES > 1), —
+# например, режим ответа админа. scope — пространство имен, value — JSON.
+SQL_STATE_GET = "SELECT value FROM shared_state WHERE scope = ? AND key = ?"
+SQL_STATE_SET = (
+    "INSERT INTO shared_state (scope, key, value, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (scope, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at"
+)
+SQL_STATE_DELETE = "DELETE FROM shared_state WHERE scope = ? AND key = ?"
+
+
+def state_get(scope, key):
+    row = fetchone(SQL_STATE_GET, (scope, key))
+    return row[0] if row else None
+
+
+def state_set(scope, key, value):
+    execute(SQL_STATE_SET, (scope, key, value, time.time()))
+
+
+def state_pop(scope, key):
+    with transaction() as conn:
+        row = conn.execute(SQL_STATE_GET, (scope, key)).fetchone()
+        if row is not None:
+            conn.execute(SQL_STATE_DELETE, (scope, key))
+    return row[0] if row else None
+
+
+# === СЧЁТЧИКИ СТАТИСТИКИ ===
+# /stats читает готовые значения из stats_counters вместо COUNT(*) по всей истории.
+# Счётчики обновляются триггерами в той же транзакции, что и INSERT/UPDATE,
+# уникальные пользователи учитываются через таблицу-множество stats_users.
+
+def count_stats():
+    counters = dict(fetchall("SELECT name, value FROM stats_counters"))
+    return {
+        'total_messages': counters.get('messages', 0),
+        'approved_messages': counters.get('status:approved', 0),
+        'pending_messages': counters.get('status:pending', 0),
+        'unique_users': counters.get('unique_users', 0),
+        'restarts_count': counters.get('events:restart', 0),
+        'total_errors': counters.get('errors', 0),
+    }
+
+
+def _table_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def rebuild_counters():
+    with transaction() as conn:
+        conn.execute("DELETE FROM stats_counters")
+        conn.execute("DELETE FROM stats_users")
+        conn.execute("INSERT INTO stats_users (user_id) SELECT DISTINCT user_id FROM messages WHERE user_id IS NOT NULL")
+        conn.execute("INSERT INTO stats_counters (name, value) SELECT 'messages', COUNT(*) FROM messages")
+        conn.execute("INSERT INTO stats_counters (name, value) SELECT 'unique_users', COUNT(*) FROM stats_users")
+        conn.execute(
+            "INSERT INTO stats_counters (name, value) "
+            "SELECT 'status:' || COALESCE(status, ''), COUNT(*) FROM messages GROUP BY COALESCE(status, '')"
+        )
+        # Старые события и ошибки лежат в сводках event_rollups (retention.py)
+        rollups = _table_exists(conn, 'event_rollups')
+        conn.execute(
+            "INSERT INTO stats_counters (name, value) "
+            "SELECT 'events:' || kind, SUM(n) FROM ("
+            "SELECT COALESCE(event_type, '') AS kind, COUNT(*) AS n FROM bot_stats GROUP BY COALESCE(event_type, '')"
+            + (" UNION ALL SELECT kind, SUM(count) FROM event_rollups WHERE source = 'event' GROUP BY kind" if rollups else "")
+            + ") GROUP BY kind"
+        )
+        conn.execute(
+            "INSERT INTO stats_counters (name, value) SELECT 'errors', (SELECT COUNT(*) FROM bot_errors)"
+            + (" + (SELECT COALESCE(SUM(count), 0) FROM event_rollups WHERE source = 'error')" if rollups else "")
+        )
+    logger.info("🔢 Счётчики статистики пересчитаны")
+
+
+def ping():
+    fetchone("SELECT 1")
+
+
+def check_writable():
+    # BEGIN IMMEDIATE берет блокировку записи: база не только читается, но и пишется
+    with transaction():
+        pass
@@ -0,0 +1,36 @@
+import os
+import hashlib
+import unicodedata
+
+import metrics
+
+# === ПОВТОРНЫЕ ЗАЯВКИ ===
+# Пользователи отправляют одно и то же по нескольку раз: повторяют текст,
+# заново загружают фото или стикер, клиент переотправляет при плохой сети.
+# У каждой заявки есть отпечаток: тип, нормализованный текст (NFKC, без учета
+# регистра, невидимых символов и лишних пробелов) и file_unique_id файлов —
+# он одинаков у повторной загрузки того же файла, в отличие от file_id.
+# Файлы альбома входят в отпечаток без учета порядка.
+# Отпечатки лежат в submission_hashes (ключ — пользователь и отпечаток).
+# Повтор в пределах DEDUP_WINDOW секунд от предыдущей отправки, пока исходная
+# заявка ждет модерации, не создает новую строку и уведомления админам: у
+# исходной заявки растет счетчик repeats (его видно в /pending и просмотре).
+# Проверка и вставка — одна операция групповой записи (db.submit_unique_message).
+# Устаревшие отпечатки удаляет обслуживание БД (retention.py).
+# DEDUP_WINDOW=0 выключает проверку.
+
+DEDUP_WINDOW = float(os.environ.get('DEDUP_WINDOW', '86400'))
+
+repeats_total = metrics.Counter('bot_submission_repeats_total', 'Повторы заявок, свернутые в ожидающую модерации', ('type',))
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKC', text or '')
+    # Cf — невидимые символы форматирования (zero-width space и т. п.)
+    text = ''.join(char for char in text if unicodedata.category(char) != 'Cf')
+    return ' '.join(text.casefold().split())
+
+
+def content_hash(message_type, text, file_unique_ids=()):
+    parts = [message_type, normalize_text(text)] + sorted(file_unique_id or '' for file_unique_id in file_unique_ids)
+    return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
@@ -0,0 +1,208 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict, deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# === ЗАЩИТА ОТ ФЛУДА ===
+# Каждая заявка — запись в БД и по уведомлению каждому админу, поэтому частоту
+# заявок одного пользователя ограничиваем в памяти, до любой работы с БД и API.
+# Лимиты — скользящие окна FLOOD_LIMITS: "5/10,20/600" — не больше 5 заявок
+# за 10 с и 20 за 10 мин. Для каждого пользователя хранятся моменты последних
+# заявок (не больше самого крупного лимита), проверка окна — O(1).
+# Альбом считается одной заявкой: остальные файлы группы следуют решению по первому.
+# Наказание за превышение (FLOOD_PENALTY):
+# - cooldown — пауза FLOOD_COOLDOWN секунд, каждое следующее нарушение удваивает
+#   ее (до FLOOD_COOLDOWN_MAX); пользователь один раз получает предупреждение,
+#   остальное за время паузы отбрасывается молча;
+# - drop — лишние заявки молча отбрасываются, пауз нет.
+# Пользователей в памяти не больше FLOOD_MAX_USERS: дольше всех молчавшие
+# вытесняются (LRU), но только если у них нет паузы и заявок в пределах самого
+# длинного окна — иначе вытеснение сняло бы ограничение. Если все старейшие
+# активны, лимит временно превышается. Отклоненные заявки считаются только в памяти и метрике
+# bot_flood_rejected_total. Админы не ограничиваются; /flood и /unflood — для них.
+# При BOT_PROCESSES > 1 пользователь всегда попадает в один процесс (shards.py),
+# но /flood и /unflood видят только процесс, который обрабатывает чат админа.
+
+FLOOD_LIMITS = os.environ.get('FLOOD_LIMITS', '5/10,20/600')
+FLOOD_PENALTY = os.environ.get('FLOOD_PENALTY', 'cooldown')
+FLOOD_COOLDOWN = float(os.environ.get('FLOOD_COOLDOWN', '60'))
+FLOOD_COOLDOWN_MAX = float(os.environ.get('FLOOD_COOLDOWN_MAX', '3600'))
+FLOOD_MAX_USERS = int(os.environ.get('FLOOD_MAX_USERS', '50000'))
+# Сколько старейших записей просматривать в поисках вытесняемой
+FLOOD_EVICT_SCAN = 32
+
+PENALTIES = ('cooldown', 'drop')
+
+flood_rejected = metrics.Counter('bot_flood_rejected_total', 'Заявки, отклоненные защитой от флуда', ('reason',))
+
+
+def parse_limits(value):
+    # "5/10,20/600" → [(5, 10.0), (20, 600.0)]
+    limits = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            count, seconds = item.split('/')
+            count, seconds = int(count), float(seconds)
+            if count < 1 or seconds <= 0:
+                raise ValueError
+        except ValueError:
+            logger.error(f"❌ Неверный лимит флуда: {item!r} (нужно ЧИСЛО/СЕКУНДЫ)")
+            continue
+        limits.append((count, seconds))
+    return sorted(set(limits))
+
+
+class UserState:
+    __slots__ = ('hits', 'blocked_until', 'strikes', 'last_strike', 'rejected', 'group', 'group_allowed')
+
+    def __init__(self, depth):
+        self.hits = deque(maxlen=depth)
+        self.blocked_until = 0.0
+        self.strikes = 0
+        self.last_strike = 0.0
+        self.rejected = 0
+        self.group = None
+        self.group_allowed = True
+
+
+class FloodLimiter:
+    def __init__(self, limits=None, penalty=FLOOD_PENALTY, cooldown=FLOOD_COOLDOWN,
+                 cooldown_max=FLOOD_COOLDOWN_MAX, max_users=FLOOD_MAX_USERS, clock=time.monotonic):
+        self.limits = parse_limits(FLOOD_LIMITS) if limits is None else list(limits)
+        self.penalty = penalty if penalty in PENALTIES else 'cooldown'
+        if penalty not in PENALTIES:
+            logger.error(f"❌ Неизвестный FLOOD_PENALTY: {penalty!r}, используем cooldown")
+        self.cooldown = cooldown
+        self.cooldown_max = max(cooldown, cooldown_max)
+        self.max_users = max(1, max_users)
+        self.clock = clock
+        self._depth = max((count for count, _ in self.limits), default=1)
+        self._horizon = max((seconds for _, seconds in self.limits), default=0.0)
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def _user(self, user_id, now):
+        state = self._users.get(user_id)
+        if state is None:
+            state = UserState(self._depth)
+            # После превышения лимита лишние записи уходят, как только освободятся
+            while len(self._users) >= self.max_users and self._evict(now):
+                pass
+            self._users[user_id] = state
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def _idle(self, state, now):
+        # Вытеснение не должно снимать паузу или обнулять заполненное окно
+        if state.blocked_until > now:
+            return False
+        return not state.hits or now - state.hits[-1] >= self._horizon
+
+    def _evict(self, now):
+        for scanned, (user_id, state) in enumerate(self._users.items()):
+            if scanned >= FLOOD_EVICT_SCAN:
+                return False
+            if self._idle(state, now):
+                del self._users[user_id]
+                self.evicted += 1
+                return True
+        return False
+
+    def _exceeded(self, state, now):
+        # → сколько секунд осталось до освобождения места в переполненном окне, иначе None
+        for count, seconds in self.limits:
+            if len(state.hits) >= count and now - state.hits[-count] < seconds:
+                return state.hits[-count] + seconds - now
+        return None
+
+    def _punish(self, state, now):
+        # → пауза в секундах; серия нарушений забывается после FLOOD_COOLDOWN_MAX без них
+        if now - state.last_strike > self.cooldown_max:
+            state.strikes = 0
+        pause = min(self.cooldown * 2 ** state.strikes, self.cooldown_max)
+        state.strikes += 1
+        state.last_strike = now
+        state.blocked_until = now + pause
+        return pause
+
+    def check(self, user_id, group_id=None):
+        # → (пропустить, предупредить пользователя, секунд до снятия ограничения)
+        if not self.limits:
+            return True, False, 0.0
+        now = self.clock()
+        notify = False
+        with self._lock:
+            state = self._user(user_id, now)
+            if group_id is not None and group_id == state.group:
+                allowed, wait, reason = state.group_allowed, max(0.0, state.blocked_until - now), 'album'
+            elif state.blocked_until > now:
+                allowed, wait, reason = False, state.blocked_until - now, 'cooldown'
+            else:
+                wait = self._exceeded(state, now)
+                allowed, reason = wait is None, 'window'
+                if allowed:
+                    state.hits.append(now)
+                elif self.penalty == 'cooldown':
+                    wait, notify = self._punish(state, now), True
+                if group_id is not None:
+                    state.group, state.group_allowed = group_id, allowed
+            if allowed:
+                # Остальные файлы принятого альбома — та же заявка
+                if reason != 'album':
+                    self.allowed += 1
+                return True, False, 0.0
+            self.rejected += 1
+            state.rejected += 1
+        flood_rejected.inc(reason)
+        return False, notify, wait
+
+    def lift(self, user_id):
+        with self._lock:
+            return self._users.pop(user_id, None) is not None
+
+    def lift_all(self):
+        with self._lock:
+            count = len(self._users)
+            self._users.clear()
+            return count
+
+    def limited(self, limit=20):
+        # Пользователи с паузой или отклоненными заявками: [(id, отклонено, секунд паузы)]
+        now = self.clock()
+        with self._lock:
+            rows = [
+                (user_id, state.rejected, max(0.0, state.blocked_until - now))
+                for user_id, state in self._users.items()
+                if state.rejected or state.blocked_until > now
+            ]
+        rows.sort(key=lambda row: (row[2], row[1]), reverse=True)
+        return rows[:limit]
+
+    def describe(self):
+        limits = ", ".join(f"{count} за {seconds:g} с" for count, seconds in self.limits) or "выключены"
+        if self.penalty == 'cooldown':
+            penalty = f"пауза {self.cooldown:g}–{self.cooldown_max:g} с"
+        else:
+            penalty = "молча отбрасываются"
+        return f"лимиты: {limits}; лишние заявки: {penalty}"
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'allowed': self.allowed,
+                'rejected': self.rejected,
+                'evicted': self.evicted,
+            }
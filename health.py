@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# === СНИМОК ЗДОРОВЬЯ ===
+# /health, /health/live и /health/ready отдают готовый снимок и сами ничего не
+# проверяют: проверки компонентов выполняет поток мониторинга (bot.health_monitor)
+# раз в HEALTH_REFRESH секунд. У каждой проверки свой интервал: запросы к Bot API
+# идут редко, и их результат отдается до следующей проверки, а локальные
+# (БД, heartbeat, очереди) обновляются на каждом проходе.
+# Сбой критичного компонента снимает готовность (ready), сбой компонента с live —
+# еще и живость: она падает, только если завис сам процесс (мониторинг или цикл
+# получения обновлений давно не отмечался). Сбой некритичного компонента
+# (например, отставание очередей) дает статус degraded.
+# beat(name) отмечает, что цикл name жив; возраст отметки — heartbeat_age(name).
+
+HEALTH_REFRESH = float(os.environ.get('HEALTH_REFRESH', '15'))
+HEALTH_STALE_FACTOR = 3
+
+_heartbeats = {}
+
+
+def beat(name):
+    _heartbeats[name] = time.time()
+
+
+def heartbeat_age(name, now=None):
+    last = _heartbeats.get(name)
+    if last is None:
+        return None
+    return (now or time.time()) - last
+
+
+class CheckFailed(Exception):
+    # Проверка отработала, но компонент не в порядке; detail попадает в снимок
+    def __init__(self, message, detail=None):
+        super().__init__(message)
+        self.detail = detail or {}
+
+
+class CheckResult:
+    __slots__ = ('ok', 'error', 'detail', 'checked_at', 'duration')
+
+    def __init__(self, ok, error, detail, checked_at, duration):
+        self.ok = ok
+        self.error = error
+        self.detail = detail
+        self.checked_at = checked_at
+        self.duration = duration
+
+
+class Component:
+    __slots__ = ('name', 'check', 'interval', 'critical', 'live', 'result')
+
+    def __init__(self, name, check, interval, critical, live):
+        self.name = name
+        self.check = check
+        self.interval = interval
+        self.critical = critical
+        self.live = live
+        # Результат заменяется целиком одним присваиванием: читатели без блокировок
+        self.result = None
+
+    def due(self, now):
+        return self.result is None or now - self.result.checked_at >= self.interval
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            ok, error, detail = True, None, self.check() or {}
+        except CheckFailed as e:
+            ok, error, detail = False, str(e), e.detail
+        except Exception as e:
+            ok, error, detail = False, f"{type(e).__name__}: {e}", {}
+        self.result = CheckResult(ok, error, detail, time.time(), time.perf_counter() - started)
+        return self.result
+
+
+class Health:
+    def __init__(self, refresh=HEALTH_REFRESH):
+        self.refresh_interval = refresh
+        self.started = time.time()
+        self.refreshed_at = None
+        self._components = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, check, interval=None, critical=True, live=False):
+        # check() возвращает dict с подробностями или бросает исключение (CheckFailed — с подробностями)
+        with self._lock:
+            self._components[name] = Component(name, check, interval or self.refresh_interval, critical, live)
+
+    def refresh(self, force=False):
+        now = time.time()
+        with self._lock:
+            components = list(self._components.values())
+        for component in components:
+            if force or component.due(now):
+                result = component.run()
+                if not result.ok:
+                    logger.error(f"🩺 {component.name}: {result.error}")
+        self.refreshed_at = time.time()
+        beat('health')
+
+    @property
+    def stale_after(self):
+        return self.refresh_interval * HEALTH_STALE_FACTOR
+
+    def status(self, now=None):
+        now = now or time.time()
+        age = None if self.refreshed_at is None else now - self.refreshed_at
+        # До первого прохода процесс считается живым, но не готовым
+        live = (now - self.started if age is None else age) < self.stale_after
+        ready = age is not None and live
+        degraded = False
+        components = {}
+        for component in list(self._components.values()):
+            result = component.result
+            if result is None:
+                components[component.name] = {'ok': None, 'critical': component.critical}
+                ready = ready and not component.critical
+                continue
+            item = {
+                'ok': result.ok,
+                'critical': component.critical,
+                'age_seconds': round(now - result.checked_at, 1),
+                'duration_ms': round(result.duration * 1000, 1),
+                'detail': result.detail,
+            }
+            if result.error:
+                item['error'] = result.error
+            components[component.name] = item
+            if not result.ok:
+                live = live and not component.live
+                if component.critical:
+                    ready = False
+                else:
+                    degraded = True
+        ready = ready and live
+        return {
+            'status': 'fail' if not ready else 'degraded' if degraded else 'ok',
+            'live': live,
+            'ready': ready,
+            'age_seconds': None if age is None else round(age, 1),
+            'refreshed_at': None if self.refreshed_at is None else datetime.fromtimestamp(self.refreshed_at).isoformat(timespec='seconds'),
+            'components': components,
+        }
+
+    def live(self):
+        return self.status()['live']
+
+    def ready(self):
+        return self.status()['ready']
+
+    def component_ok(self):
+        # {(имя,): 1/0} для gauge; компоненты без результата пропускаются
+        return {(c.name,): int(c.result.ok) for c in list(self._components.values()) if c.result is not None}
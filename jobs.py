@@ -0,0 +1,161 @@
+import os
+import random
+import threading
+import time
+import logging
+
+import db
+import outbound
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# === ВОРКЕРЫ ОЧЕРЕДИ ПУБЛИКАЦИЙ ===
+# Потоки забирают задачи из publish_jobs (см. db.py) и выполняют их функцией
+# execute(job), итог передается в on_finish(job, success, error). Ошибку
+# Telegram 400/403 (неверный файл, нет прав в канале) и PermanentJobError
+# повторять бесполезно — задача сразу завершается с ошибкой. Остальные ошибки
+# повторяются с экспоненциальной задержкой и разбросом, на 429 — не раньше
+# retry_after; после JOB_MAX_ATTEMPTS попыток задача считается проваленной.
+# Между задачами поток спит до срока ближайшей, но не дольше JOB_POLL_INTERVAL;
+# wake() будит воркеры сразу после постановки новой задачи. Если передан
+# pacer (pacing.Pacer), публикации в канал выпускаются по его расписанию.
+
+PUBLISH_WORKERS = int(os.environ.get('PUBLISH_WORKERS', '2'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '6'))
+JOB_BACKOFF_BASE = float(os.environ.get('JOB_BACKOFF_BASE', '2'))
+JOB_BACKOFF_MAX = float(os.environ.get('JOB_BACKOFF_MAX', '300'))
+JOB_POLL_INTERVAL = 5.0
+
+PERMANENT_ERRORS = (400, 403)
+
+
+class PermanentJobError(Exception):
+    pass
+
+
+def backoff(attempts, error=None):
+    delay = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+    if getattr(error, 'error_code', None) == 429:
+        delay = max(delay, outbound.retry_after(error))
+    return delay
+
+
+def is_permanent(error):
+    return isinstance(error, PermanentJobError) or getattr(error, 'error_code', None) in PERMANENT_ERRORS
+
+
+class JobWorkers:
+    def __init__(self, execute, on_finish=None, workers=PUBLISH_WORKERS, max_attempts=JOB_MAX_ATTEMPTS, pacer=None):
+        self.execute = execute
+        self.on_finish = on_finish
+        self.pacer = pacer
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self._wakeups = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        recovered = db.recover_jobs()
+        if recovered:
+            logger.warning(f"📤 Возобновлено незавершенных публикаций: {recovered}")
+        self._threads = [
+            threading.Thread(target=self._run, name=f"publish-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"📤 Очередь публикаций запущена: {self.workers} воркеров")
+
+    def wake(self):
+        with self._cond:
+            self._wakeups += 1
+            self._cond.notify_all()
+
+    def stop(self, timeout=30):
+        # Текущие задачи дорабатывают; то, что не успело, продолжится после рестарта
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        logger.info(f"📤 Очередь публикаций остановлена: {self.completed} опубликовано, {self.failed} с ошибкой")
+
+    @property
+    def _next_release(self):
+        return self.pacer.next_release if self.pacer is not None else None
+
+    def _idle_timeout(self):
+        due = db.next_job_time(self._next_release)
+        if due is None:
+            return JOB_POLL_INTERVAL
+        return min(JOB_POLL_INTERVAL, max(0.0, due - time.time()))
+
+    def _run(self):
+        while self._running:
+            try:
+                # wake(), пришедший между выборкой и ожиданием, не должен потеряться
+                with self._cond:
+                    wakeups = self._wakeups
+                job = db.take_job(self._next_release)
+                if job is None:
+                    timeout = self._idle_timeout()
+                    with self._cond:
+                        if self._running and self._wakeups == wakeups:
+                            self._cond.wait(timeout)
+                    continue
+                self._process(job)
+            except Exception as e:
+                logger.error(f"❌ Ошибка очереди публикаций: {e}")
+                time.sleep(1)
+
+    def _process(self, job):
+        try:
+            with tracing.trace('publish_job', f"заявка #{job.message_id}", profile=True):
+                self.execute(job)
+        except Exception as e:
+            if is_permanent(e) or job.attempts >= self.max_attempts:
+                logger.error(f"❌ Публикация заявки #{job.message_id} не удалась ({job.attempts} попыток): {e}")
+                self._finish(job, False, str(e))
+            else:
+                delay = backoff(job.attempts, e)
+                logger.warning(f"🔁 Публикация заявки #{job.message_id} повторится через {delay:.0f}с: {e}")
+                db.retry_job(job.id, delay, str(e))
+                with self._cond:
+                    self.retried += 1
+            return
+        self._finish(job, True)
+
+    def _finish(self, job, success, error=None):
+        db.finish_job(job, success, error)
+        with self._cond:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job, success, error)
+            except Exception as e:
+                logger.error(f"❌ Ошибка уведомления о публикации #{job.message_id}: {e}")
+
+    def stats(self):
+        with self._cond:
+            retried = self.retried
+        return dict(db.job_stats(), retried=retried)
@@ -0,0 +1,207 @@
+import os
+import sys
+import gzip
+import json
+import queue
+import random
+import shutil
+import logging
+import logging.handlers
+import multiprocessing
+from datetime import datetime
+
+import metrics
+
+# === ЛОГИРОВАНИЕ ЧЕРЕЗ ОЧЕРЕДЬ ===
+# Обработчики не пишут ни в файл, ни в консоль сами: запись кладется в
+# ограниченную очередь (LOG_QUEUE_SIZE), а фоновый QueueListener отдает ее
+# консоли и файлу DATA_DIR/bot_health.log. Если очередь переполнена (диск
+# не успевает), запись отбрасывается и считается в bot_log_dropped_total —
+# поток обработчика никогда не ждет диск.
+# Файл ротируется по размеру (LOG_ROTATE=size, LOG_MAX_MB) или по времени
+# (LOG_ROTATE=time, LOG_ROTATE_WHEN — как у TimedRotatingFileHandler), хранится
+# LOG_BACKUPS старых файлов, сжатых gzip (LOG_COMPRESS). Формат файла и консоли —
+# text или json (одна JSON-строка на запись, поля extra попадают в объект).
+# При нескольких процессах (shards.py) очередь межпроцессная: воркеры пишут
+# в нее через attach(), файл ведет только главный процесс.
+# До setup() (импорт bot из бенчмарков, bot_async, воркер до attach) действует
+# fallback(): синхронный вывод в консоль, чтобы INFO-строки не терялись.
+# Строки, которые пишутся на каждое обновление, идут через SampledLogger:
+# при LOG_SAMPLE_RATE < 1 пишется только такая доля.
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FILE_FORMAT = os.environ.get('LOG_FILE_FORMAT', 'json')
+LOG_CONSOLE_FORMAT = os.environ.get('LOG_CONSOLE_FORMAT', 'text')
+LOG_ROTATE = os.environ.get('LOG_ROTATE', 'size')
+LOG_MAX_MB = float(os.environ.get('LOG_MAX_MB', '10'))
+LOG_ROTATE_WHEN = os.environ.get('LOG_ROTATE_WHEN', 'midnight')
+LOG_BACKUPS = int(os.environ.get('LOG_BACKUPS', '7'))
+LOG_COMPRESS = os.environ.get('LOG_COMPRESS', '1') not in ('0', 'false', 'no')
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1'))
+LOG_QUEUE_SIZE = 10000
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Атрибуты самой LogRecord: всё остальное в record.__dict__ пришло через extra
+_RECORD_FIELDS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+log_dropped = metrics.Counter('bot_log_dropped_total', 'Записи лога, отброшенные из-за переполненной очереди')
+log_sampled_out = metrics.Counter('bot_log_sampled_out_total', 'Строки лога обновлений, пропущенные сэмплированием', ('logger',))
+
+_listener = None
+_queue = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_dropped.inc()
+
+    def prepare(self, record):
+        # Сообщение и трассировку форматируем здесь (аргументы могут измениться
+        # после возврата), а оформление строки — уже в потоке listener
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _formatter(kind):
+    return JsonFormatter() if kind == 'json' else logging.Formatter(TEXT_FORMAT)
+
+
+def _compress(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def file_handler(path):
+    if LOG_ROTATE == 'time':
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS, encoding='utf-8')
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=int(LOG_MAX_MB * 1024 * 1024), backupCount=LOG_BACKUPS, encoding='utf-8'
+        )
+    if LOG_COMPRESS:
+        # Сжатие идет в потоке listener при ротации
+        handler.namer = lambda name: name + '.gz'
+        handler.rotator = _compress
+    handler.setFormatter(_formatter(LOG_FILE_FORMAT))
+    return handler
+
+
+def _install(log_queue):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(DroppingQueueHandler(log_queue))
+
+    # У TeleBot свой синхронный StreamHandler: пусть пишет через общую очередь
+    telebot_logger = logging.getLogger('TeleBot')
+    for handler in list(telebot_logger.handlers):
+        telebot_logger.removeHandler(handler)
+
+
+def fallback():
+    # Только консоль и только если логирование еще никто не настроил; setup()
+    # и attach() снимают этот обработчик
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(console)
+
+
+def setup(log_path, processes=1):
+    # processes > 1: очередь межпроцессная, в нее пишут и процессы-воркеры (attach),
+    # а файл и консоль по-прежнему ведет один listener главного процесса
+    global _listener, _queue
+    if _listener is not None:
+        return
+
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(_formatter(LOG_CONSOLE_FORMAT))
+    handlers = [console, file_handler(log_path)]
+
+    if processes > 1:
+        _queue = multiprocessing.get_context('spawn').Queue(LOG_QUEUE_SIZE)
+    else:
+        _queue = queue.Queue(LOG_QUEUE_SIZE)
+    _install(_queue)
+
+    _listener = logging.handlers.QueueListener(_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shared_queue():
+    return _queue
+
+
+def attach(log_queue):
+    # В процессе-воркере: записи уходят в очередь главного процесса
+    _install(log_queue)
+
+
+def stop():
+    # Дописывает все, что осталось в очереди; вызывается последним шагом bot.shutdown()
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+
+
+class SampledLogger:
+    # Для строк на каждое обновление: info/debug пишутся с вероятностью rate,
+    # предупреждения и ошибки — всегда
+    def __init__(self, logger, rate=LOG_SAMPLE_RATE):
+        self.logger = logger
+        self.rate = rate
+
+    def _sampled(self):
+        if self.rate >= 1 or random.random() < self.rate:
+            return True
+        log_sampled_out.inc(self.logger.name)
+        return False
+
+    def debug(self, msg, *args, **kwargs):
+        if self._sampled():
+            self.logger.debug(msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if self._sampled():
+            self.logger.info(msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.logger.warning(msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.logger.error(msg, *args, **kwargs)
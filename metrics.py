@@ -0,0 +1,386 @@
+import os
+import time
+import bisect
+import threading
+import logging
+from functools import wraps
+
+import health
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# === МЕТРИКИ (ФОРМАТ PROMETHEUS) ===
+# Счетчики и гистограммы пишутся без блокировок: у каждого потока свой шард —
+# обычный dict, в который пишет только он. /metrics складывает шарды при чтении
+# (копия dict в CPython атомарна под GIL). Шарды завершившихся потоков
+# сворачиваются в общий при следующем чтении, поэтому потоки Flask на каждый
+# запрос не накапливают память.
+# Gauge либо считается функцией при чтении (только то, что лежит в памяти),
+# либо обновляется фоновым потоком раз в METRICS_REFRESH секунд (запросы к БД):
+# сам /metrics в базу не ходит.
+# Таймеры гистограмм с span_prefix заодно открывают span текущей трассы
+# (tracing.py), а обертки обработчиков начинают трассу обновления.
+# Обертки Bot API отмечают в health.py последний успешный ответ ('api')
+# и каждый завершенный getUpdates ('polling', heartbeat цикла polling).
+
+METRICS_REFRESH = float(os.environ.get('METRICS_REFRESH', '15'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_retired = {}
+_metrics = {}
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = {}
+        _local.shard = shard
+        with _shards_lock:
+            _shards.append((threading.current_thread(), shard))
+    return shard
+
+
+def _merge(target, source):
+    for key, value in source.items():
+        if isinstance(value, list):
+            current = target.get(key)
+            if current is None:
+                target[key] = list(value)
+            else:
+                for i, item in enumerate(value):
+                    current[i] += item
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+def _collect():
+    total = {}
+    with _shards_lock:
+        alive = []
+        for thread, shard in _shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge(_retired, dict(shard))
+        _shards[:] = alive
+        _merge(total, _retired)
+        shards = [shard for _, shard in alive]
+    for shard in shards:
+        _merge(total, dict(shard))
+    return total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        _metrics[name] = self
+
+    def inc(self, *values, amount=1):
+        shard = _shard()
+        key = (self.name, values)
+        shard[key] = shard.get(key, 0) + amount
+
+    def render(self, collected):
+        for (name, values), value in sorted(collected.items(), key=lambda item: str(item[0])):
+            if name == self.name:
+                yield f"{self.name}{_labels(self.labels, values)} {value}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, span_prefix=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.span_prefix = span_prefix
+        _metrics[name] = self
+
+    def observe(self, seconds, *values):
+        # [счетчики по корзинам..., +Inf, сумма, количество]
+        shard = _shard()
+        key = (self.name, values)
+        state = shard.get(key)
+        if state is None:
+            state = shard[key] = [0] * (len(self.buckets) + 3)
+        state[bisect.bisect_left(self.buckets, seconds)] += 1
+        state[-2] += seconds
+        state[-1] += 1
+
+    def time(self, *values):
+        return _Timer(self, values)
+
+    def render(self, collected):
+        for (name, values), state in sorted(collected.items(), key=lambda item: str(item[0])):
+            if name != self.name:
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labels, values, (('le', bound),))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, values)} {state[-2]}"
+            yield f"{self.name}_count{_labels(self.labels, values)} {state[-1]}"
+
+
+class _Timer:
+    __slots__ = ('histogram', 'values', 'started', 'span')
+
+    def __init__(self, histogram, values):
+        self.histogram = histogram
+        self.values = values
+
+    def __enter__(self):
+        prefix = self.histogram.span_prefix
+        self.span = tracing.span(prefix, self.values[0] if self.values else None) if prefix else None
+        if self.span is not None:
+            self.span.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.values)
+        if self.span is not None:
+            self.span.__exit__(*exc)
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, func, labels=()):
+        # func() возвращает число или {кортеж значений меток: число}
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labels = labels
+        _metrics[name] = self
+
+    def value(self):
+        return self.func()
+
+    def render(self, collected):
+        try:
+            value = self.value()
+        except Exception as e:
+            logger.error(f"❌ Ошибка метрики {self.name}: {e}")
+            return
+        if value is None:
+            return
+        if isinstance(value, dict):
+            for values, item in sorted(value.items()):
+                yield f"{self.name}{_labels(self.labels, values)} {item}"
+        else:
+            yield f"{self.name} {value}"
+
+
+class SampledGauge(Gauge):
+    # Значение обновляет фоновый поток (см. start); при чтении отдается последнее,
+    # пропущенное через transform (например, возраст считается от сохраненного времени)
+    def __init__(self, name, help, func, labels=(), transform=None):
+        super().__init__(name, help, func, labels)
+        self.transform = transform
+        self._value = None
+
+    def refresh(self):
+        self._value = self.func()
+
+    def value(self):
+        if self.transform is not None:
+            return self.transform(self._value)
+        return self._value
+
+
+def gauge_value(name):
+    return _metrics[name].value()
+
+
+def render():
+    collected = _collect()
+    lines = []
+    for metric in list(_metrics.values()):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render(collected))
+    return "\n".join(lines) + "\n"
+
+
+# === ФОНОВОЕ ОБНОВЛЕНИЕ ===
+_refresher = None
+
+
+def refresh_sampled():
+    for metric in list(_metrics.values()):
+        if isinstance(metric, SampledGauge):
+            try:
+                metric.refresh()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления метрики {metric.name}: {e}")
+
+
+def start(interval=METRICS_REFRESH):
+    global _refresher
+    if _refresher is not None:
+        return
+
+    def run():
+        while True:
+            refresh_sampled()
+            time.sleep(interval)
+
+    _refresher = threading.Thread(target=run, name='metrics', daemon=True)
+    _refresher.start()
+    logger.info(f"📈 Метрики включены (обновление из БД раз в {interval:g}с)")
+
+
+# === ОБРАБОТЧИКИ И BOT API ===
+handler_calls = Counter('bot_handler_calls_total', 'Вызовы обработчиков обновлений', ('handler', 'status'))
+handler_seconds = Histogram('bot_handler_seconds', 'Время обработчика обновлений', ('handler',))
+api_requests = Counter('bot_api_requests_total', 'Запросы к Bot API по методу и коду ответа', ('method', 'code'))
+api_seconds = Histogram('bot_api_seconds', 'Время запроса к Bot API', ('method',))
+db_seconds = Histogram('bot_db_seconds', 'Время операций SQLite', ('op',), DB_BUCKETS, span_prefix='db')
+
+
+def describe_update(update):
+    # Короткое описание сообщения или callback для трассы
+    data = getattr(update, 'data', None)
+    if data is not None:
+        return f"callback {data}"
+    content_type = getattr(update, 'content_type', '')
+    user = getattr(update, 'from_user', None)
+    return f"{content_type} от {user.id}" if user else content_type
+
+
+def timed_handler(func):
+    name = func.__name__
+
+    @wraps(func)
+    def handler(message):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            with tracing.trace(name, describe_update(message), profile=True):
+                result = func(message)
+            status = 'ok'
+            return result
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+            handler_calls.inc(name, status)
+    return handler
+
+
+def timed_async_handler(func):
+    name = func.__name__
+
+    @wraps(func)
+    async def handler(message):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            # cProfile в event loop захватил бы чужие задачи: только трасса
+            with tracing.trace(name, describe_update(message)):
+                result = await func(message)
+            status = 'ok'
+            return result
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+            handler_calls.inc(name, status)
+    return handler
+
+
+def instrument_handlers(bot, wrap=timed_handler):
+    # Оборачивает уже зарегистрированные обработчики TeleBot/AsyncTeleBot
+    count = 0
+    for handlers in (bot.message_handlers, bot.callback_query_handlers):
+        for handler in handlers:
+            if not getattr(handler['function'], '_instrumented', False):
+                handler['function'] = wrap(handler['function'])
+                handler['function']._instrumented = True
+                count += 1
+    return count
+
+
+def api_error_code(error):
+    code = getattr(error, 'error_code', None)
+    return str(code) if code is not None else type(error).__name__
+
+
+def instrument_api():
+    # Все запросы TeleBot проходят через apihelper._make_request: там и меряем
+    from telebot import apihelper
+
+    make_request = apihelper._make_request
+    if getattr(make_request, '_instrumented', False):
+        return
+
+    @wraps(make_request)
+    def timed_request(token, method_name, method='get', params=None, files=None):
+        started = time.perf_counter()
+        code = '200'
+        try:
+            with tracing.span('api', method_name):
+                result = make_request(token, method_name, method, params, files)
+            health.beat('api')
+            return result
+        except Exception as e:
+            code = api_error_code(e)
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - started, method_name)
+            api_requests.inc(method_name, code)
+            if method_name == 'getUpdates':
+                health.beat('polling')
+
+    timed_request._instrumented = True
+    apihelper._make_request = timed_request
+
+
+def instrument_async_api():
+    # Запросы AsyncTeleBot идут через asyncio_helper._process_request. Отдельно от
+    # instrument_api: asyncio_helper тянет aiohttp (~0.2 с импорта), нужный только
+    # асинхронному движку
+    from telebot import asyncio_helper
+
+    process_request = asyncio_helper._process_request
+    if getattr(process_request, '_instrumented', False):
+        return
+
+    @wraps(process_request)
+    async def timed_process_request(token, url, method='get', params=None, files=None, **kwargs):
+        started = time.perf_counter()
+        code = '200'
+        try:
+            with tracing.span('api', url):
+                result = await process_request(token, url, method, params, files, **kwargs)
+            health.beat('api')
+            return result
+        except Exception as e:
+            code = api_error_code(e)
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - started, url)
+            api_requests.inc(url, code)
+            if url == 'getUpdates':
+                health.beat('polling')
+
+    timed_process_request._instrumented = True
+    asyncio_helper._process_request = timed_process_request
@@ -0,0 +1,382 @@
+import time
+import json
+import logging
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# === МИГРАЦИИ СХЕМЫ ===
+# Версия схемы хранится в PRAGMA user_version. При старте применяются
+# по порядку все миграции с номером больше текущей версии.
+# Обычная миграция выполняется в одной транзакции вместе с повышением версии.
+# Миграция с online=True делит работу на короткие транзакции через backfill(),
+# чтобы не держать блокировку записи, и обязана быть идемпотентной:
+# после падения она продолжится с того места, где остановилась.
+
+BACKFILL_BATCH_SIZE = 1000
+BACKFILL_PAUSE = 0.01
+
+MIGRATIONS = []
+
+
+def migration(version, description, online=False):
+    def register(func):
+        MIGRATIONS.append((version, description, online, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def get_version(conn=None):
+    if conn is None:
+        return db.fetchone("PRAGMA user_version")[0]
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _set_version(conn, version):
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+
+
+def backfill(sql, params=(), batch_size=BACKFILL_BATCH_SIZE):
+    # Последний параметр sql — LIMIT пачки
+    return backfill_batches(lambda conn, limit: conn.execute(sql, (*params, limit)).rowcount, batch_size)
+
+
+def backfill_batches(step, batch_size=BACKFILL_BATCH_SIZE):
+    # step(conn, limit) обрабатывает одну пачку в своей транзакции и возвращает
+    # число обработанных строк; повторяем, пока пачки полные
+    total = 0
+    while True:
+        with db.transaction() as conn:
+            changed = step(conn, batch_size)
+        total += changed
+        if changed < batch_size:
+            return total
+        time.sleep(BACKFILL_PAUSE)
+
+
+def migrate(target=None):
+    for version, description, online, func in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        if get_version() >= version:
+            continue
+
+        started = time.perf_counter()
+        if online:
+            func()
+            with db.transaction() as conn:
+                if get_version(conn) < version:
+                    _set_version(conn, version)
+        else:
+            with db.transaction() as conn:
+                if get_version(conn) >= version:
+                    continue
+                func(conn)
+                _set_version(conn, version)
+        logger.info(f"🧱 Миграция v{version} применена за {time.perf_counter() - started:.2f}с: {description}")
+
+    return get_version()
+
+
+# === СПИСОК МИГРАЦИЙ ===
+@migration(1, 'базовые таблицы')
+def _base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            user_name TEXT,
+            username TEXT,
+            message_text TEXT,
+            message_type TEXT,
+            file_id TEXT,
+            file_type TEXT,
+            timestamp TEXT,
+            status TEXT DEFAULT 'pending',
+            admin_reply TEXT DEFAULT NULL,
+            reply_sent BOOLEAN DEFAULT FALSE,
+            publish_type TEXT DEFAULT 'normal'
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bot_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type TEXT,
+            event_time TEXT,
+            details TEXT
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bot_errors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            error_type TEXT,
+            error_message TEXT,
+            error_time TEXT,
+            resolved BOOLEAN DEFAULT FALSE
+        )
+    ''')
+
+
+COUNTER_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_messages_insert AFTER INSERT ON messages
+    BEGIN
+        INSERT INTO stats_counters (name, value) VALUES ('messages', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        INSERT INTO stats_counters (name, value) VALUES ('status:' || COALESCE(NEW.status, ''), 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        INSERT INTO stats_counters (name, value)
+            SELECT 'unique_users', 1
+            WHERE NEW.user_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM stats_users WHERE user_id = NEW.user_id)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        INSERT OR IGNORE INTO stats_users (user_id) SELECT NEW.user_id WHERE NEW.user_id IS NOT NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_messages_status AFTER UPDATE OF status ON messages
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'status:' || COALESCE(OLD.status, '');
+        INSERT INTO stats_counters (name, value) VALUES ('status:' || COALESCE(NEW.status, ''), 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_events_insert AFTER INSERT ON bot_stats
+    BEGIN
+        INSERT INTO stats_counters (name, value) VALUES ('events:' || COALESCE(NEW.event_type, ''), 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_errors_insert AFTER INSERT ON bot_errors
+    BEGIN
+        INSERT INTO stats_counters (name, value) VALUES ('errors', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    END
+    ''',
+)
+
+
+
+@migration(2, 'счётчики статистики')
+def _stats_counters(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_users (
+            user_id INTEGER PRIMARY KEY
+        )
+    ''')
+
+    for trigger in COUNTER_TRIGGERS:
+        conn.execute(trigger)
+
+    if not conn.execute("SELECT 1 FROM stats_counters LIMIT 1").fetchone():
+        db.rebuild_counters()
+
+
+@migration(3, 'индексы под запросы бота')
+def _query_indexes(conn):
+    # /pending: WHERE status = 'pending' ORDER BY id DESC LIMIT n, пересчёт счётчиков по статусам
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_status_id ON messages (status, id)")
+    # Выборки и подсчёты по пользователю, COUNT(DISTINCT user_id)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, id)")
+    # Выборки по времени поступления
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+    # Подсчёт событий по типу (перезапуски и т.п.)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bot_stats_event ON bot_stats (event_type, event_time)")
+
+
+@migration(4, 'таблица файлов сообщений')
+def _message_files_table(conn):
+    # Файлы сообщения по порядку; первичный ключ (message_id, position) служит
+    # индексом для выборки сообщения вместе с файлами
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS message_files (
+            message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT,
+            media_type TEXT NOT NULL,
+            PRIMARY KEY (message_id, position)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _legacy_files(message_type, file_id, file_type):
+    # Альбомы раньше хранили JSON-список file_id в messages.file_id,
+    # а типы файлов — JSON-списком в file_type или одним типом на всех
+    if not file_id.startswith('['):
+        return [(file_id, file_type or message_type)]
+    try:
+        file_ids = json.loads(file_id)
+    except ValueError:
+        return [(file_id, file_type or message_type)]
+    file_types = [message_type] * len(file_ids)
+    if file_type and file_type.startswith('['):
+        try:
+            file_types = json.loads(file_type)
+        except ValueError:
+            pass
+    return list(zip(file_ids, file_types))
+
+
+@migration(5, 'перенос файлов сообщений в message_files', online=True)
+def _message_files_backfill():
+    # Идемпотентно: файлы вставляются через INSERT OR IGNORE, а у альбома
+    # в messages.file_id после переноса остается первый файл
+    state = {'last_id': 0}
+
+    def step(conn, limit):
+        rows = conn.execute(
+            "SELECT id, message_type, file_id, file_type FROM messages "
+            "WHERE id > ? AND file_id IS NOT NULL ORDER BY id LIMIT ?",
+            (state['last_id'], limit)
+        ).fetchall()
+        for message_id, message_type, file_id, file_type in rows:
+            files = _legacy_files(message_type, file_id, file_type)
+            conn.executemany(
+                "INSERT OR IGNORE INTO message_files (message_id, position, file_id, media_type) VALUES (?, ?, ?, ?)",
+                [(message_id, position, f_id, f_type) for position, (f_id, f_type) in enumerate(files)]
+            )
+            if file_id.startswith('['):
+                first_id, first_type = files[0] if files else (None, None)
+                conn.execute("UPDATE messages SET file_id = ?, file_type = ? WHERE id = ?", (first_id, first_type, message_id))
+        if rows:
+            state['last_id'] = rows[-1][0]
+        return len(rows)
+
+    moved = backfill_batches(step)
+    logger.info(f"📎 Файлы {moved} сообщений перенесены в message_files")
+
+
+@migration(6, 'захват заявок и уведомления админам')
+def _moderation_claims(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+    if 'claimed_by' not in columns:
+        conn.execute("ALTER TABLE messages ADD COLUMN claimed_by INTEGER")
+    if 'claimed_at' not in columns:
+        conn.execute("ALTER TABLE messages ADD COLUMN claimed_at TEXT")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS admin_notifications (
+            message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+            chat_id INTEGER NOT NULL,
+            notification_id INTEGER NOT NULL,
+            PRIMARY KEY (message_id, chat_id, notification_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+@migration(7, 'очередь публикаций в канал')
+def _publish_jobs(conn):
+    # run_after — время в секундах Unix, с которого задачу можно брать в работу;
+    # step — сколько отправок плана уже выполнено (продолжение после падения)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS publish_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+            publish_type TEXT NOT NULL,
+            admin_id INTEGER,
+            admin_name TEXT,
+            reply_chat_id INTEGER,
+            reply_message_id INTEGER,
+            state TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            step INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_publish_jobs_due ON publish_jobs (state, run_after)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_publish_jobs_message ON publish_jobs (message_id)")
+
+
+@migration(8, 'расписание публикаций в канал')
+def _publish_schedule(conn):
+    # position — место в очереди канала (NULL — задача без расписания),
+    # released_at — когда расписание выпустило задачу, cost — число сообщений в канале
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(publish_jobs)")}
+    if 'position' not in columns:
+        conn.execute("ALTER TABLE publish_jobs ADD COLUMN position REAL")
+    if 'released_at' not in columns:
+        conn.execute("ALTER TABLE publish_jobs ADD COLUMN released_at REAL")
+    if 'cost' not in columns:
+        conn.execute("ALTER TABLE publish_jobs ADD COLUMN cost INTEGER NOT NULL DEFAULT 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_publish_jobs_position ON publish_jobs (state, position)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_publish_jobs_released ON publish_jobs (released_at)")
+
+
+@migration(9, 'сводки событий и журнал обслуживания')
+def _event_rollups(conn):
+    # Сводка: число событий (source = 'event') или ошибок ('error') вида kind
+    # за час (period = 'hour', bucket 'ГГГГ-ММ-ДДTЧЧ') или сутки ('day', 'ГГГГ-ММ-ДД')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS event_rollups (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            source TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            first_time TEXT,
+            last_time TEXT,
+            PRIMARY KEY (period, bucket, source, kind)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            duration REAL NOT NULL,
+            rows INTEGER NOT NULL DEFAULT 0,
+            details TEXT
+        )
+    ''')
+    # Отбор старых строк для сворачивания — по времени, а не полным просмотром
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bot_stats_time ON bot_stats (event_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bot_errors_time ON bot_errors (error_time)")
+
+
+@migration(10, 'общее состояние процессов')
+def _shared_state(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shared_state (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+    ''')
+
+
+@migration(11, 'отпечатки заявок для повторов')
+def _submission_hashes(conn):
+    # repeats — сколько раз заявку прислали повторно (dedup.py);
+    # seen_at — последняя отправка с этим отпечатком, секунды Unix
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+    if 'repeats' not in columns:
+        conn.execute("ALTER TABLE messages ADD COLUMN repeats INTEGER NOT NULL DEFAULT 0")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS submission_hashes (
+            user_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (user_id, content_hash)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_submission_hashes_seen ON submission_hashes (seen_at)")
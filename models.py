@@ -0,0 +1,86 @@
+# === МОДЕЛЬ ЗАЯВКИ ===
+# Строка messages превращается в Submission прямо в курсоре (row factory),
+# без промежуточных кортежей и словарей. __slots__ убирает __dict__ у каждого
+# экземпляра. Файлы подгружаются при первом обращении, если запрос их не выбрал.
+
+SUBMISSION_COLUMNS = (
+    'id', 'user_id', 'user_name', 'username', 'text', 'message_type', 'file_id', 'file_type',
+    'timestamp', 'status', 'admin_reply', 'reply_sent', 'publish_type', 'repeats',
+)
+
+
+class Submission:
+    __slots__ = SUBMISSION_COLUMNS + ('_files',)
+
+    def __init__(self, id, user_id, user_name, username, text, message_type, file_id=None, file_type=None,
+                 timestamp=None, status=None, admin_reply=None, reply_sent=None, publish_type=None, repeats=0, files=None):
+        self.id = id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.username = username
+        self.text = text
+        self.message_type = message_type
+        self.file_id = file_id
+        self.file_type = file_type
+        self.timestamp = timestamp
+        self.status = status
+        self.admin_reply = admin_reply
+        self.reply_sent = reply_sent
+        self.publish_type = publish_type
+        self.repeats = repeats
+        self._files = files
+
+    @property
+    def files(self):
+        # [(file_id, media_type), ...] по порядку в альбоме
+        if self._files is None:
+            import db
+            self._files = db.get_files(self.id)
+        return self._files
+
+    @property
+    def file_ids(self):
+        return [file_id for file_id, _ in self.files]
+
+    @property
+    def file_types(self):
+        return [media_type for _, media_type in self.files]
+
+    def __repr__(self):
+        return f"Submission(#{self.id}, {self.message_type}, {self.status})"
+
+
+_new = object.__new__
+
+
+def submission_row(cursor, row):
+    # Row factory для запросов, выбирающих все столбцы messages в порядке SUBMISSION_COLUMNS.
+    # Без вызова __init__ с 15 аргументами: слоты заполняются одной распаковкой
+    submission = _new(Submission)
+    (submission.id, submission.user_id, submission.user_name, submission.username, submission.text,
+     submission.message_type, submission.file_id, submission.file_type, submission.timestamp,
+     submission.status, submission.admin_reply, submission.reply_sent, submission.publish_type,
+     submission.repeats) = row
+    submission._files = None
+    return submission
+
+
+# === ЗАДАЧА ПУБЛИКАЦИИ ===
+PUBLISH_JOB_COLUMNS = (
+    'id', 'message_id', 'publish_type', 'admin_id', 'admin_name', 'reply_chat_id', 'reply_message_id',
+    'state', 'attempts', 'step',
+)
+
+
+class PublishJob:
+    __slots__ = PUBLISH_JOB_COLUMNS
+
+    def __repr__(self):
+        return f"PublishJob(#{self.id}, заявка #{self.message_id}, {self.state}, попытка {self.attempts})"
+
+
+def publish_job_row(cursor, row):
+    job = _new(PublishJob)
+    (job.id, job.message_id, job.publish_type, job.admin_id, job.admin_name, job.reply_chat_id,
+     job.reply_message_id, job.state, job.attempts, job.step) = row
+    return job
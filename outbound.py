@@ -0,0 +1,328 @@
+import os
+import time
+import asyncio
+import bisect
+import itertools
+import threading
+import logging
+from functools import wraps
+
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+# === ПЛАНИРОВЩИК ИСХОДЯЩИХ ЗАПРОСОВ ===
+# Каждая отправка в Telegram проходит через общий планировщик:
+# - глобальный token bucket (лимит бота в целом, ~30 сообщений/с);
+# - token bucket на каждый чат (личка ~1/с, группы и каналы ~20/мин);
+# - очередь с приоритетами: публикации в канал идут раньше уведомлений
+#   админам, а те — раньше ответов пользователям;
+# - на 429 чат блокируется на retry_after, запрос возвращается в очередь
+#   на своё прежнее место и повторяется.
+
+PRIORITY_CHANNEL = 0
+PRIORITY_ADMIN = 1
+PRIORITY_USER = 2
+
+GLOBAL_RATE = float(os.environ.get('OUTBOUND_GLOBAL_RATE', '25'))
+PRIVATE_CHAT_RATE = float(os.environ.get('OUTBOUND_PRIVATE_RATE', '1'))
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = float(os.environ.get('OUTBOUND_GROUP_RATE_PER_MIN', '20')) / 60
+GROUP_CHAT_BURST = 3
+MAX_RETRIES = int(os.environ.get('OUTBOUND_MAX_RETRIES', '5'))
+MAX_TRACKED_CHATS = 10000
+
+SCHEDULED_METHODS = (
+    'send_message',
+    'send_photo',
+    'send_video',
+    'send_voice',
+    'send_document',
+    'send_sticker',
+    'send_media_group',
+    'forward_message',
+    'copy_message',
+    'edit_message_text',
+    'edit_message_reply_markup',
+)
+# Где в позиционных аргументах метода TeleBot стоит chat_id (по умолчанию первым)
+CHAT_ID_POSITION = {
+    'edit_message_text': 1,
+}
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now, cost=1):
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        needed = min(cost, self.capacity)
+        if self.tokens < needed:
+            wait = max(wait, (needed - self.tokens) / self.rate)
+        return wait
+
+    def take(self, cost=1):
+        # Может уйти в минус: крупный альбом «занимает» токены у будущего
+        self.tokens -= cost
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+def request_target(name, args, kwargs):
+    # → (chat_id, стоимость в токенах) для вызова метода name
+    position = CHAT_ID_POSITION.get(name, 0)
+    chat_id = args[position] if len(args) > position else kwargs.get('chat_id')
+    cost = 1
+    if name == 'send_media_group':
+        media = args[1] if len(args) > 1 else kwargs.get('media', ())
+        cost = max(1, len(media))
+    return chat_id, cost
+
+
+def is_group_chat(chat_id):
+    if isinstance(chat_id, str):
+        return chat_id.startswith('@') or chat_id.startswith('-')
+    return chat_id is not None and chat_id < 0
+
+
+def retry_after(error):
+    parameters = (error.result_json or {}).get('parameters') or {}
+    return parameters.get('retry_after', 1)
+
+
+class OutboundScheduler:
+    def __init__(self, global_rate=GLOBAL_RATE, classify=None):
+        self.classify = classify or (lambda chat_id: PRIORITY_USER)
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._global = TokenBucket(global_rate, max(1.0, global_rate), time.monotonic())
+        self._chats = {}
+        self.requests = 0
+        self.sent = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.queue_peak = 0
+
+    def _bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_TRACKED_CHATS:
+                self._prune(now)
+            if is_group_chat(chat_id):
+                bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST, now)
+            else:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def set_global_rate(self, rate):
+        # Процессы-воркеры (shards.py) делят лимит бота между собой
+        with self._cond:
+            self._global = TokenBucket(rate, max(1.0, rate), time.monotonic())
+
+    def _prune(self, now):
+        waiting = {entry[2] for entry in self._waiters}
+        for chat_id in [c for c, b in self._chats.items() if c not in waiting and b.idle(now)]:
+            del self._chats[chat_id]
+
+    def _wait_time(self, entry, now):
+        # Глобальные токены сначала резервируются за более приоритетными запросами,
+        # чьи чаты не упираются в лимит; запрос из «горячего» чата очередь не держит
+        reserved = 0
+        for waiter in self._waiters:
+            if waiter is entry:
+                break
+            if self._bucket(waiter[2], now).wait_time(now, waiter[3]) == 0:
+                reserved += waiter[3]
+        chat_wait = self._bucket(entry[2], now).wait_time(now, entry[3])
+        if chat_wait > 0:
+            return chat_wait
+        global_wait = self._global.wait_time(now, reserved + entry[3])
+        if global_wait > 0 and reserved:
+            # Впереди есть кандидаты: проснемся, когда они заберут свои токены
+            return max(global_wait, 0.01)
+        return global_wait
+
+    def acquire(self, chat_id, priority, seq, cost=1):
+        entry = (priority, seq, chat_id, cost)
+        with self._cond:
+            # seq уникален, поэтому кортежи упорядочиваются по (приоритет, очередность)
+            bisect.insort(self._waiters, entry)
+            self.queue_peak = max(self.queue_peak, len(self._waiters))
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(entry, now)
+                    if wait <= 0:
+                        self._global.take(cost)
+                        self._bucket(chat_id, now).take(cost)
+                        return
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                self._cond.notify_all()
+
+    def penalize(self, chat_id, seconds):
+        with self._cond:
+            now = time.monotonic()
+            self._bucket(chat_id, now).block(now, seconds)
+            self._cond.notify_all()
+
+    def call(self, chat_id, func, *args, cost=1, **kwargs):
+        priority = self.classify(chat_id)
+        seq = next(self._seq)
+        enqueued = time.monotonic()
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire(chat_id, priority, seq, cost)
+            if attempt == 0:
+                waited = time.monotonic() - enqueued
+                with self._cond:
+                    self.requests += 1
+                    self.wait_total += waited
+                    self.wait_max = max(self.wait_max, waited)
+            try:
+                result = func(*args, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 429 or attempt == MAX_RETRIES:
+                    with self._cond:
+                        self.rate_limited += e.error_code == 429
+                        self.failed += 1
+                    raise
+                with self._cond:
+                    self.rate_limited += 1
+                delay = retry_after(e)
+                logger.warning(f"⏳ 429 для чата {chat_id}: повтор через {delay}с (попытка {attempt + 1}/{MAX_RETRIES})")
+                self.penalize(chat_id, delay)
+                continue
+            with self._cond:
+                self.sent += 1
+            return result
+
+    def wrap(self, method):
+        @wraps(method)
+        def scheduled(*args, **kwargs):
+            chat_id, cost = request_target(method.__name__, args, kwargs)
+            return self.call(chat_id, method, *args, cost=cost, **kwargs)
+        return scheduled
+
+    def stats(self):
+        with self._cond:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            'queue_depth': len(self._waiters),
+            'queue_peak': self.queue_peak,
+            'sent': self.sent,
+            'rate_limited': self.rate_limited,
+            'failed': self.failed,
+            'avg_wait_ms': self.wait_total / self.requests * 1000 if self.requests else 0.0,
+            'max_wait_ms': self.wait_max * 1000,
+        }
+
+
+class AsyncOutboundScheduler(OutboundScheduler):
+    # Те же бакеты и приоритеты для AsyncTeleBot: ожидание идет в event loop,
+    # а не блокирует потоки. Все методы вызываются только из одного цикла.
+    def __init__(self, global_rate=GLOBAL_RATE, classify=None):
+        super().__init__(global_rate, classify)
+        from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException
+        self._api_error = AsyncApiTelegramException
+        self._cond = None
+
+    def _condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, chat_id, priority, seq, cost=1):
+        entry = (priority, seq, chat_id, cost)
+        cond = self._condition()
+        async with cond:
+            bisect.insort(self._waiters, entry)
+            self.queue_peak = max(self.queue_peak, len(self._waiters))
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(entry, now)
+                    if wait <= 0:
+                        self._global.take(cost)
+                        self._bucket(chat_id, now).take(cost)
+                        return
+                    try:
+                        await asyncio.wait_for(cond.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiters.remove(entry)
+                cond.notify_all()
+
+    async def penalize(self, chat_id, seconds):
+        cond = self._condition()
+        async with cond:
+            now = time.monotonic()
+            self._bucket(chat_id, now).block(now, seconds)
+            cond.notify_all()
+
+    async def call(self, chat_id, func, *args, cost=1, **kwargs):
+        priority = self.classify(chat_id)
+        seq = next(self._seq)
+        enqueued = time.monotonic()
+        for attempt in range(MAX_RETRIES + 1):
+            await self.acquire(chat_id, priority, seq, cost)
+            if attempt == 0:
+                waited = time.monotonic() - enqueued
+                self.requests += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            try:
+                result = await func(*args, **kwargs)
+            except self._api_error as e:
+                if e.error_code != 429 or attempt == MAX_RETRIES:
+                    self.rate_limited += e.error_code == 429
+                    self.failed += 1
+                    raise
+                self.rate_limited += 1
+                delay = retry_after(e)
+                logger.warning(f"⏳ 429 для чата {chat_id}: повтор через {delay}с (попытка {attempt + 1}/{MAX_RETRIES})")
+                await self.penalize(chat_id, delay)
+                continue
+            self.sent += 1
+            return result
+
+    def wrap(self, method):
+        @wraps(method)
+        async def scheduled(*args, **kwargs):
+            chat_id, cost = request_target(method.__name__, args, kwargs)
+            return await self.call(chat_id, method, *args, cost=cost, **kwargs)
+        return scheduled
+
+    def stats(self):
+        return self._snapshot()
+
+
+def install(bot, scheduler, methods=SCHEDULED_METHODS):
+    for name in methods:
+        setattr(bot, name, scheduler.wrap(getattr(bot, name)))
+    logger.info(f"🚦 Планировщик отправки подключен ({len(methods)} методов)")
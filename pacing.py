@@ -0,0 +1,88 @@
+import os
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# === РАСПИСАНИЕ ПУБЛИКАЦИЙ В КАНАЛ ===
+# Одобренные заявки не уходят в канал разом, а выпускаются из очереди по одной:
+# - по интервалу: следующая публикация не раньше, чем через
+#   PUBLISH_INTERVAL × (число сообщений предыдущей) секунд — альбом из 5 файлов
+#   занимает 5 интервалов, поэтому канал получает не больше 60 / PUBLISH_INTERVAL
+#   сообщений в минуту при любом составе очереди;
+# - по слотам: если задан PUBLISH_SLOTS (например, "09:00,13:00,19:30"), в каждый
+#   слот выходит одна публикация, время — локальное время сервера. Слот,
+#   пропущенный, пока бот лежал, отрабатывается сразу после старта (один раз).
+# PUBLISH_INTERVAL=0 без слотов — публикация сразу после одобрения.
+# Альбом уходит в канал одним пакетом, поэтому интервал берется с запасом
+# относительно лимита канала (~20 сообщений/мин → от 3 с + размер альбома);
+# см. benchmarks/bench_pacing.py.
+
+PUBLISH_INTERVAL = float(os.environ.get('PUBLISH_INTERVAL', '60'))
+
+
+def parse_slots(value):
+    slots = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            hour, minute = (int(part) for part in item.split(':'))
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                raise ValueError
+        except ValueError:
+            logger.error(f"❌ Неверный слот публикации: {item!r} (нужно ЧЧ:ММ)")
+            continue
+        slots.append((hour, minute))
+    return sorted(set(slots))
+
+
+PUBLISH_SLOTS = parse_slots(os.environ.get('PUBLISH_SLOTS', ''))
+
+
+class Pacer:
+    def __init__(self, interval=PUBLISH_INTERVAL, slots=PUBLISH_SLOTS):
+        self.interval = max(0.0, interval)
+        self.slots = list(slots)
+
+    @property
+    def enabled(self):
+        return bool(self.slots) or self.interval > 0
+
+    def next_slot(self, after):
+        # Первый слот строго позже момента after (секунды Unix)
+        day = datetime.fromtimestamp(after).replace(hour=0, minute=0, second=0, microsecond=0)
+        for offset in range(2):
+            for hour, minute in self.slots:
+                slot = (day + timedelta(days=offset, hours=hour, minutes=minute)).timestamp()
+                if slot > after:
+                    return slot
+        return after + 86400
+
+    def next_release(self, last_released, last_cost, now):
+        # Когда можно выпустить следующую публикацию после последней выпущенной
+        if self.slots:
+            return self.next_slot(now if last_released is None else last_released)
+        if last_released is None:
+            return now
+        return last_released + self.interval * max(1, last_cost or 1)
+
+    def schedule(self, last_released, last_cost, costs, now):
+        # Ожидаемое время выхода для очереди публикаций с заданным числом сообщений
+        times = []
+        for cost in costs:
+            release = max(now, self.next_release(last_released, last_cost, now))
+            times.append(release)
+            last_released, last_cost = release, cost
+        return times
+
+    def describe(self):
+        if self.slots:
+            return "слоты " + ", ".join(f"{hour:02d}:{minute:02d}" for hour, minute in self.slots)
+        if self.interval > 0:
+            return f"не чаще одного сообщения в {self.interval:g} с"
+        return "без ограничений"
+
+
+pacer = Pacer()
@@ -0,0 +1,356 @@
+import os
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+
+import db
+import dedup
+import migrations
+from metrics import db_seconds
+
+logger = logging.getLogger(__name__)
+
+# === ХРАНЕНИЕ И ОБСЛУЖИВАНИЕ БАЗЫ ===
+# События (bot_stats) и ошибки (bot_errors) старше EVENTS_RETENTION_DAYS
+# сворачиваются в почасовые строки event_rollups (сколько событий каждого типа
+# было за час), исходные строки удаляются. Почасовые сводки старше
+# ROLLUP_HOURLY_DAYS сворачиваются в суточные. Каждая пачка из
+# RETENTION_BATCH_SIZE строк — своя короткая транзакция с паузой после нее,
+# поэтому запись бота ждет не дольше одной пачки. Счетчики /stats удаление
+# не меняет: триггеры висят только на INSERT.
+# Освободившиеся страницы возвращаются файлу через PRAGMA incremental_vacuum
+# порциями по VACUUM_STEP_PAGES, WAL переносится в базу пассивным checkpoint
+# (не ждет читателей и писателей) раз в CHECKPOINT_INTERVAL.
+# Отпечатки заявок (submission_hashes) старше окна DEDUP_WINDOW удаляются теми же пачками.
+# Каждый запуск пишется в maintenance_log, журнал и сроки хранения — /maintenance.
+# Перевод существующей базы в auto_vacuum = INCREMENTAL требует полного VACUUM,
+# который держит базу целиком, поэтому сам он не запускается: в журнал пишется
+# совет, перевод выполняет админ командой /maintenance convert.
+# Ручной запуск (/maintenance run) только ставит задачи в shared_state и будит
+# поток обслуживания: задачи выполняются в нем, а не в обработчике команды.
+
+EVENTS_RETENTION_DAYS = float(os.environ.get('EVENTS_RETENTION_DAYS', '30'))
+ROLLUP_HOURLY_DAYS = float(os.environ.get('ROLLUP_HOURLY_DAYS', '180'))
+MAINTENANCE_INTERVAL = float(os.environ.get('MAINTENANCE_INTERVAL', '3600'))
+CHECKPOINT_INTERVAL = float(os.environ.get('CHECKPOINT_INTERVAL', '600'))
+MAINTENANCE_START_DELAY = 60
+RETENTION_BATCH_SIZE = 500
+VACUUM_STEP_PAGES = 256
+VACUUM_PAUSE = 0.01
+MAINTENANCE_LOG_KEEP = 500
+REQUEST_SCOPE = 'maintenance'
+
+_convert_warned = False
+
+SOURCES = (
+    # source в event_rollups, таблица, колонка типа, колонка времени
+    ('event', 'bot_stats', 'event_type', 'event_time'),
+    ('error', 'bot_errors', 'error_type', 'error_time'),
+)
+
+SQL_UPSERT_ROLLUP = (
+    "INSERT INTO event_rollups (period, bucket, source, kind, count, first_time, last_time) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (period, bucket, source, kind) DO UPDATE SET "
+    "count = count + excluded.count, "
+    "first_time = MIN(first_time, excluded.first_time), "
+    "last_time = MAX(last_time, excluded.last_time)"
+)
+SQL_PRUNE_HASHES = (
+    "DELETE FROM submission_hashes WHERE (user_id, content_hash) IN "
+    "(SELECT user_id, content_hash FROM submission_hashes WHERE seen_at < ? LIMIT ?)"
+)
+SQL_INSERT_LOG = "INSERT INTO maintenance_log (task, started_at, duration, rows, details) VALUES (?, ?, ?, ?, ?)"
+SQL_PRUNE_LOG = "DELETE FROM maintenance_log WHERE id <= (SELECT MAX(id) FROM maintenance_log) - ?"
+
+
+def _merge(counts, key, count, first, last):
+    current = counts.get(key)
+    if current is None:
+        counts[key] = [count, first, last]
+    else:
+        current[0] += count
+        current[1] = min(current[1], first)
+        current[2] = max(current[2], last)
+
+
+def _upsert(conn, period, counts):
+    conn.executemany(SQL_UPSERT_ROLLUP, [
+        (period, bucket, source, kind, count, first, last)
+        for (bucket, source, kind), (count, first, last) in counts.items()
+    ])
+
+
+# === СВОРАЧИВАНИЕ ===
+def rollup_raw(source, table, kind_column, time_column, cutoff, batch_size=RETENTION_BATCH_SIZE):
+    # Строки старше cutoff (ISO-время) → почасовые сводки; возвращает число удаленных строк
+    def step(conn, limit):
+        rows = conn.execute(
+            f"SELECT id, COALESCE({kind_column}, ''), {time_column} FROM {table} "
+            f"WHERE {time_column} < ? ORDER BY {time_column} LIMIT ?",
+            (cutoff, limit)
+        ).fetchall()
+        counts = {}
+        for _, kind, stamp in rows:
+            _merge(counts, (stamp[:13], source, kind), 1, stamp, stamp)
+        _upsert(conn, 'hour', counts)
+        conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(row[0],) for row in rows])
+        return len(rows)
+
+    return migrations.backfill_batches(step, batch_size)
+
+
+def rollup_hours(cutoff, batch_size=RETENTION_BATCH_SIZE):
+    # Почасовые сводки до часа cutoff ('ГГГГ-ММ-ДДTЧЧ') → суточные
+    def step(conn, limit):
+        rows = conn.execute(
+            "SELECT bucket, source, kind, count, first_time, last_time FROM event_rollups "
+            "WHERE period = 'hour' AND bucket < ? ORDER BY bucket LIMIT ?",
+            (cutoff, limit)
+        ).fetchall()
+        counts = {}
+        for bucket, source, kind, count, first, last in rows:
+            _merge(counts, (bucket[:10], source, kind), count, first, last)
+        _upsert(conn, 'day', counts)
+        conn.executemany(
+            "DELETE FROM event_rollups WHERE period = 'hour' AND bucket = ? AND source = ? AND kind = ?",
+            [row[:3] for row in rows]
+        )
+        return len(rows)
+
+    return migrations.backfill_batches(step, batch_size)
+
+
+def apply_retention(now=None):
+    now = now or datetime.now()
+    cutoff = (now - timedelta(days=EVENTS_RETENTION_DAYS)).isoformat()
+    moved = {source: rollup_raw(source, table, kind_column, time_column, cutoff)
+             for source, table, kind_column, time_column in SOURCES}
+    merged = rollup_hours((now - timedelta(days=ROLLUP_HOURLY_DAYS)).isoformat()[:13])
+    details = f"события {moved['event']}, ошибки {moved['error']} → часы; часовых сводок {merged} → сутки"
+    return moved['event'] + moved['error'] + merged, details
+
+
+def prune_hashes(now=None):
+    # Повтор после окна — уже новая заявка, отпечаток ей не нужен
+    cutoff = (now or time.time()) - max(dedup.DEDUP_WINDOW, 0)
+    removed = migrations.backfill(SQL_PRUNE_HASHES, (cutoff,), RETENTION_BATCH_SIZE)
+    return removed, f"отпечатков заявок удалено {removed}"
+
+
+# === ФАЙЛ БАЗЫ ===
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def _size_mb(conn):
+    return _pragma(conn, 'page_count') * _pragma(conn, 'page_size') / 1024 / 1024
+
+
+def advise_incremental_vacuum():
+    # Совет один раз за процесс; True — база уже в auto_vacuum = INCREMENTAL
+    global _convert_warned
+    with db.connection() as conn:
+        if _pragma(conn, 'auto_vacuum') == 2:
+            return True
+        size_mb = _size_mb(conn)
+    if not _convert_warned:
+        _convert_warned = True
+        logger.warning(
+            f"🧹 База {size_mb:.1f} МБ без auto_vacuum = INCREMENTAL: место после очистки не вернется в ФС. "
+            f"Выполните /maintenance convert (полный VACUUM) в окно обслуживания"
+        )
+    return False
+
+
+def convert_vacuum():
+    # Только по команде админа: полный VACUUM блокирует базу на все время работы
+    with db.connection() as conn:
+        if _pragma(conn, 'auto_vacuum') == 2:
+            return 0, "база уже в auto_vacuum = INCREMENTAL"
+        size_mb = _size_mb(conn)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        with db_seconds.time('vacuum'):
+            conn.execute("VACUUM")
+    return 0, f"база переведена в auto_vacuum = INCREMENTAL (полный VACUUM, {size_mb:.1f} МБ)"
+
+
+def incremental_vacuum(step_pages=VACUUM_STEP_PAGES):
+    with db.connection() as conn:
+        if _pragma(conn, 'auto_vacuum') != 2:
+            return 0, "auto_vacuum выключен"
+        page_size = _pragma(conn, 'page_size')
+    freed = 0
+    while True:
+        with db.connection() as conn:
+            free = _pragma(conn, 'freelist_count')
+            if not free:
+                break
+            # execute() делает один шаг, а incremental_vacuum освобождает страницу
+            # за шаг; executescript выполняет прагму до конца в своей транзакции
+            with db_seconds.time('vacuum'):
+                conn.executescript(f"PRAGMA incremental_vacuum({int(step_pages)})")
+            freed += free - _pragma(conn, 'freelist_count')
+        time.sleep(VACUUM_PAUSE)
+    return freed, f"освобождено {freed} страниц ({freed * page_size / 1024:.0f} КБ)"
+
+
+def vacuum():
+    if not advise_incremental_vacuum():
+        return 0, "auto_vacuum выключен, нужен /maintenance convert"
+    return incremental_vacuum()
+
+
+def checkpoint():
+    # Вне транзакции: внутри нее checkpoint не может сбросить WAL
+    with db.connection() as conn:
+        busy, wal_pages, moved = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    return max(moved, 0), f"WAL {max(wal_pages, 0)} страниц, перенесено {max(moved, 0)}" + (", база занята" if busy else "")
+
+
+def storage_info():
+    with db.connection() as conn:
+        page_size = _pragma(conn, 'page_size')
+        info = {
+            'size': _pragma(conn, 'page_count') * page_size,
+            'free': _pragma(conn, 'freelist_count') * page_size,
+            'incremental': _pragma(conn, 'auto_vacuum') == 2,
+            'raw_events': conn.execute("SELECT COUNT(*) FROM bot_stats").fetchone()[0],
+            'raw_errors': conn.execute("SELECT COUNT(*) FROM bot_errors").fetchone()[0],
+            'rollups': dict(conn.execute("SELECT period, COUNT(*) FROM event_rollups GROUP BY period").fetchall()),
+        }
+    try:
+        info['wal'] = os.path.getsize(db.DB_PATH + '-wal')
+    except OSError:
+        info['wal'] = 0
+    return info
+
+
+# === ЖУРНАЛ И РАСПИСАНИЕ ===
+def log_run(task, started_at, duration, rows, details):
+    with db.transaction() as conn:
+        conn.execute(SQL_INSERT_LOG, (task, started_at.isoformat(timespec='seconds'), duration, rows, details))
+        conn.execute(SQL_PRUNE_LOG, (MAINTENANCE_LOG_KEEP,))
+
+
+def recent_runs(limit=10):
+    return db.fetchall(
+        "SELECT task, started_at, duration, rows, details FROM maintenance_log ORDER BY id DESC LIMIT ?",
+        (limit,)
+    )
+
+
+class Maintenance:
+    def __init__(self, tasks, manual=(), start_delay=MAINTENANCE_START_DELAY):
+        # tasks: [(имя, интервал в секундах, функция → (строк, описание))], выполняются по порядку;
+        # manual: [(имя, функция)] — задачи только для ручного запуска
+        self.tasks = list(tasks)
+        self.manual = list(manual)
+        self.start_delay = start_delay
+        self._due = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        first = time.monotonic() + self.start_delay
+        self._due = {name: first for name, _, _ in self.tasks}
+        self._stop.clear()
+        # Запросы, оставшиеся от прошлого запуска, не выполняем
+        for name in self.names():
+            db.state_pop(REQUEST_SCOPE, name)
+        self._thread = threading.Thread(target=self._run, name='maintenance', daemon=True)
+        self._thread.start()
+        logger.info(
+            f"🧹 Обслуживание БД включено: события хранятся {EVENTS_RETENTION_DAYS:g} дн., "
+            f"часовые сводки {ROLLUP_HOURLY_DAYS:g} дн."
+        )
+
+    def stop(self, timeout=30):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def run_task(self, name, func):
+        # Задачи не пересекаются: фоновый проход и ручной запуск идут по очереди
+        with self._lock:
+            started_at = datetime.now()
+            started = time.perf_counter()
+            try:
+                rows, details = func()
+            except Exception as e:
+                rows, details = 0, f"ошибка: {e}"
+                logger.error(f"❌ Обслуживание БД {name}: {e}")
+            duration = time.perf_counter() - started
+            try:
+                log_run(name, started_at, duration, rows, details)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи журнала обслуживания: {e}")
+        logger.info(f"🧹 {name}: {details} за {duration:.2f}с")
+        return rows, details
+
+    def run_all(self):
+        return [(name,) + self.run_task(name, func) for name, _, func in self.tasks]
+
+    def names(self):
+        return [name for name, _, _ in self.tasks] + [name for name, _ in self.manual]
+
+    def request(self, names=None):
+        # Ручной запуск из любого процесса: отметка в shared_state, выполнит поток
+        # обслуживания после wake(); names=None — все плановые задачи
+        names = [name for name, _, _ in self.tasks] if names is None else list(names)
+        unknown = [name for name in names if name not in self.names()]
+        if unknown:
+            raise ValueError(f"неизвестные задачи: {', '.join(unknown)}")
+        for name in names:
+            db.state_set(REQUEST_SCOPE, name, '1')
+        return names
+
+    def wake(self):
+        self._wake.set()
+
+    def _run_requested(self):
+        funcs = [(name, func) for name, _, func in self.tasks] + self.manual
+        for name, func in funcs:
+            if self._stop.is_set():
+                return
+            try:
+                requested = db.state_pop(REQUEST_SCOPE, name) is not None
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения запроса обслуживания: {e}")
+                return
+            if requested:
+                self.run_task(name, func)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            self._run_requested()
+            now = time.monotonic()
+            for name, interval, func in self.tasks:
+                if self._due[name] <= now:
+                    self.run_task(name, func)
+                    self._due[name] = time.monotonic() + interval
+            self._wake.wait(max(0.0, min(self._due.values()) - time.monotonic()))
+
+
+def default_tasks():
+    return [
+        ('retention', MAINTENANCE_INTERVAL, apply_retention),
+        ('dedup', MAINTENANCE_INTERVAL, prune_hashes),
+        ('vacuum', MAINTENANCE_INTERVAL, vacuum),
+        ('checkpoint', CHECKPOINT_INTERVAL, checkpoint),
+    ]
+
+
+def manual_tasks():
+    return [
+        ('convert', convert_vacuum),
+    ]
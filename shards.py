@@ -0,0 +1,293 @@
+import os
+import json
+import queue
+import threading
+import time
+import logging
+import multiprocessing
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# === НЕСКОЛЬКО ПРОЦЕССОВ (BOT_PROCESSES > 1) ===
+# Один процесс упирается в GIL. В этом режиме главный процесс только получает
+# обновления (getUpdates или webhook) и раскладывает их по BOT_PROCESSES
+# процессам-воркерам: номер воркера — hash(id чата или автора callback) по
+# модулю числа воркеров. Все обновления одного пользователя, в том числе все
+# части его альбома, попадают в один процесс и там — в один поток, поэтому
+# порядок и сборка альбомов не меняются. Очереди к воркерам ограничены
+# (SHARD_QUEUE_SIZE): при переполнении getUpdates ждет, webhook отвечает 503.
+# Упавший воркер перезапускается с той же очередью.
+# Состояние, которое должны видеть все процессы, хранится вне процесса:
+# SharedMap — в таблице shared_state (SQLite), SharedCounter — в разделяемой памяти.
+# Очередь публикаций и обслуживание БД работают только в главном процессе:
+# воркер будит их через SharedWakeup (multiprocessing.Event), иначе задача
+# ждала бы следующей проверки (JOB_POLL_INTERVAL, расписание обслуживания).
+# Процессы запускаются через spawn: импорт bot.py не имеет побочных эффектов
+# (см. startup.py), а fork процесса с работающими потоками небезопасен.
+
+BOT_PROCESSES = int(os.environ.get('BOT_PROCESSES', '1'))
+SHARD_QUEUE_SIZE = int(os.environ.get('SHARD_QUEUE_SIZE', '1000'))
+SHARD_THREADS = int(os.environ.get('SHARD_THREADS', '4'))
+SHARD_WATCH_INTERVAL = 1.0
+# Заявку может изменить другой процесс: в кэше заявок (db.submission_cache) она живет недолго
+SHARD_CACHE_TTL = 5
+SHARD_STOP_TIMEOUT = 30
+
+
+def context():
+    return multiprocessing.get_context('spawn')
+
+
+def shard_key(update):
+    # update — JSON-объект Update: чат сообщения или автор callback
+    message = update.get('message') or update.get('edited_message')
+    if message:
+        return message['chat']['id']
+    callback = update.get('callback_query')
+    if callback:
+        return callback['from']['id']
+    return update.get('update_id')
+
+
+# === ОБЩЕЕ СОСТОЯНИЕ ===
+class SharedMap:
+    # Словарь в таблице shared_state: каждое обращение — запрос к SQLite
+    def __init__(self, scope):
+        self.scope = scope
+
+    def get(self, key, default=None):
+        value = db.state_get(self.scope, str(key))
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value):
+        db.state_set(self.scope, str(key), json.dumps(value))
+
+    def pop(self, key, default=None):
+        value = db.state_pop(self.scope, str(key))
+        return default if value is None else json.loads(value)
+
+    def __contains__(self, key):
+        return db.state_get(self.scope, str(key)) is not None
+
+    def __getitem__(self, key):
+        value = db.state_get(self.scope, str(key))
+        if value is None:
+            raise KeyError(key)
+        return json.loads(value)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+
+class SharedCounter:
+    # В одном процессе — число под блокировкой; share() переносит его в
+    # multiprocessing.Value, которую воркеры получают при запуске и подключают attach()
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = 0
+        self._shared = None
+
+    def share(self):
+        if self._shared is None:
+            self._shared = context().Value('q', self._local)
+        return self._shared
+
+    def attach(self, shared):
+        self._shared = shared
+
+    def add(self, delta=1):
+        if self._shared is None:
+            with self._lock:
+                self._local += delta
+                return self._local
+        with self._shared.get_lock():
+            self._shared.value += delta
+            return self._shared.value
+
+    def reset(self):
+        if self._shared is None:
+            with self._lock:
+                self._local = 0
+        else:
+            with self._shared.get_lock():
+                self._shared.value = 0
+
+    @property
+    def value(self):
+        return self._local if self._shared is None else self._shared.value
+
+
+class SharedWakeup:
+    # Будит поток главного процесса (очередь публикаций, обслуживание БД) из любого процесса.
+    # В одном процессе wake() сразу вызывает callback; share() создает
+    # multiprocessing.Event и поток, который ждет его и вызывает callback,
+    # воркеры получают Event при запуске и подключают attach()
+    def __init__(self, callback, name='wakeup'):
+        self.callback = callback
+        self.name = name
+        self._event = None
+        self._thread = None
+        self._running = False
+
+    def share(self):
+        if self._event is None:
+            self._event = context().Event()
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._relay, name=self.name, daemon=True)
+            self._thread.start()
+        return self._event
+
+    def attach(self, event):
+        self._event = event
+
+    def wake(self):
+        if self._event is None:
+            self.callback()
+        else:
+            self._event.set()
+
+    def _relay(self):
+        while self._running:
+            if not self._event.wait(SHARD_WATCH_INTERVAL):
+                continue
+            # Сигнал, пришедший после clear(), разбудит следующую итерацию
+            self._event.clear()
+            try:
+                self.callback()
+            except Exception as e:
+                logger.error(f"❌ Ошибка пробуждения {self.name}: {e}")
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(SHARD_WATCH_INTERVAL * 2)
+            self._thread = None
+
+
+# === ПРОЦЕССЫ-ВОРКЕРЫ ===
+def serve(updates, handle):
+    # Цикл процесса-воркера: handle(update) до None в очереди или смерти главного процесса
+    parent = os.getppid()
+    while True:
+        try:
+            update = updates.get(timeout=1)
+        except queue.Empty:
+            if os.getppid() != parent:
+                logger.warning("⚠️ Главный процесс завершился, воркер останавливается")
+                return
+            continue
+        if update is None:
+            return
+        handle(update)
+
+
+class ShardPool:
+    def __init__(self, count, target, queue_size=SHARD_QUEUE_SIZE, name='shard'):
+        # target(номер, всего, очередь, *args) выполняется в процессе-воркере; None в очереди — остановка
+        self.count = max(1, count)
+        self.target = target
+        self.args = ()
+        self.queue_size = queue_size
+        self.name = name
+        self.dispatched = [0] * self.count
+        self.restarts = 0
+        self._queues = []
+        self._processes = []
+        self._running = False
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self, *args):
+        # args — то, что воркеры получают при запуске (очередь логов, разделяемые счетчики)
+        if self._running:
+            return
+        self.args = args
+        ctx = context()
+        self._queues = [ctx.Queue(self.queue_size) for _ in range(self.count)]
+        self._processes = [self._spawn(index) for index in range(self.count)]
+        self._running = True
+        self._watcher = threading.Thread(target=self._watch, name=f"{self.name}-watch", daemon=True)
+        self._watcher.start()
+        logger.info(f"🧩 Запущено процессов-воркеров: {self.count}")
+
+    def _spawn(self, index):
+        process = context().Process(
+            target=self.target,
+            args=(index, self.count, self._queues[index]) + self.args,
+            name=f"{self.name}-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def shard_of(self, key):
+        return hash(key) % self.count
+
+    def dispatch(self, key, item):
+        # Ждет, если очередь воркера заполнена
+        index = self.shard_of(key)
+        self._queues[index].put(item)
+        self.dispatched[index] += 1
+
+    def offer(self, key, item):
+        index = self.shard_of(key)
+        try:
+            self._queues[index].put_nowait(item)
+        except queue.Full:
+            return False
+        self.dispatched[index] += 1
+        return True
+
+    def _watch(self):
+        while self._running:
+            time.sleep(SHARD_WATCH_INTERVAL)
+            with self._lock:
+                for index, process in enumerate(self._processes):
+                    if self._running and not process.is_alive():
+                        logger.error(f"❌ Процесс {process.name} завершился (код {process.exitcode}), перезапускаем")
+                        self.restarts += 1
+                        self._processes[index] = self._spawn(index)
+
+    def stop(self, timeout=SHARD_STOP_TIMEOUT):
+        # Воркеры дорабатывают то, что уже в очереди, и завершаются
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        for q in self._queues:
+            try:
+                q.put(None, timeout=1)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"⚠️ Процесс {process.name} не остановился за {timeout}с, завершаем")
+                process.terminate()
+        logger.info(f"🧩 Процессы-воркеры остановлены: обработано {sum(self.dispatched)} обновлений")
+
+    def stats(self):
+        queues = []
+        for q in self._queues:
+            try:
+                queues.append(q.qsize())
+            except NotImplementedError:
+                queues.append(None)
+        return {
+            'processes': self.count,
+            'alive': sum(process.is_alive() for process in self._processes),
+            'restarts': self.restarts,
+            'queues': queues,
+            'dispatched': list(self.dispatched),
+        }
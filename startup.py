@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# === ЗАПУСК ===
+# Импорт bot.py ничего не делает сам: папка данных, логирование, миграции,
+# запросы к Bot API и фоновые потоки запускаются по фазам из bot.start().
+# Phases замеряет каждую фазу (первая — импорт модулей, от импорта этого модуля),
+# run_checks выполняет сетевые проверки (getMe, getChat, webhook) параллельно:
+# запуск ждет самую медленную из них, а не их сумму.
+# После успешных проверок их итог сохраняется в DATA_DIR/startup_state.json.
+# Если при следующем запуске файл свежий (моложе STARTUP_STATE_TTL) и выписан
+# для того же бота, канала и режима — это теплый рестарт (редеплой, падение
+# процесса): проверки уходят в фон, и polling начинается сразу после локальной
+# работы. Провал фоновой проверки удаляет файл, следующий запуск будет холодным.
+# python bot.py --startup-report печатает время каждой фазы и выходит.
+
+STARTUP_STATE_TTL = float(os.environ.get('STARTUP_STATE_TTL', '86400'))
+STARTUP_CHECK_TIMEOUT = float(os.environ.get('STARTUP_CHECK_TIMEOUT', '15'))
+
+
+class Phases:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.items = []
+
+    def add(self, name, seconds, note='', local=True):
+        self.items.append((name, seconds, note, local))
+
+    @contextmanager
+    def phase(self, name, local=True):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, local=local)
+
+    def since_start(self, name):
+        # Время от импорта этого модуля до вызова: импорт остальных модулей
+        self.add(name, time.perf_counter() - self.started)
+
+    def local_seconds(self):
+        return sum(seconds for _, seconds, _, local in self.items if local)
+
+    def network_seconds(self):
+        return sum(seconds for _, seconds, _, local in self.items if not local)
+
+    def report(self):
+        lines = [f"   {name:<28} {seconds * 1000:8.1f} мс{'  ' + note if note else ''}" for name, seconds, note, _ in self.items]
+        lines.append(f"   {'локальная работа':<28} {self.local_seconds() * 1000:8.1f} мс")
+        lines.append(f"   {'ожидание сети':<28} {self.network_seconds() * 1000:8.1f} мс")
+        return lines
+
+
+# Создается при импорте модуля: от этого момента считается фаза импорта
+phases = Phases()
+
+
+class CheckResult:
+    __slots__ = ('ok', 'value', 'error', 'duration')
+
+    def __init__(self, ok, value, error, duration):
+        self.ok = ok
+        self.value = value
+        self.error = error
+        self.duration = duration
+
+
+def _timed(func):
+    started = time.perf_counter()
+    try:
+        return CheckResult(True, func(), None, time.perf_counter() - started)
+    except Exception as e:
+        return CheckResult(False, None, str(e), time.perf_counter() - started)
+
+
+def run_checks(checks, timeout=STARTUP_CHECK_TIMEOUT):
+    # checks: [(имя, функция)] → {имя: CheckResult}; не уложившиеся в timeout считаются проваленными
+    if not checks:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=len(checks), thread_name_prefix='startup')
+    futures = {name: executor.submit(_timed, func) for name, func in checks}
+    wait(futures.values(), timeout)
+    executor.shutdown(wait=False)
+    return {
+        name: future.result() if future.done() else CheckResult(False, None, f"нет ответа за {timeout:g}с", timeout)
+        for name, future in futures.items()
+    }
+
+
+def run_checks_background(checks, on_done, timeout=STARTUP_CHECK_TIMEOUT):
+    def run():
+        try:
+            on_done(run_checks(checks, timeout))
+        except Exception as e:
+            logger.error(f"❌ Ошибка фоновых проверок запуска: {e}")
+
+    thread = threading.Thread(target=run, name='startup-checks', daemon=True)
+    thread.start()
+    return thread
+
+
+def describe(results):
+    return ", ".join(
+        f"{name} {result.duration * 1000:.0f} мс {'✅' if result.ok else '❌'}" for name, result in results.items()
+    )
+
+
+# === СОСТОЯНИЕ ДЛЯ ТЕПЛОГО РЕСТАРТА ===
+def load_state(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if isinstance(state, dict) else None
+
+
+def save_state(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(state, saved_at=time.time()), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def forget_state(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def warm_state(path, ttl=STARTUP_STATE_TTL, **expected):
+    # Сохраненный итог проверок, если он свежий и выписан для тех же параметров
+    state = load_state(path)
+    if state is None or time.time() - state.get('saved_at', 0) > ttl:
+        return None
+    if any(state.get(key) != value for key, value in expected.items()):
+        return None
+    return state
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+
+class FakeClock:
+    # Часы для тестов: время двигается только через advance()
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def database(tmp_path):
+    # Пустая база во временном каталоге; соединения закрываются после теста
+    db.configure(str(tmp_path / 'bot.db'), pool_size=2)
+    yield db
+    db.close_all()
@@ -0,0 +1,87 @@
+import time
+
+from db import LRUCache
+
+
+def test_get_put_and_stats():
+    cache = LRUCache(maxsize=2, ttl=60)
+    assert cache.get(1) is None
+    cache.put(1, 'a')
+    assert cache.get(1) == 'a'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+    assert stats['hit_rate'] == 0.5
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.put(1, 'a')
+    cache.put(2, 'b')
+    cache.get(1)
+    cache.put(3, 'c')
+    assert cache.get(2) is None
+    assert cache.get(1) == 'a'
+    assert cache.get(3) == 'c'
+
+
+def test_expired_items_are_dropped(monkeypatch):
+    cache = LRUCache(maxsize=2, ttl=5)
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache.put(1, 'a')
+    now[0] += 4.9
+    assert cache.get(1) == 'a'
+    now[0] += 0.2
+    assert cache.get(1) is None
+    assert cache.stats()['size'] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = LRUCache(maxsize=0, ttl=60)
+    cache.put(1, 'a')
+    assert cache.get(1) is None
+
+
+def test_invalidate_removes_item():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.put(1, 'a')
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_stale_read_is_not_cached_after_invalidate():
+    # Чтение началось (token), запись изменила заявку, затем чтение кладет старое значение
+    cache = LRUCache(maxsize=2, ttl=60)
+    token = cache.token()
+    cache.invalidate(1)
+    cache.put(1, 'old', token)
+    assert cache.get(1) is None
+    # Чтение, начатое после инвалидации, кэшируется
+    cache.put(1, 'new', cache.token())
+    assert cache.get(1) == 'new'
+    # Инвалидация другого ключа не мешает
+    token = cache.token()
+    cache.invalidate(2)
+    cache.put(3, 'c', token)
+    assert cache.get(3) == 'c'
+
+
+def test_clear_rejects_reads_started_before_it():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.put(1, 'a')
+    token = cache.token()
+    cache.clear()
+    assert cache.get(1) is None
+    cache.put(2, 'b', token)
+    assert cache.get(2) is None
+
+
+def test_forgotten_invalidations_keep_a_floor():
+    # Старые отметки инвалидации забываются, но более ранние токены все равно отклоняются
+    cache = LRUCache(maxsize=2, ttl=60)
+    token = cache.token()
+    for key in range(20):
+        cache.invalidate(key)
+    cache.put(0, 'stale', token)
+    assert cache.get(0) is None
@@ -0,0 +1,35 @@
+from dedup import content_hash, normalize_text
+
+
+def test_normalize_casefold_and_whitespace():
+    assert normalize_text('  Привет \n\t МИР  ') == 'привет мир'
+    assert normalize_text('Straße') == 'strasse'
+
+
+def test_normalize_nfkc_and_invisible_characters():
+    # Полноширинные буквы, лигатура и zero-width символы
+    assert normalize_text('ＡＢＣ ﬁ') == 'abc fi'
+    assert normalize_text('при\u200bвет\u200d \ufeffмир') == 'привет мир'
+
+
+def test_normalize_empty():
+    assert normalize_text(None) == ''
+    assert normalize_text(' \u200b ') == ''
+
+
+def test_hash_ignores_formatting_differences():
+    assert content_hash('text', 'Привет  мир') == content_hash('text', 'привет\u200b мир ')
+    assert len(content_hash('text', 'привет')) == 32
+
+
+def test_hash_depends_on_type_and_text():
+    assert content_hash('text', 'привет') != content_hash('photo', 'привет')
+    assert content_hash('text', 'привет') != content_hash('text', 'пока')
+
+
+def test_hash_album_files_unordered():
+    assert content_hash('photo', 'подпись', ['a', 'b']) == content_hash('photo', 'подпись', ['b', 'a'])
+    assert content_hash('photo', 'подпись', ['a', 'b']) != content_hash('photo', 'подпись', ['a', 'c'])
+    assert content_hash('photo', 'подпись', ['a']) != content_hash('photo', 'подпись', ['a', 'a'])
+    # Файл без file_unique_id не ломает отпечаток
+    assert content_hash('photo', '', [None]) == content_hash('photo', '', [''])
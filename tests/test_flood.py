@@ -0,0 +1,111 @@
+import pytest
+
+from flood import FloodLimiter, parse_limits
+
+
+def limiter(clock, **kwargs):
+    kwargs.setdefault('limits', [(2, 10.0)])
+    kwargs.setdefault('penalty', 'cooldown')
+    kwargs.setdefault('cooldown', 5.0)
+    kwargs.setdefault('cooldown_max', 100.0)
+    return FloodLimiter(clock=clock, **kwargs)
+
+
+def test_parse_limits():
+    assert parse_limits('20/600, 5/10,5/10,,0/10,3/-1,abc') == [(5, 10.0), (20, 600.0)]
+
+
+def test_no_limits_allows_everything(clock):
+    flood = limiter(clock, limits=[])
+    for _ in range(100):
+        assert flood.check(1) == (True, False, 0.0)
+
+
+def test_sliding_window_drop(clock):
+    flood = limiter(clock, penalty='drop')
+    assert flood.check(1)[0]
+    clock.advance(1)
+    assert flood.check(1)[0]
+    allowed, notify, wait = flood.check(1)
+    assert (allowed, notify) == (False, False)
+    assert wait == pytest.approx(9.0)
+    # Другой пользователь не затронут
+    assert flood.check(2)[0]
+    clock.advance(9)
+    assert flood.check(1)[0]
+    assert flood.stats() == {'users': 2, 'allowed': 4, 'rejected': 1, 'evicted': 0}
+
+
+def test_cooldown_warns_once_and_doubles(clock):
+    flood = limiter(clock)
+    flood.check(1)
+    flood.check(1)
+    assert flood.check(1) == (False, True, 5.0)
+    clock.advance(1)
+    allowed, notify, wait = flood.check(1)
+    assert (allowed, notify) == (False, False)
+    assert wait == pytest.approx(4.0)
+
+    clock.advance(4)
+    # Окно еще заполнено: второе нарушение подряд — пауза вдвое длиннее
+    assert flood.check(1) == (False, True, 10.0)
+    clock.advance(10)
+    assert flood.check(1)[0]
+
+
+def test_cooldown_is_capped_and_strikes_forgotten(clock):
+    flood = limiter(clock, limits=[(1, 1000.0)], cooldown=40.0, cooldown_max=100.0)
+    flood.check(1)
+    waits = []
+    for _ in range(3):
+        waits.append(flood.check(1)[2])
+        clock.advance(waits[-1])
+    assert waits == [40.0, 80.0, 100.0]
+    # После cooldown_max без нарушений серия начинается заново
+    clock.advance(101)
+    assert flood.check(1)[2] == 40.0
+
+
+def test_album_follows_first_decision(clock):
+    flood = limiter(clock, penalty='drop')
+    assert flood.check(1, group_id='g1')[0]
+    for _ in range(5):
+        assert flood.check(1, group_id='g1')[0]
+    assert flood.check(1)[0]
+    assert not flood.check(1, group_id='g2')[0]
+    assert not flood.check(1, group_id='g2')[0]
+    # Весь альбом — одна принятая заявка
+    assert flood.stats()['allowed'] == 2
+
+
+def test_lift(clock):
+    flood = limiter(clock)
+    for _ in range(3):
+        flood.check(1)
+    assert flood.limited() == [(1, 1, 5.0)]
+    assert flood.lift(1)
+    assert not flood.lift(1)
+    assert flood.check(1)[0]
+    flood.check(2)
+    assert flood.lift_all() == 2
+
+
+def test_eviction_skips_limited_users(clock):
+    flood = limiter(clock, max_users=2)
+    for _ in range(3):
+        flood.check(1)
+    flood.check(2)
+    # Оба активны: лимит временно превышается, пауза пользователя 1 сохраняется
+    assert flood.check(3)[0]
+    assert flood.stats()['users'] == 3
+    assert not flood.check(1)[0]
+
+    clock.advance(60)
+    assert flood.check(4)[0]
+    stats = flood.stats()
+    assert stats['users'] == 2
+    assert stats['evicted'] == 2
+
+
+def test_unknown_penalty_falls_back_to_cooldown(clock):
+    assert limiter(clock, penalty='ban').penalty == 'cooldown'
@@ -0,0 +1,114 @@
+import sqlite3
+
+import migrations
+
+LATEST = migrations.MIGRATIONS[-1][0]
+
+# Схема до появления миграций (user_version = 0): таблицы создавал init_db в bot.py
+LEGACY_SCHEMA = '''
+    CREATE TABLE messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        user_name TEXT,
+        username TEXT,
+        message_text TEXT,
+        message_type TEXT,
+        file_id TEXT,
+        file_type TEXT,
+        timestamp TEXT,
+        status TEXT DEFAULT 'pending',
+        admin_reply TEXT DEFAULT NULL,
+        reply_sent BOOLEAN DEFAULT FALSE,
+        publish_type TEXT DEFAULT 'normal'
+    );
+    CREATE TABLE bot_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_type TEXT,
+        event_time TEXT,
+        details TEXT
+    );
+    CREATE TABLE bot_errors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        error_type TEXT,
+        error_message TEXT,
+        error_time TEXT,
+        resolved BOOLEAN DEFAULT FALSE
+    );
+'''
+
+LEGACY_MESSAGES = [
+    (10, 'text', 'привет', None, None, 'pending'),
+    (10, 'photo', None, 'p1', 'photo', 'approved'),
+    (20, 'photo', 'альбом', '["a1", "a2", "a3"]', '["photo", "video", "photo"]', 'pending'),
+    (30, 'video', None, '["v1", "v2"]', 'video', 'rejected'),
+]
+
+
+def tables(database):
+    return {row[0] for row in database.fetchall("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def columns(database, table):
+    return {row[1] for row in database.fetchall(f"PRAGMA table_info({table})")}
+
+
+def create_legacy(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany(
+        "INSERT INTO messages (user_id, message_type, message_text, file_id, file_type, status, timestamp) "
+        "VALUES (?, ?, ?, ?, ?, ?, '2024-01-01T00:00:00')",
+        LEGACY_MESSAGES
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_versions_are_sequential():
+    assert [version for version, _, _, _ in migrations.MIGRATIONS] == list(range(1, LATEST + 1))
+
+
+def test_migrate_empty_database(database):
+    assert migrations.get_version() == 0
+    assert migrations.migrate() == LATEST
+    assert {
+        'messages', 'bot_stats', 'bot_errors', 'stats_counters', 'stats_users', 'message_files',
+        'publish_jobs', 'event_rollups', 'maintenance_log', 'shared_state', 'submission_hashes',
+    } <= tables(database)
+    assert 'repeats' in columns(database, 'messages')
+    # Повторный запуск ничего не меняет
+    assert migrations.migrate() == LATEST
+
+
+def test_migrate_in_steps(database):
+    assert migrations.migrate(target=3) == 3
+    assert 'message_files' not in tables(database)
+    assert migrations.migrate() == LATEST
+
+
+def test_migrate_legacy_database(database):
+    create_legacy(database.DB_PATH)
+    assert migrations.migrate() == LATEST
+
+    rows = database.fetchall("SELECT id, file_id, file_type, repeats FROM messages ORDER BY id")
+    # У альбомов в messages остается первый файл, остальные — в message_files
+    assert rows == [(1, None, None, 0), (2, 'p1', 'photo', 0), (3, 'a1', 'photo', 0), (4, 'v1', 'video', 0)]
+    files = database.fetchall("SELECT message_id, position, file_id, media_type FROM message_files ORDER BY message_id, position")
+    assert files == [
+        (2, 0, 'p1', 'photo'),
+        (3, 0, 'a1', 'photo'), (3, 1, 'a2', 'video'), (3, 2, 'a3', 'photo'),
+        (4, 0, 'v1', 'video'), (4, 1, 'v2', 'video'),
+    ]
+
+    counters = dict(database.fetchall("SELECT name, value FROM stats_counters"))
+    assert counters['messages'] == 4
+    assert counters['unique_users'] == 3
+    assert counters['status:pending'] == 2
+
+
+def test_message_files_backfill_is_idempotent(database):
+    create_legacy(database.DB_PATH)
+    migrations.migrate(target=5)
+    # Повторный перенос (как после падения посреди online-миграции) не дублирует файлы
+    migrations.MIGRATIONS[4][3]()
+    assert database.fetchone("SELECT COUNT(*) FROM message_files")[0] == 6
@@ -0,0 +1,71 @@
+import pytest
+
+from outbound import TokenBucket, request_target
+
+
+# === TokenBucket ===
+def test_bucket_starts_full():
+    bucket = TokenBucket(rate=1.0, capacity=3, now=0.0)
+    assert bucket.wait_time(0.0) == 0.0
+    assert bucket.idle(0.0)
+
+
+def test_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, capacity=3, now=0.0)
+    bucket.take(3)
+    assert bucket.wait_time(0.0) == pytest.approx(0.5)
+    assert bucket.wait_time(0.25) == pytest.approx(0.25)
+    assert bucket.wait_time(0.5) == 0.0
+    assert not bucket.idle(0.5)
+    assert bucket.idle(1.5)
+
+
+def test_bucket_never_exceeds_capacity():
+    bucket = TokenBucket(rate=1.0, capacity=3, now=0.0)
+    bucket.wait_time(100.0)
+    assert bucket.tokens == 3
+
+
+def test_bucket_large_cost_waits_for_full_bucket_only():
+    # Альбом из 10 файлов при емкости 3 ждет полного ведра и уходит в минус
+    bucket = TokenBucket(rate=1.0, capacity=3, now=0.0)
+    bucket.take(1)
+    assert bucket.wait_time(0.0, cost=10) == pytest.approx(1.0)
+    bucket.take(10)
+    assert bucket.tokens == -8
+    assert bucket.wait_time(1.0) == pytest.approx(8.0)
+
+
+def test_bucket_block_delays_even_with_tokens():
+    bucket = TokenBucket(rate=1.0, capacity=3, now=0.0)
+    bucket.block(0.0, 5.0)
+    assert bucket.wait_time(1.0) == pytest.approx(4.0)
+    assert not bucket.idle(1.0)
+    # Более короткая пауза не сокращает уже назначенную
+    bucket.block(1.0, 1.0)
+    assert bucket.wait_time(1.0) == pytest.approx(4.0)
+    assert bucket.wait_time(5.0) == 0.0
+
+
+# === request_target ===
+def test_target_chat_id_is_first_positional_argument():
+    assert request_target('send_message', (123, 'текст'), {}) == (123, 1)
+
+
+def test_target_chat_id_from_kwargs():
+    assert request_target('send_photo', (), {'chat_id': '@channel', 'photo': 'f'}) == ('@channel', 1)
+
+
+def test_target_edit_message_text_takes_chat_id_second():
+    assert request_target('edit_message_text', ('новый текст', 55, 7), {}) == (55, 1)
+    assert request_target('edit_message_text', ('новый текст',), {'chat_id': 55, 'message_id': 7}) == (55, 1)
+
+
+def test_target_media_group_costs_one_token_per_file():
+    assert request_target('send_media_group', (-100, ['a', 'b', 'c']), {}) == (-100, 3)
+    assert request_target('send_media_group', (), {'chat_id': -100, 'media': ['a', 'b']}) == (-100, 2)
+    assert request_target('send_media_group', (-100, []), {}) == (-100, 1)
+
+
+def test_target_without_chat_id():
+    assert request_target('send_message', (), {}) == (None, 1)
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from pacing import Pacer, parse_slots
+
+
+def stamp(*args):
+    return datetime(*args).timestamp()
+
+
+def test_parse_slots_sorts_dedups_and_skips_invalid():
+    assert parse_slots('18:30, 09:00,09:00,,25:00,9:60,утро') == [(9, 0), (18, 30)]
+    assert parse_slots('') == []
+
+
+def test_disabled_pacer():
+    pacer = Pacer(interval=0, slots=[])
+    assert not pacer.enabled
+    assert pacer.next_release(100.0, 1, now=50.0) == 100.0
+    assert pacer.schedule(None, None, [1, 1], now=10.0) == [10.0, 10.0]
+    assert pacer.describe() == "без ограничений"
+
+
+def test_interval_scales_with_cost_of_last_release():
+    pacer = Pacer(interval=60, slots=[])
+    assert pacer.enabled
+    assert pacer.next_release(None, None, now=100.0) == 100.0
+    assert pacer.next_release(100.0, 3, now=110.0) == 280.0
+    # Стоимость 0 или None считается за одно сообщение
+    assert pacer.next_release(100.0, 0, now=110.0) == 160.0
+
+
+def test_interval_schedule():
+    pacer = Pacer(interval=10, slots=[])
+    assert pacer.schedule(None, None, [1, 2, 1], now=0.0) == [0.0, 10.0, 30.0]
+    # Давно ничего не выходило: первая публикация — сразу
+    assert pacer.schedule(0.0, 1, [1, 1], now=100.0) == [100.0, 110.0]
+
+
+def test_next_slot_is_strictly_later():
+    pacer = Pacer(interval=0, slots=[(9, 0), (18, 30)])
+    assert pacer.next_slot(stamp(2026, 1, 1, 10, 0)) == stamp(2026, 1, 1, 18, 30)
+    assert pacer.next_slot(stamp(2026, 1, 1, 9, 0)) == stamp(2026, 1, 1, 18, 30)
+    assert pacer.next_slot(stamp(2026, 1, 1, 19, 0)) == stamp(2026, 1, 2, 9, 0)
+
+
+def test_slot_schedule_uses_one_slot_per_release():
+    pacer = Pacer(interval=0, slots=[(9, 0), (18, 30)])
+    now = stamp(2026, 1, 1, 8, 0)
+    assert pacer.schedule(None, None, [1, 3, 1], now) == [
+        stamp(2026, 1, 1, 9, 0),
+        stamp(2026, 1, 1, 18, 30),
+        stamp(2026, 1, 2, 9, 0),
+    ]
+    assert pacer.describe() == "слоты 09:00, 18:30"
@@ -0,0 +1,229 @@
+import os
+import time
+import random
+import logging
+import cProfile
+import threading
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# === ТРАССИРОВКА ОБНОВЛЕНИЙ ===
+# Обработка обновления (обработчик, сборка альбома, задача публикации) — корень
+# трассы, каждый запрос к SQLite и Bot API внутри нее — вложенный span. Текущий
+# span лежит в ContextVar: в потоках и задачах asyncio у каждого свой, а запросы
+# к БД из async-движка уходят в пул потоков вместе с контекстом (bot_async.run_db).
+# Работа, переданная в другие пулы (уведомления админам, групповая запись),
+# в трассу обновления не попадает — видна только постановка в очередь.
+# Трассы дольше TRACE_SLOW_MS попадают в кольцевой буфер на TRACE_KEEP штук
+# (команда /slow). При PROFILE_SAMPLE_RATE > 0 такая доля обновлений выполняется
+# под cProfile, результат пишется в DATA_DIR/profiles/*.pstats
+# (последние PROFILE_KEEP файлов; только для потокового движка).
+
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', '1000'))
+TRACE_KEEP = int(os.environ.get('TRACE_KEEP', '50'))
+TRACE_MAX_SPANS = 200
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '50'))
+
+PROFILE_DIR = None
+
+_current = ContextVar('trace_span', default=None)
+_profile_lock = threading.Lock()
+
+slow_traces = deque(maxlen=TRACE_KEEP)
+
+
+def configure(data_dir):
+    global PROFILE_DIR
+    PROFILE_DIR = os.path.join(data_dir, 'profiles')
+
+
+class Span:
+    __slots__ = ('name', 'trace', 'started', 'duration', 'children', 'error')
+
+    def __init__(self, name, trace):
+        self.name = name
+        self.trace = trace
+        self.started = time.perf_counter()
+        self.duration = None
+        self.children = []
+        self.error = None
+
+
+class Trace:
+    __slots__ = ('name', 'detail', 'started_at', 'root', 'spans', 'profile')
+
+    def __init__(self, name, detail):
+        self.name = name
+        self.detail = detail
+        self.started_at = datetime.now()
+        self.spans = 1
+        self.profile = None
+        self.root = Span(name, self)
+
+    @property
+    def duration(self):
+        return self.root.duration
+
+
+class _SpanContext:
+    __slots__ = ('name', 'label', 'span', 'token')
+
+    def __init__(self, name, label):
+        self.name = name
+        self.label = label
+
+    def __enter__(self):
+        parent = _current.get()
+        trace = parent.trace
+        if trace.spans >= TRACE_MAX_SPANS:
+            self.span = None
+            return self
+        name = self.name if self.label is None else f"{self.name}.{self.label}"
+        self.span = Span(name, trace)
+        trace.spans += 1
+        parent.children.append(self.span)
+        self.token = _current.set(self.span)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is None:
+            return
+        self.span.duration = time.perf_counter() - self.span.started
+        if exc is not None:
+            self.span.error = type(exc).__name__
+        _current.reset(self.token)
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _Noop()
+
+
+def span(name, label=None):
+    # Вне трассы — пустой контекст без аллокаций
+    if _current.get() is None:
+        return _NOOP
+    return _SpanContext(name, label)
+
+
+class _TraceContext:
+    __slots__ = ('trace', 'token', 'profiler')
+
+    def __init__(self, name, detail, profile):
+        self.trace = Trace(name, detail)
+        self.profiler = None
+        if profile and PROFILE_SAMPLE_RATE > 0 and PROFILE_DIR and random.random() < PROFILE_SAMPLE_RATE:
+            self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.token = _current.set(self.trace.root)
+        if self.profiler is not None:
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Профилировщик уже активен (вложенная трасса или другой инструмент)
+                self.profiler = None
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        root = self.trace.root
+        root.duration = time.perf_counter() - root.started
+        if exc is not None:
+            root.error = type(exc).__name__
+        _current.reset(self.token)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.trace.profile = save_profile(self.profiler, self.trace)
+        finish(self.trace)
+        return False
+
+
+def trace(name, detail='', profile=False):
+    # Внутри уже идущей трассы — обычный span
+    if _current.get() is not None:
+        return span(name)
+    if TRACE_SLOW_MS <= 0:
+        return _NOOP
+    return _TraceContext(name, detail, profile)
+
+
+def traced(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace(name, profile=True):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finish(trace):
+    if trace.duration * 1000 < TRACE_SLOW_MS:
+        return
+    slow_traces.append(trace)
+    logger.warning(f"🐢 Медленное обновление: {trace.name} {trace.detail} — {trace.duration * 1000:.0f} мс")
+
+
+def save_profile(profiler, trace):
+    with _profile_lock:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{trace.started_at:%Y%m%d-%H%M%S-%f}-{trace.name}.pstats")
+            profiler.dump_stats(path)
+            files = sorted(os.listdir(PROFILE_DIR))
+            for old in (files[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []):
+                os.remove(os.path.join(PROFILE_DIR, old))
+            return path
+        except OSError as e:
+            logger.error(f"❌ Ошибка записи профиля: {e}")
+            return None
+
+
+# === ОТЧЕТ /slow ===
+def _span_lines(span, depth, lines):
+    # Подряд идущие одноименные листья сворачиваются: "db.fetchone ×3"
+    children = span.children
+    i = 0
+    while i < len(children):
+        child = children[i]
+        j = i + 1
+        if not child.children:
+            while j < len(children) and children[j].name == child.name and not children[j].children:
+                j += 1
+        group = children[i:j]
+        total = sum(item.duration or 0 for item in group)
+        count = f" ×{len(group)}" if len(group) > 1 else ""
+        error = " ⚠️" + child.error if child.error else ""
+        pending = "" if all(item.duration is not None for item in group) else " (не завершен)"
+        lines.append(f"{'  ' * depth}{child.name}{count} {total * 1000:.1f} мс{error}{pending}")
+        if len(group) == 1:
+            _span_lines(child, depth + 1, lines)
+        i = j
+
+
+def format_trace(trace):
+    lines = [f"{trace.started_at:%H:%M:%S} {trace.name} {trace.detail} — {trace.duration * 1000:.0f} мс"]
+    _span_lines(trace.root, 1, lines)
+    if trace.spans >= TRACE_MAX_SPANS:
+        lines.append(f"  … только первые {TRACE_MAX_SPANS} spans")
+    if trace.profile:
+        lines.append(f"  профиль: {os.path.basename(trace.profile)}")
+    return "\n".join(lines)
+
+
+def slow_report(limit=5):
+    traces = list(slow_traces)[-limit:]
+    return [format_trace(trace) for trace in reversed(traces)]
@@ -0,0 +1,102 @@
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# === ПУЛ ПОТОКОВ С ПОРЯДКОМ ПО КЛЮЧУ ===
+# Задачи с одинаковым ключом (например, id админа) всегда попадают в один
+# и тот же поток и выполняются строго по очереди, разные ключи — параллельно.
+# Очереди ограничены: при переполнении submit ждёт, а не копит память.
+# Пока пул не запущен (или уже остановлен), submit выполняет задачу сразу
+# в вызывающем потоке, а offer отказывает.
+
+_STOP = object()
+
+
+class KeyedExecutor:
+    def __init__(self, workers, name, max_queue=1000):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._queues = []
+        self._threads = []
+        self._lock = threading.Lock()
+        self._accepting = False
+
+    @property
+    def running(self):
+        return self._accepting
+
+    def start(self):
+        with self._lock:
+            if self._accepting:
+                return
+            self._queues = [queue.Queue(self.max_queue) for _ in range(self.workers)]
+            self._threads = [
+                threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}", daemon=True)
+                for i, q in enumerate(self._queues)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._accepting = True
+        logger.info(f"🧵 Пул '{self.name}' запущен: {self.workers} потоков")
+
+    def submit(self, key, func, *args, **kwargs):
+        with self._lock:
+            if self._accepting:
+                target = self._queues[hash(key) % self.workers]
+            else:
+                target = None
+        if target is None:
+            self._call(func, args, kwargs)
+        else:
+            target.put((func, args, kwargs))
+
+    def offer(self, key, func, *args, **kwargs):
+        # Неблокирующий вариант submit: False, если очередь потока заполнена
+        with self._lock:
+            if not self._accepting:
+                return False
+            target = self._queues[hash(key) % self.workers]
+        try:
+            target.put_nowait((func, args, kwargs))
+        except queue.Full:
+            return False
+        return True
+
+    def pending(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stop(self, timeout=30):
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+        for q in self._queues:
+            q.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        # Задачи, попавшие в очередь уже после сигнала остановки, выполняем здесь
+        for q in self._queues:
+            while True:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    self._call(*item)
+        logger.info(f"🧵 Пул '{self.name}' остановлен")
+
+    def _call(self, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"❌ Ошибка задачи в пуле '{self.name}': {e}")
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is _STOP:
+                return
+            self._call(*item)